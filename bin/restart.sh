@@ -1,7 +1,11 @@
 #!/bin/bash
 
+RQ_DEFAULT_WORKERS=${RQ_DEFAULT_WORKERS:-4}
+
 cd $HOME/arielinstaller/
 . .env/bin/activate
 gunicorn -b 0.0.0.0:8001 config.wsgi --daemon
-nohup python manage.py rqworker default low &
-nohup python manage.py rqscheduler &
\ No newline at end of file
+for i in $(seq 1 $RQ_DEFAULT_WORKERS); do
+  nohup python manage.py rqworker default low &
+done
+nohup python manage.py rqscheduler &
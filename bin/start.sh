@@ -1,8 +1,12 @@
 #!/bin/bash
 
+RQ_DEFAULT_WORKERS=${RQ_DEFAULT_WORKERS:-4}
+
 python manage.py migrate
 python manage.py flushqueue --queue default
 python manage.py flushqueue --queue low
-python manage.py rqworker -v 3 default &
+for i in $(seq 1 $RQ_DEFAULT_WORKERS); do
+  python manage.py rqworker -v 3 default &
+done
 python manage.py rqworker -v 3 low &
 python manage.py runserver 8000 &
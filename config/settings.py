@@ -246,3 +246,72 @@ RQ_EXCEPTION_HANDLERS = []
 CREATE_VIRTUAL_ENV = os.environ.get('CREATE_VIRTUAL_ENV', True)
 value_to_bool = lambda v: v.lower() in ("yes", "true", "t", "1", "y") if isinstance(v, str) else v in (1,)
 CREATE_VIRTUAL_ENV = value_to_bool(CREATE_VIRTUAL_ENV)
+
+# Git polling
+GIT_FETCH_MAX_WORKERS = int(os.environ.get('GIT_FETCH_MAX_WORKERS', 16))
+GIT_FETCH_MAX_WORKERS_PER_HOST = int(os.environ.get('GIT_FETCH_MAX_WORKERS_PER_HOST', 4))
+
+# GitHub push webhooks. With the secret set the polling becomes a slow reconciliation fallback
+GITHUB_WEBHOOK_SECRET = os.environ.get('GITHUB_WEBHOOK_SECRET', '')
+CHECK_NEW_COMMITS_INTERVAL = int(os.environ.get('CHECK_NEW_COMMITS_INTERVAL', 900 if GITHUB_WEBHOOK_SECRET else 60))
+
+# Application liveness. The listening ports are read from /proc/net at most once per this number of seconds
+LISTENING_PORTS_SNAPSHOT_MAX_AGE = float(os.environ.get('LISTENING_PORTS_SNAPSHOT_MAX_AGE', 2))
+PROJECT_STATUS_CACHE_TTL = int(os.environ.get('PROJECT_STATUS_CACHE_TTL', 300))
+
+# Virtual envs cache, the envs are shared by the projects with the same requirements.txt
+VIRTUAL_ENVS_DIR = f'{GIT_REPOS_DIR}/.venvs'
+VIRTUAL_ENVS_DISK_BUDGET = int(os.environ.get('VIRTUAL_ENVS_DISK_BUDGET', 20 * 1024 ** 3))  # bytes
+
+# Wheels shared by the pip installs of all the projects
+WHEELHOUSE_DIR = f'{GIT_REPOS_DIR}/.wheelhouse'
+WHEELHOUSE_DISK_BUDGET = int(os.environ.get('WHEELHOUSE_DISK_BUDGET', 10 * 1024 ** 3))  # bytes
+
+# Blue/green deploys: the new release starts beside the running one, which is retired when the new one is ready
+BLUE_GREEN_DEPLOYS = value_to_bool(os.environ.get('BLUE_GREEN_DEPLOYS', True))
+DEPLOY_READINESS_TIMEOUT = int(os.environ.get('DEPLOY_READINESS_TIMEOUT', 300))  # seconds
+
+# Seconds the stopped application has to exit before it is killed
+APPLICATION_STOP_TIMEOUT = int(os.environ.get('APPLICATION_STOP_TIMEOUT', 30))
+
+# The deploys, starts, stops and rollbacks of a project are serialized by a Redis lock expiring after the timeout
+PROJECT_LOCK_TIMEOUT = int(os.environ.get('PROJECT_LOCK_TIMEOUT', 60 * 60))  # seconds
+
+# Live log tail over Server-Sent Events, every tailer holds a web worker thread
+LOG_TAIL_MAX_CLIENTS = int(os.environ.get('LOG_TAIL_MAX_CLIENTS', 10))
+LOG_TAIL_POLL_INTERVAL = float(os.environ.get('LOG_TAIL_POLL_INTERVAL', 0.5))  # seconds
+LOG_TAIL_MAX_DURATION = int(os.environ.get('LOG_TAIL_MAX_DURATION', 600))  # seconds, the browser reconnects
+LOG_TAIL_STALE_AFTER = int(os.environ.get('LOG_TAIL_STALE_AFTER', 60))  # seconds without a heartbeat
+
+# Project logs rotation into gzip archives under logs/archive
+LOG_ROTATE_MAX_SIZE = int(os.environ.get('LOG_ROTATE_MAX_SIZE', 100 * 1024 ** 2))  # bytes
+LOG_ROTATE_INTERVAL = int(os.environ.get('LOG_ROTATE_INTERVAL', 24 * 60 * 60))  # seconds
+LOG_ARCHIVE_RETENTION = int(os.environ.get('LOG_ARCHIVE_RETENTION', 30 * 24 * 60 * 60))  # seconds
+LOG_ARCHIVE_MAX_SIZE = int(os.environ.get('LOG_ARCHIVE_MAX_SIZE', 1024 ** 3))  # bytes per project
+LOG_ROTATE_CHECK_INTERVAL = int(os.environ.get('LOG_ROTATE_CHECK_INTERVAL', 5 * 60))  # seconds
+
+# Incremental analytics of the project logs
+LOG_ANALYSIS_INTERVAL = int(os.environ.get('LOG_ANALYSIS_INTERVAL', 60))  # seconds
+LOG_ANALYSIS_MAX_BYTES = int(os.environ.get('LOG_ANALYSIS_MAX_BYTES', 64 * 1024 ** 2))  # per log and run
+TRAFFIC_RETENTION = int(os.environ.get('TRAFFIC_RETENTION', 24 * 60 * 60))  # seconds
+TRACEBACK_GROUPS_RETENTION = int(os.environ.get('TRACEBACK_GROUPS_RETENTION', 30 * 24 * 60 * 60))  # seconds
+
+# Shallow and partial clones of the projects, the projects may override them. 0 and empty - the full clone
+GIT_CLONE_DEPTH = int(os.environ.get('GIT_CLONE_DEPTH', 0))
+GIT_CLONE_FILTER = os.environ.get('GIT_CLONE_FILTER', '')
+
+# Projects of the same family, e.g. the forks of one template, borrow the git objects of a shared reference repo
+GIT_SHARED_OBJECTS = value_to_bool(os.environ.get('GIT_SHARED_OBJECTS', True))
+GIT_REFERENCES_DIR = f'{GIT_REPOS_DIR}/.references'
+GIT_GC_INTERVAL = int(os.environ.get('GIT_GC_INTERVAL', 24 * 60 * 60))  # seconds
+
+# Deployments kept in the history of every project
+DEPLOYMENT_HISTORY_SIZE = int(os.environ.get('DEPLOYMENT_HISTORY_SIZE', 500))
+
+# The projects run in the release dirs addressed by commit, the last GIT_RELEASES_KEEP ones are kept for the rollback
+GIT_RELEASES = value_to_bool(os.environ.get('GIT_RELEASES', True))
+GIT_RELEASES_DIR = f'{GIT_REPOS_DIR}/.releases'
+GIT_RELEASES_KEEP = int(os.environ.get('GIT_RELEASES_KEEP', 5))
+
+# The bearer token of the /metrics scrape, empty serves the loopback clients only
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
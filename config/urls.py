@@ -24,6 +24,7 @@ from django.urls import path, include
 
 from hijack import urls as hijack_urls
 from github import urls as github_urls
+from github.views import AIMetricsView
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 
 urlpatterns = [
@@ -32,6 +33,7 @@ urlpatterns = [
                   path('github/', include(github_urls, namespace="github")),
                   path('django-rq/', include('django_rq.urls')),
                   path('scheduler/', include('scheduler.urls')),
+                  path('metrics', AIMetricsView.as_view(), name='metrics'),
               ] + staticfiles_urlpatterns()
 
 admin.site.site_header = settings.PROJECT_TITLE
@@ -2,38 +2,256 @@ from __future__ import unicode_literals
 
 __author__ = 'David Baum'
 
-import os
+import functools
 
 from django.contrib import admin, messages
-from django.http import HttpResponseRedirect, HttpResponse
+from django.contrib.admin.options import IS_POPUP_VAR
+from django.http import Http404, HttpResponseRedirect, JsonResponse
+from django.template.response import TemplateResponse
 from django.urls import path, reverse
 from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
 
-from .models import AIGitHubProject
-from .utils import RepoTools, AIApplicationRunner
+from .analytics import AITrafficStore
+from .deployments import AIDeploymentTrigger, AIDeploymentOutcome, AIDeploymentStats
+from .logs import serve_log_file
+from .liveness import get_listening_ports_snapshot
+from .models import AIGitHubProject, AIDeployment
+from .provisioning import AIProvisioningState, AICloneProgress, AIProjectNotReadyError
+from .releases import AIReleaseError
+from .rotation import AILogRotator
+from .readiness import AIReadinessResult
+from .status import AIProjectStatusCache
+from .supervisor import AIProjectLock, AIProjectLockedError
+from .tracebacks import AITracebackGroups
+from .transfers import AITransferMetrics
+from .utils import AIApplicationRunner
+from utils.jobs.scheduler import enqueue_clone_project
 
 
 @admin.register(AIGitHubProject)
 class AIGitHubProjectAdmin(admin.ModelAdmin):
-    list_display = ['name', 'description', 'url', 'has_ssh_key',
-                    'is_application_running', 'has_last_error', 'last_error', 'port', 'project_actions',
-                    'last_commit']
+    DEPLOYMENTS_PAGE_SIZE = 50
+    # Seconds the admin waits for the deploy or the health restart of the project to finish
+    PROJECT_LOCK_WAIT = 5
+    list_display = ['name', 'description', 'url', 'has_ssh_key', 'provisioning',
+                    'is_application_running', 'status_probed_at', 'has_last_error', 'last_error', 'port',
+                    'project_actions', 'last_commit', 'last_deploy_plan', 'recent_traffic', 'crashes']
+    readonly_fields = ['provisioning_state', 'last_deploy_plan', 'last_deploy_plan_reason']
 
     def has_last_error(self, obj) -> bool:
         if obj.last_error:
             return True
         return False
 
+    def get_changelist_instance(self, request):
+        changelist = super().get_changelist_instance(request)
+        # Read the statuses, the traffic and the crashes of the whole page in one Redis round-trip each
+        projects = list(changelist.result_list)
+        statuses = AIProjectStatusCache().get_many([obj.pk for obj in projects])
+        missing_projects = [obj for obj in projects if obj.pk not in statuses]
+        if missing_projects:
+            statuses.update(AIProjectStatusCache().refresh(missing_projects, get_listening_ports_snapshot()))
+        crash_summaries = AITracebackGroups().get_summaries([obj.pk for obj in projects])
+        traffic_summaries = AITrafficStore().get_summaries([obj.pk for obj in projects], minutes=15)
+        for obj in projects:
+            obj.cached_status = statuses.get(obj.pk)
+            obj.crash_summary = crash_summaries.get(obj.pk, (0, 0))
+            obj.traffic_summary = traffic_summaries.get(obj.pk)
+        return changelist
+
+    def get_status(self, obj):
+        status = getattr(obj, 'cached_status', None)
+        if status is None:
+            status = AIProjectStatusCache().get(obj.pk)
+        if status is None:
+            status = AIProjectStatusCache().refresh([obj], get_listening_ports_snapshot())[obj.pk]
+        obj.cached_status = status
+        return status
+
     def is_application_running(self, obj) -> bool:
-        return AIApplicationRunner(obj).is_application_running()
+        return self.get_status(obj).is_running
+
+    def status_probed_at(self, obj):
+        return self.get_status(obj).probed_at_datetime
+
+    def provisioning(self, obj):
+        meta = self.model._meta
+        reversed_provisioning_url = reverse(f'admin:{meta.app_label}_{meta.model_name}_provisioning', args=[obj.pk])
+        percentage = AICloneProgress(obj.pk).get().get('percentage')
+        if obj.provisioning_state == AIProvisioningState.CLONING and percentage is not None:
+            return format_html('<a href="{}">{} {}%</a>', reversed_provisioning_url, obj.provisioning_state,
+                               percentage)
+        return format_html('<a href="{}">{}</a>', reversed_provisioning_url, obj.provisioning_state)
+
+    def provisioning_page(self, request, project_id, *args, **kwargs):
+        obj = self.model.objects.get(pk=project_id)
+        meta = self.model._meta
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': meta,
+            'original': obj,
+            'title': _('Provisioning of %(name)s') % {'name': obj.name},
+            'progress_url': reverse(f'admin:{meta.app_label}_{meta.model_name}_provisioning_progress',
+                                    args=[obj.pk]),
+            'transfers': AITransferMetrics().get_recent(obj.pk, limit=20),
+        }
+        return TemplateResponse(request, 'admin/github/aigithubproject/provisioning.html', context)
+
+    def ready_project_view(self, view):
+        """Show the provisioning page instead of the view needing the repo of the project which is not cloned."""
+        @functools.wraps(view)
+        def wrapper(request, project_id, *args, **kwargs):
+            try:
+                return view(request, project_id, *args, **kwargs)
+            except AIProjectNotReadyError as e:
+                messages.add_message(request, messages.WARNING, str(e))
+                meta = self.model._meta
+                return HttpResponseRedirect(reverse(f'admin:{meta.app_label}_{meta.model_name}_provisioning',
+                                                    args=[project_id]))
+        return wrapper
+
+    def provisioning_progress(self, request, project_id, *args, **kwargs):
+        obj = self.model.objects.filter(pk=project_id).only('provisioning_state', 'last_error').first()
+        if obj is None:
+            raise Http404
+        progress = AICloneProgress(obj.pk).get()
+        return JsonResponse({
+            **progress,
+            'state': obj.provisioning_state,
+            'error': obj.last_error if obj.provisioning_state == AIProvisioningState.FAILED else '',
+        })
+
+    def response_add(self, request, obj, post_url_continue=None):
+        if '_addanother' in request.POST or '_continue' in request.POST or IS_POPUP_VAR in request.POST:
+            return super().response_add(request, obj, post_url_continue)
+        meta = self.model._meta
+        return HttpResponseRedirect(reverse(f'admin:{meta.app_label}_{meta.model_name}_provisioning',
+                                            args=[obj.pk]))
+
+    def recent_traffic(self, obj):
+        summary = getattr(obj, 'traffic_summary', None) or AITrafficStore().get_summary(obj.pk, minutes=15)
+        meta = self.model._meta
+        reversed_traffic_url = reverse(f'admin:{meta.app_label}_{meta.model_name}_traffic', args=[obj.pk])
+        return format_html('<a href="{}">{} req, {} 5xx, p95 {}</a>', reversed_traffic_url, summary.requests,
+                           summary.count_status_class('5'), summary.format_percentile(95))
+
+    def crashes(self, obj):
+        summary = getattr(obj, 'crash_summary', None)
+        groups_number, occurrences = summary if summary is not None else AITracebackGroups().get_summary(obj.pk)
+        if not groups_number:
+            return '-'
+        meta = self.model._meta
+        reversed_tracebacks_url = reverse(f'admin:{meta.app_label}_{meta.model_name}_tracebacks', args=[obj.pk])
+        return format_html('<a href="{}">{} distinct, {} occurrences</a>', reversed_tracebacks_url, groups_number,
+                           occurrences)
+
+    def tracebacks(self, request, project_id, *args, **kwargs):
+        obj = self.model.objects.get(pk=project_id)
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'original': obj,
+            'title': _('Crashes of %(name)s') % {'name': obj.name},
+            'groups': AITracebackGroups().get_groups(obj.pk),
+        }
+        return TemplateResponse(request, 'admin/github/aigithubproject/tracebacks.html', context)
+
+    def deployments(self, request, project_id, *args, **kwargs):
+        obj = self.model.objects.get(pk=project_id)
+        history = list(obj.deployments.all()[:self.DEPLOYMENTS_PAGE_SIZE])
+        # The skipped deployments did not run any phase and would pull the percentiles down
+        measured = obj.deployments.filter(
+            outcome__in=[AIDeploymentOutcome.SUCCEEDED, AIDeploymentOutcome.FAILED]).only(
+            'duration', 'kill_duration', 'venv_duration', 'pip_duration', 'boot_duration', 'ready_duration')
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'original': obj,
+            'title': _('Deployments of %(name)s') % {'name': obj.name},
+            'stats': AIDeploymentStats(measured).get_rows(),
+            'percentiles': AIDeploymentStats.PERCENTILES,
+            'history': history,
+        }
+        return TemplateResponse(request, 'admin/github/aigithubproject/deployments.html', context)
+
+    def releases(self, request, project_id, *args, **kwargs):
+        obj = self.model.objects.get(pk=project_id)
+        runner = AIApplicationRunner(obj)
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'original': obj,
+            'title': _('Releases of %(name)s') % {'name': obj.name},
+            'releases': runner.releases.get_releases() if runner.releases else [],
+            'is_enabled': bool(runner.releases),
+        }
+        return TemplateResponse(request, 'admin/github/aigithubproject/releases.html', context)
+
+    def rollback_release(self, request, project_id, commit, *args, **kwargs):
+        obj = self.model.objects.get(pk=project_id)
+        obj.last_error = None
+
+        try:
+            with AIProjectLock(obj.pk, blocking_timeout=self.PROJECT_LOCK_WAIT):
+                readiness = AIApplicationRunner(obj).rollback(commit)
+        except (AIReleaseError, AIProjectLockedError) as e:
+            messages.add_message(request, messages.WARNING, _('The release was not rolled back: %(error)s') % {
+                'error': e})
+        else:
+            if readiness:
+                messages.add_message(request, messages.SUCCESS,
+                                     _('Rolled back to %(commit)s in %(duration).2f seconds') % {
+                                         'commit': commit[:8], 'duration': readiness.duration})
+            else:
+                messages.add_message(request, messages.WARNING,
+                                     _('The release %(commit)s was not started: %(error)s') % {
+                                         'commit': commit[:8], 'error': readiness.error})
+
+        meta = self.model._meta
+        return HttpResponseRedirect(reverse(f'admin:{meta.app_label}_{meta.model_name}_releases', args=[obj.pk]))
+
+    def traffic(self, request, project_id, *args, **kwargs):
+        obj = self.model.objects.get(pk=project_id)
+        buckets = AITrafficStore().get_buckets(obj.pk, minutes=60)
+        rows = [{
+            'started_at': bucket.started_at,
+            'requests': bucket.requests,
+            'status_classes': [bucket.count_status_class(status_class) for status_class in '2345'],
+            'mean': bucket.mean_response_time,
+            'p50': bucket.format_percentile(50),
+            'p95': bucket.format_percentile(95),
+            'p99': bucket.format_percentile(99),
+        } for bucket in reversed(buckets)]
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'original': obj,
+            'title': _('Traffic of %(name)s') % {'name': obj.name},
+            'rows': rows,
+        }
+        return TemplateResponse(request, 'admin/github/aigithubproject/traffic.html', context)
+
+    def refresh_status(self, request, queryset):
+        AIProjectStatusCache().refresh(queryset)
+        messages.add_message(request, messages.SUCCESS, _('The project statuses have been refreshed'))
+
+    def refresh_project_status(self, request, project_id, *args, **kwargs):
+        AIProjectStatusCache().refresh(self.model.objects.filter(pk=project_id))
+
+        meta = self.model._meta
+        return HttpResponseRedirect(
+            reverse(
+                f"admin:{meta.app_label}_{meta.model_name}_changelist"
+            )
+        )
 
     def git_pull_from_repo(self, request, queryset):
-        queryset.update(task_id=None)
+        # Cloned again by the background job, the failed projects included
+        queryset.update(provisioning_state=AIProvisioningState.PENDING)
         for qs in queryset:
-            repo_tools = RepoTools(project=qs)
-            repo_tools.pygit2_clone_repo()
-            qs.save()
+            enqueue_clone_project(qs.pk)
+        messages.add_message(request, messages.SUCCESS, _('The projects have been queued for the git pull'))
 
     def has_ssh_key(self, obj):
         return True if obj.ssh_key else False
@@ -43,7 +261,11 @@ class AIGitHubProjectAdmin(admin.ModelAdmin):
         obj.last_error = None
 
         runner = AIApplicationRunner(obj)
-        runner.kill_application()
+        try:
+            with AIProjectLock(obj.pk, blocking_timeout=self.PROJECT_LOCK_WAIT):
+                runner.kill_application()
+        except AIProjectLockedError as e:
+            obj.last_error = str(e)
 
         if not obj.last_error:
             messages.add_message(request, messages.SUCCESS,
@@ -64,14 +286,19 @@ class AIGitHubProjectAdmin(admin.ModelAdmin):
         obj.last_error = None
 
         runner = AIApplicationRunner(obj)
-        runner.run()
+        try:
+            with AIProjectLock(obj.pk, blocking_timeout=self.PROJECT_LOCK_WAIT):
+                readiness = runner.run(trigger=AIDeploymentTrigger.ADMIN)
+        except AIProjectLockedError as e:
+            readiness = AIReadinessResult(False, 0, error=str(e))
 
-        if not obj.last_error:
+        if readiness:
             messages.add_message(request, messages.SUCCESS,
-                                 _('The application has been successfully started'))
+                                 _('The application has been successfully started in %(duration).2f seconds') % {
+                                     'duration': readiness.duration})
         else:
             messages.add_message(request, messages.WARNING,
-                                 _('The application was not started'))
+                                 _('The application was not started: %(error)s') % {'error': readiness.error})
 
         meta = self.model._meta
         return HttpResponseRedirect(
@@ -82,9 +309,15 @@ class AIGitHubProjectAdmin(admin.ModelAdmin):
 
     def project_actions(self, obj):
         meta = self.model._meta
+        if not obj.is_ready:
+            reversed_provisioning_url = reverse(f'admin:{meta.app_label}_{meta.model_name}_provisioning',
+                                                args=[obj.pk])
+            return format_html(f'<div class="button"><a style="color: white" href="{reversed_provisioning_url}">Provisioning</a></div><br/>')
         is_running = self.is_application_running(obj)
         reversed_stop_url = reverse(f'admin:{meta.app_label}_{meta.model_name}_stop_application', args=[obj.pk])
         reversed_restart_url = reverse(f'admin:{meta.app_label}_{meta.model_name}_start_application', args=[obj.pk])
+        reversed_refresh_status_url = reverse(f'admin:{meta.app_label}_{meta.model_name}_refresh_status',
+                                              args=[obj.pk])
         reversed_download_access_logs_url = reverse(f'admin:{meta.app_label}_{meta.model_name}_download_access_logs',
                                                     args=[obj.pk])
         reversed_download_error_logs_url = reverse(f'admin:{meta.app_label}_{meta.model_name}_download_error_logs',
@@ -93,12 +326,23 @@ class AIGitHubProjectAdmin(admin.ModelAdmin):
                                                 args=[obj.pk])
         reversed_read_error_logs_url = reverse(f'github:read_error_logs',
                                                 args=[obj.pk])
+        reversed_log_archives_url = reverse(f'admin:{meta.app_label}_{meta.model_name}_log_archives', args=[obj.pk])
+        reversed_deployments_url = reverse(f'admin:{meta.app_label}_{meta.model_name}_deployments', args=[obj.pk])
+        reversed_releases_url = reverse(f'admin:{meta.app_label}_{meta.model_name}_releases', args=[obj.pk])
+        reversed_tail_access_logs_url = reverse(f'github:tail_logs', args=[obj.pk, 'access'])
+        reversed_tail_error_logs_url = reverse(f'github:tail_logs', args=[obj.pk, 'error'])
         buttons = [
             f'<div class="button"><a style="color: white" href="{reversed_restart_url}">{"Restart" if is_running else "Start"}</a></div><br/>',
             f'<div class="button"><a style="color: white" href="{reversed_download_access_logs_url}">Download Access Logs</a></div><br/>',
             f'<div class="button"><a style="color: white" href="{reversed_download_error_logs_url}">Download Error Logs</a></div><br/>',
             f'<div class="button"><a style="color: white" href="{reversed_read_error_logs_url}" target="_blank">Read Error Logs</a></div><br/>',
-            f'<div class="button"><a style="color: white" href="{reversed_read_access_logs_url}" target="_blank">Read Access Logs</a></div><br/>'
+            f'<div class="button"><a style="color: white" href="{reversed_read_access_logs_url}" target="_blank">Read Access Logs</a></div><br/>',
+            f'<div class="button"><a style="color: white" href="{reversed_tail_error_logs_url}" target="_blank">Live Error Logs</a></div><br/>',
+            f'<div class="button"><a style="color: white" href="{reversed_tail_access_logs_url}" target="_blank">Live Access Logs</a></div><br/>',
+            f'<div class="button"><a style="color: white" href="{reversed_log_archives_url}">Log Archives</a></div><br/>',
+            f'<div class="button"><a style="color: white" href="{reversed_deployments_url}">Deployments</a></div><br/>',
+            f'<div class="button"><a style="color: white" href="{reversed_releases_url}">Releases</a></div><br/>',
+            f'<div class="button"><a style="color: white" href="{reversed_refresh_status_url}">Refresh Status</a></div><br/>'
         ]
         if is_running:
             buttons.insert(0, f'<div class="button"><a style="color: white" href="{reversed_stop_url}">{"Stop"}</a></div><br/>')
@@ -107,24 +351,39 @@ class AIGitHubProjectAdmin(admin.ModelAdmin):
     def download_access_logs_file(self, request, project_id, *args, **kwargs):
         obj = self.model.objects.get(pk=project_id)
         access_logs_path = AIApplicationRunner(obj).access_log_path
-        file_data = ''
-        with open(access_logs_path, 'r') as f:
-            file_data = f.read()
-
-        response = HttpResponse(file_data, content_type='plain/text')
-        response['Content-Disposition'] = f'attachment; filename="{os.path.basename(access_logs_path)}"'
-        return response
+        return serve_log_file(request, access_logs_path, as_attachment=True)
 
     def download_error_logs_file(self, request, project_id, *args, **kwargs):
         obj = self.model.objects.get(pk=project_id)
         error_logs_path = AIApplicationRunner(obj).error_log_path
-        file_data = ''
-        with open(error_logs_path, 'r') as f:
-            file_data = f.read()
+        return serve_log_file(request, error_logs_path, as_attachment=True)
+
+    def log_archives(self, request, project_id, *args, **kwargs):
+        obj = self.model.objects.get(pk=project_id)
+        rotator = AILogRotator(AIApplicationRunner(obj))
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'original': obj,
+            'title': _('Log archives of %(name)s') % {'name': obj.name},
+            'archives': rotator.get_archives(),
+        }
+        return TemplateResponse(request, 'admin/github/aigithubproject/log_archives.html', context)
+
+    def download_log_archive(self, request, project_id, archive_name, *args, **kwargs):
+        obj = self.model.objects.get(pk=project_id)
+        archive = AILogRotator(AIApplicationRunner(obj)).get_archive(archive_name)
+        if archive is None:
+            raise Http404
+        if archive.is_compressed:
+            return serve_log_file(request, archive.path, as_attachment=True, content_type='application/gzip',
+                                  compress=False)
+        return serve_log_file(request, archive.path, as_attachment=True)
 
-        response = HttpResponse(file_data, content_type='plain/text')
-        response['Content-Disposition'] = f'attachment; filename="{os.path.basename(error_logs_path)}"'
-        return response
+    def rotate_logs(self, request, queryset):
+        for qs in queryset.filter(provisioning_state=AIProvisioningState.READY):
+            AILogRotator(AIApplicationRunner(qs)).rotate_if_needed(force=True)
+        messages.add_message(request, messages.SUCCESS, _('The project logs have been rotated'))
 
     def get_urls(self):
         urls = super().get_urls()
@@ -132,23 +391,73 @@ class AIGitHubProjectAdmin(admin.ModelAdmin):
         custom_urls = [
             path(
                 "<int:project_id>/stop-application/",
-                self.admin_site.admin_view(self.stop_application),
+                self.admin_site.admin_view(self.ready_project_view(self.stop_application)),
                 name=f'{meta.app_label}_{meta.model_name}_stop_application',
             ),
             path(
                 "<int:project_id>/start-application/",
-                self.admin_site.admin_view(self.start_application),
+                self.admin_site.admin_view(self.ready_project_view(self.start_application)),
                 name=f'{meta.app_label}_{meta.model_name}_start_application',
             ),
+            path(
+                "<int:project_id>/refresh-status/",
+                self.admin_site.admin_view(self.refresh_project_status),
+                name=f'{meta.app_label}_{meta.model_name}_refresh_status',
+            ),
             path(
                 "<int:project_id>/access-logs/",
-                self.admin_site.admin_view(self.download_access_logs_file),
+                self.admin_site.admin_view(self.ready_project_view(self.download_access_logs_file)),
                 name=f'{meta.app_label}_{meta.model_name}_download_access_logs',
             ),
             path(
                 "<int:project_id>/error-logs/",
-                self.admin_site.admin_view(self.download_error_logs_file),
+                self.admin_site.admin_view(self.ready_project_view(self.download_error_logs_file)),
                 name=f'{meta.app_label}_{meta.model_name}_download_error_logs',
+            ),
+            path(
+                "<int:project_id>/provisioning/",
+                self.admin_site.admin_view(self.provisioning_page),
+                name=f'{meta.app_label}_{meta.model_name}_provisioning',
+            ),
+            path(
+                "<int:project_id>/provisioning/progress/",
+                self.admin_site.admin_view(self.provisioning_progress),
+                name=f'{meta.app_label}_{meta.model_name}_provisioning_progress',
+            ),
+            path(
+                "<int:project_id>/tracebacks/",
+                self.admin_site.admin_view(self.tracebacks),
+                name=f'{meta.app_label}_{meta.model_name}_tracebacks',
+            ),
+            path(
+                "<int:project_id>/deployments/",
+                self.admin_site.admin_view(self.deployments),
+                name=f'{meta.app_label}_{meta.model_name}_deployments',
+            ),
+            path(
+                "<int:project_id>/releases/",
+                self.admin_site.admin_view(self.ready_project_view(self.releases)),
+                name=f'{meta.app_label}_{meta.model_name}_releases',
+            ),
+            path(
+                "<int:project_id>/releases/<str:commit>/rollback/",
+                self.admin_site.admin_view(self.ready_project_view(self.rollback_release)),
+                name=f'{meta.app_label}_{meta.model_name}_rollback_release',
+            ),
+            path(
+                "<int:project_id>/traffic/",
+                self.admin_site.admin_view(self.traffic),
+                name=f'{meta.app_label}_{meta.model_name}_traffic',
+            ),
+            path(
+                "<int:project_id>/log-archives/",
+                self.admin_site.admin_view(self.ready_project_view(self.log_archives)),
+                name=f'{meta.app_label}_{meta.model_name}_log_archives',
+            ),
+            path(
+                "<int:project_id>/log-archives/<str:archive_name>/",
+                self.admin_site.admin_view(self.ready_project_view(self.download_log_archive)),
+                name=f'{meta.app_label}_{meta.model_name}_download_log_archive',
             )
         ]
         return custom_urls + urls
@@ -156,7 +465,34 @@ class AIGitHubProjectAdmin(admin.ModelAdmin):
     has_ssh_key.boolean = True
     has_last_error.boolean = True
     is_application_running.boolean = True
+    status_probed_at.short_description = _("Status probed at")
+    provisioning.short_description = _("Provisioning")
+    recent_traffic.short_description = _("Traffic (15 min)")
+    crashes.short_description = _("Crashes")
     git_pull_from_repo.short_description = _("Git pull")
+    refresh_status.short_description = _("Refresh status now")
+    rotate_logs.short_description = _("Rotate logs now")
     project_actions.short_description = _("Actions")
     project_actions.allow_tags = True
-    actions = [git_pull_from_repo]
+    actions = [git_pull_from_repo, refresh_status, rotate_logs]
+
+
+@admin.register(AIDeployment)
+class AIDeploymentAdmin(admin.ModelAdmin):
+    list_display = ['project', 'trigger', 'started_at', 'outcome', 'commit_range', 'plan', 'duration',
+                    'kill_duration', 'venv_duration', 'pip_duration', 'boot_duration', 'ready_duration']
+    list_filter = ['project', 'trigger', 'outcome']
+    list_select_related = ['project']
+    date_hierarchy = 'started_at'
+
+    def commit_range(self, obj):
+        return f"{(obj.previous_commit or '-')[:8]}..{(obj.commit or '-')[:8]}"
+
+    def has_add_permission(self, request):
+        # The deployments are recorded by the runner only
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    commit_range.short_description = _("Commits")
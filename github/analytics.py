@@ -0,0 +1,236 @@
+from __future__ import unicode_literals
+
+__author__ = 'David Baum'
+
+import logging
+import os
+import re
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime, timezone
+from time import time
+
+import redis
+from django.conf import settings
+
+from github.logs import AILogCheckpoint, AIIncrementalLogReader
+from github.rotation import AILogRotator
+
+
+class AITrafficBucket(object):
+    """Requests of one project in one minute."""
+    # Upper bounds of the response time histogram buckets in milliseconds, the last bucket is unbounded
+    RESPONSE_TIME_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self, minute, data=None):
+        self.minute = minute
+        self.counters = Counter(data or {})
+
+    @property
+    def started_at(self):
+        return datetime.fromtimestamp(self.minute, tz=timezone.utc)
+
+    @property
+    def requests(self):
+        return self.counters['requests']
+
+    @property
+    def status_codes(self):
+        return {field[len('status:'):]: count for field, count in sorted(self.counters.items())
+                if field.startswith('status:')}
+
+    def count_status_class(self, status_class):
+        return sum(count for status_code, count in self.status_codes.items() if status_code.startswith(status_class))
+
+    @classmethod
+    def get_response_time_field(cls, response_time_ms):
+        index = bisect_left(cls.RESPONSE_TIME_BUCKETS, response_time_ms)
+        if index == len(cls.RESPONSE_TIME_BUCKETS):
+            return 'rt:inf'
+        return f'rt:{cls.RESPONSE_TIME_BUCKETS[index]}'
+
+    def add(self, status_code, response_time_ms=None):
+        self.counters['requests'] += 1
+        self.counters[f'status:{status_code}'] += 1
+        if response_time_ms is not None:
+            self.counters[self.get_response_time_field(response_time_ms)] += 1
+            self.counters['rt_sum_us'] += int(response_time_ms * 1000)
+
+    def merge(self, other):
+        self.counters.update(other.counters)
+
+    @property
+    def mean_response_time(self):
+        timed_requests = sum(count for field, count in self.counters.items() if field.startswith('rt:'))
+        if not timed_requests:
+            return None
+        return self.counters['rt_sum_us'] / 1000 / timed_requests
+
+    def get_percentile(self, percentile):
+        """
+        :return:
+            the upper bound of the histogram bucket of the percentile in milliseconds, None without timings
+        """
+        histogram = [(self.counters[f'rt:{bound}'], bound) for bound in self.RESPONSE_TIME_BUCKETS]
+        histogram.append((self.counters['rt:inf'], float('inf')))
+        total = sum(count for count, _ in histogram)
+        if not total:
+            return None
+        rank = total * percentile / 100
+        seen = 0
+        for count, bound in histogram:
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def format_percentile(self, percentile):
+        bound = self.get_percentile(percentile)
+        if bound is None:
+            return '-'
+        if bound == float('inf'):
+            return f'> {self.RESPONSE_TIME_BUCKETS[-1]} ms'
+        return f'≤ {bound} ms'
+
+
+class AITrafficStore(object):
+    """
+    Per-minute traffic buckets of the projects in Redis hashes, expiring after settings.TRAFFIC_RETENTION seconds.
+    """
+    KEY_PREFIX = 'arielinstaller:traffic'
+
+    def __init__(self):
+        self.connection = redis.Redis(connection_pool=settings.REDIS_POOL)
+
+    def get_key(self, project_id, minute):
+        return f'{self.KEY_PREFIX}:{project_id}:{minute}'
+
+    def add(self, project_id, buckets):
+        pipeline = self.connection.pipeline(transaction=False)
+        for bucket in buckets:
+            key = self.get_key(project_id, bucket.minute)
+            for field, count in bucket.counters.items():
+                pipeline.hincrby(key, field, count)
+            pipeline.expire(key, settings.TRAFFIC_RETENTION)
+        pipeline.execute()
+
+    def get_many_buckets(self, project_ids, minutes=60, now=None):
+        """
+        :return:
+            dict of the lists of AITrafficBucket objects of the last minutes by the project id, the oldest first,
+            including the empty ones, read in one round-trip
+        """
+        current_minute = int((now or time()) // 60 * 60)
+        bucket_minutes = [current_minute - 60 * index for index in reversed(range(minutes))]
+        try:
+            pipeline = self.connection.pipeline(transaction=False)
+            for project_id in project_ids:
+                for minute in bucket_minutes:
+                    pipeline.hgetall(self.get_key(project_id, minute))
+            rows = pipeline.execute()
+        except redis.RedisError as e:
+            logging.error(f'Error occurred while reading the traffic of the projects {project_ids}: {e}')
+            rows = [{}] * len(bucket_minutes) * len(project_ids)
+
+        buckets = {}
+        for index, project_id in enumerate(project_ids):
+            project_rows = rows[index * len(bucket_minutes):(index + 1) * len(bucket_minutes)]
+            buckets[project_id] = [AITrafficBucket(minute, {key.decode(): int(value) for key, value in data.items()})
+                                   for minute, data in zip(bucket_minutes, project_rows)]
+        return buckets
+
+    def get_buckets(self, project_id, minutes=60, now=None):
+        """
+        :return:
+            list of AITrafficBucket objects of the last minutes, the oldest first, including the empty ones
+        """
+        return self.get_many_buckets([project_id], minutes, now)[project_id]
+
+    def get_summaries(self, project_ids, minutes=15):
+        """
+        :return:
+            dict of AITrafficBucket objects merging the last minutes by the project id
+        """
+        summaries = {}
+        for project_id, buckets in self.get_many_buckets(project_ids, minutes).items():
+            summaries[project_id] = AITrafficBucket(None)
+            for bucket in buckets:
+                summaries[project_id].merge(bucket)
+        return summaries
+
+    def get_summary(self, project_id, minutes=15):
+        """
+        :return:
+            AITrafficBucket object merging the last minutes
+        """
+        return self.get_summaries([project_id], minutes)[project_id]
+
+
+class AIAccessLogAnalyzer(object):
+    """
+    Aggregate the new lines of the project gunicorn access log into the per-minute traffic buckets.
+
+    The log format is AIApplicationRunner.ACCESS_LOG_FORMAT, the response time (%(D)s, microseconds) is the last
+    field. The lines written before the response time was logged are counted without the timing.
+    """
+    CONSUMER = 'traffic'
+    LINE_RE = re.compile(r'\[(?P<time>[^\]]+)\] ".*" (?P<status>\d{3}) \S+ ".*" ".*"(?: (?P<duration>\d+))?$')
+
+    def __init__(self, project, runner):
+        self.project = project
+        self.runner = runner
+        self.minutes_cache = {}
+
+    def parse_minute(self, log_time):
+        """
+        :param log_time:
+            gunicorn request time, e.g. 17/Oct/2026:20:51:05 +0000
+
+        :return:
+            the epoch of the minute start
+        """
+        # The lines of the same minute share the prefix, parse it once
+        minute_key = f'{log_time[:17]}{log_time[20:]}'
+        minute = self.minutes_cache.get(minute_key)
+        if minute is None:
+            minute = int(datetime.strptime(minute_key, '%d/%b/%Y:%H:%M %z').timestamp())
+            self.minutes_cache[minute_key] = minute
+        return minute
+
+    def aggregate(self, lines):
+        """
+        :return:
+            list of AITrafficBucket objects
+        """
+        buckets = {}
+        for line in lines:
+            match = self.LINE_RE.search(line)
+            if not match:
+                continue
+            try:
+                minute = self.parse_minute(match.group('time'))
+            except ValueError:
+                continue
+            bucket = buckets.get(minute)
+            if bucket is None:
+                bucket = buckets[minute] = AITrafficBucket(minute)
+            duration = match.group('duration')
+            bucket.add(match.group('status'), int(duration) / 1000 if duration else None)
+        return list(buckets.values())
+
+    def analyze(self):
+        """
+        :return:
+            number of the processed lines
+        """
+        log_path = self.runner.access_log_path
+        reader = AIIncrementalLogReader(
+            log_path,
+            AILogCheckpoint(self.CONSUMER, self.project.pk, os.path.basename(log_path)),
+            archive_dir=os.path.join(os.path.dirname(log_path), AILogRotator.ARCHIVE_DIR)
+        )
+        lines = reader.read()
+        if lines:
+            AITrafficStore().add(self.project.pk, self.aggregate(lines))
+        reader.commit()
+        return len(lines)
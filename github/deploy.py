@@ -0,0 +1,108 @@
+from __future__ import unicode_literals
+
+__author__ = 'David Baum'
+
+import fnmatch
+import logging
+import os
+
+from git import GitCommandError, Repo
+
+
+class AIDeployPlan(object):
+    NOTHING = 'nothing'
+    RELOAD = 'reload'
+    RESTART = 'restart'
+    REBUILD = 'rebuild'
+
+    def __init__(self, action, reason, changed_files=()):
+        self.action = action
+        self.reason = reason
+        self.changed_files = list(changed_files)
+
+    def __str__(self):
+        return f'{self.action}: {self.reason}'
+
+
+class AIDeployPlanner(object):
+    """
+    Choose the cheapest safe deploy action from the diff between the deployed and the new commit.
+
+    * requirements.txt changed or the deployed commit is beyond the shallow history - rebuild the env and restart
+    * none of the changed files is under the project watch paths - nothing
+    * only python code changed - graceful gunicorn reload
+    * anything else - restart
+    """
+    REQUIREMENTS_FILES = ('requirements.txt',)
+    RELOADABLE_EXTENSIONS = ('.py',)
+
+    def __init__(self, project, local_dir):
+        self.project = project
+        self.local_dir = local_dir
+
+    @property
+    def watch_patterns(self):
+        return [line.strip() for line in (self.project.watch_paths or '').splitlines() if line.strip()]
+
+    def is_watched(self, path):
+        patterns = self.watch_patterns
+        if not patterns:
+            return True
+        for pattern in patterns:
+            if fnmatch.fnmatch(path, pattern) or path.startswith(pattern.rstrip('/') + '/'):
+                return True
+        return False
+
+    def is_shallow(self):
+        return os.path.exists(os.path.join(self.local_dir, '.git', 'shallow'))
+
+    def get_changed_files(self, old_commit, new_commit):
+        output = Repo(self.local_dir).git.diff('--name-only', '--no-renames', old_commit, new_commit)
+        return [line for line in output.splitlines() if line]
+
+    def plan(self, old_commit, new_commit):
+        """
+        :param old_commit:
+            the commit deployed now
+
+        :param new_commit:
+            the commit to deploy
+
+        :return:
+            AIDeployPlan object
+        """
+        if not old_commit:
+            return AIDeployPlan(AIDeployPlan.REBUILD, 'No commit was deployed before')
+        if old_commit == new_commit:
+            return AIDeployPlan(AIDeployPlan.NOTHING, f'The commit {new_commit} is already deployed')
+
+        try:
+            changed_files = self.get_changed_files(old_commit, new_commit)
+        except (GitCommandError, ValueError) as e:
+            if self.is_shallow():
+                # Fetching the deployed commit would deepen the clone for good and the git command gets no
+                # credentials of the project, the rebuild is the safe action
+                logging.info(f'The commit {old_commit} is beyond the shallow history of {self.local_dir}')
+                return AIDeployPlan(AIDeployPlan.REBUILD,
+                                    f'The deployed commit {old_commit} is beyond the shallow history')
+            error = e.stderr.strip() if isinstance(e, GitCommandError) else e
+            return AIDeployPlan(AIDeployPlan.REBUILD, f'Failed comparing {old_commit}..{new_commit}: {error}')
+
+        requirements_files = [path for path in changed_files if path in self.REQUIREMENTS_FILES]
+        if requirements_files:
+            return AIDeployPlan(AIDeployPlan.REBUILD, f'Changed {", ".join(requirements_files)}', changed_files)
+
+        watched_files = [path for path in changed_files if self.is_watched(path)]
+        if not watched_files:
+            return AIDeployPlan(AIDeployPlan.NOTHING,
+                                f'None of {len(changed_files)} changed files is under the watch paths',
+                                changed_files)
+
+        other_files = [path for path in watched_files if os.path.splitext(path)[1] not in self.RELOADABLE_EXTENSIONS]
+        if not other_files:
+            return AIDeployPlan(AIDeployPlan.RELOAD, f'Only python code changed in {len(watched_files)} files',
+                                changed_files)
+        return AIDeployPlan(AIDeployPlan.RESTART,
+                            f'Changed non-python files: {", ".join(other_files[:10])}'
+                            f'{"..." if len(other_files) > 10 else ""}',
+                            changed_files)
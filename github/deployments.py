@@ -0,0 +1,91 @@
+from __future__ import unicode_literals
+
+__author__ = 'David Baum'
+
+import math
+from contextlib import contextmanager
+from time import monotonic
+
+
+class AIDeploymentTrigger(object):
+    # The polling of the new commits
+    SCHEDULER = 'scheduler'
+    WEBHOOK = 'webhook'
+    ADMIN = 'admin'
+    # The application found not running
+    HEALTH = 'health'
+    # The first start after the clone
+    PROVISIONING = 'provisioning'
+    ROLLBACK = 'rollback'
+
+
+class AIDeploymentOutcome(object):
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    # The plan was to do nothing
+    SKIPPED = 'skipped'
+
+
+class AIDeployPhase(object):
+    KILL = 'kill'
+    VENV = 'venv'
+    PIP = 'pip'
+    BOOT = 'boot'
+    READY = 'ready'
+
+    ALL = (KILL, VENV, PIP, BOOT, READY)
+
+
+class AIDeployTimer(object):
+    """Wall-clock durations of the deploy phases in seconds, a phase run twice is summed."""
+
+    def __init__(self):
+        self.durations = {}
+
+    def add(self, phase, duration):
+        self.durations[phase] = self.durations.get(phase, 0) + duration
+
+    @contextmanager
+    def measure(self, phase):
+        started_at = monotonic()
+        try:
+            yield
+        finally:
+            self.add(phase, monotonic() - started_at)
+
+
+def get_percentile(values, percentile):
+    """
+    :return:
+        the nearest-rank percentile of the values or None if there are none
+    """
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    rank = max(int(math.ceil(len(values) * percentile / 100)), 1)
+    return values[rank - 1]
+
+
+class AIDeploymentStats(object):
+    """p50/p95 of the total and per-phase durations of the finished deployments of a project."""
+    PERCENTILES = (50, 95)
+
+    def __init__(self, deployments):
+        self.deployments = [deployment for deployment in deployments if deployment.duration is not None]
+
+    def get_rows(self):
+        """
+        :return:
+            list of dicts with the phase name, the number of the measurements and the percentiles
+        """
+        rows = []
+        for phase, field in [('total', 'duration')] + [(phase, f'{phase}_duration') for phase in AIDeployPhase.ALL]:
+            values = [getattr(deployment, field) for deployment in self.deployments
+                      if getattr(deployment, field) is not None]
+            rows.append({
+                'phase': phase,
+                'count': len(values),
+                'percentiles': [get_percentile(values, percentile) for percentile in self.PERCENTILES],
+            })
+        return rows
@@ -0,0 +1,230 @@
+from __future__ import unicode_literals
+
+__author__ = 'David Baum'
+
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+from contextlib import contextmanager
+from functools import lru_cache
+from time import time
+
+from django.conf import settings
+
+from github.deployments import AIDeployPhase, AIDeployTimer
+from github.wheelhouse import AIWheelhouse
+
+
+class AIVirtualEnvError(Exception):
+    pass
+
+
+class AIVirtualEnvCache(object):
+    """
+    Content-addressed store of virtual envs.
+
+    Every env lives in settings.VIRTUAL_ENVS_DIR/<hash>, where the hash covers the project requirements.txt and
+    the python version, so the projects with the same requirements share one env and an unchanged project
+    reuses its env instantly. A project links its .env to the env by a symlink which is swapped atomically.
+    The least recently used envs nobody links to are evicted when the store exceeds its disk budget.
+    """
+    COMPLETE_MARKER = '.complete'
+    LINKS_FILE = '.links'
+    # The env used recently may be just going to be linked by a deploy
+    EVICTION_GRACE_PERIOD = 60 * 60
+
+    def __init__(self, root=None, disk_budget=None):
+        self.root = os.path.abspath(root or settings.VIRTUAL_ENVS_DIR)
+        self.disk_budget = disk_budget if disk_budget is not None else settings.VIRTUAL_ENVS_DISK_BUDGET
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_python_version():
+        result = subprocess.run(['python3', '--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                universal_newlines=True)
+        return result.stdout.strip()
+
+    def get_requirements_hash(self, requirements_path):
+        digest = hashlib.sha256(self.get_python_version().encode())
+        if os.path.exists(requirements_path):
+            with open(requirements_path, 'rb') as f:
+                digest.update(f.read())
+        return digest.hexdigest()[:32]
+
+    def get_env_path(self, requirements_hash):
+        return os.path.join(self.root, requirements_hash)
+
+    def is_complete(self, env_path):
+        return os.path.exists(os.path.join(env_path, self.COMPLETE_MARKER))
+
+    @contextmanager
+    def lock(self, env_path):
+        with open(f'{env_path}.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def ensure_env(self, requirements_path, timer=None):
+        """
+        Return the env for the requirements, building it when it does not exist yet.
+
+        :param requirements_path:
+            path to the project requirements.txt
+
+        :param timer:
+            AIDeployTimer object the virtualenv and pip durations of the build are added to
+
+        :return:
+            (env path, True if the env was built now)
+        """
+        env_path = self.get_env_path(self.get_requirements_hash(requirements_path))
+        with self.lock(env_path):
+            if self.is_complete(env_path):
+                logging.info(f'Reusing the virtual env {env_path} for {requirements_path}')
+                self.touch(env_path)
+                return env_path, False
+
+            if os.path.exists(env_path):
+                # Leftover of the interrupted build
+                shutil.rmtree(env_path)
+            try:
+                self.build_env(env_path, requirements_path, timer=timer)
+            except Exception:
+                shutil.rmtree(env_path, ignore_errors=True)
+                raise
+
+        self.evict(keep=[env_path])
+        return env_path, True
+
+    def build_env(self, env_path, requirements_path, timer=None):
+        timer = timer or AIDeployTimer()
+        logging.info(f'Creating virtual env {env_path} for {requirements_path}')
+        with timer.measure(AIDeployPhase.VENV):
+            self.run_command(['virtualenv', '-p', 'python3', env_path])
+        if os.path.exists(requirements_path):
+            with timer.measure(AIDeployPhase.PIP):
+                self.install_requirements([f'{env_path}/bin/pip'], requirements_path)
+
+        with open(os.path.join(env_path, self.COMPLETE_MARKER), 'w') as f:
+            f.write(str(self.get_dir_size(env_path)))
+
+    def install_requirements(self, pip, requirements_path):
+        wheelhouse = AIWheelhouse()
+        try:
+            self.run_command(wheelhouse.get_install_command(pip, requirements_path))
+        except AIVirtualEnvError:
+            logging.info(f'Not all the wheels of {requirements_path} are in the wheelhouse, adding them')
+            self.run_command(wheelhouse.get_wheel_command(pip, requirements_path))
+            self.run_command(wheelhouse.get_install_command(pip, requirements_path))
+            wheelhouse.prune()
+
+    def run_command(self, command):
+        try:
+            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    universal_newlines=True)
+        except OSError as e:
+            raise AIVirtualEnvError(f'The command "{" ".join(command)}" failed: {e}')
+        for line in result.stdout.split("\n"):
+            logging.info(line)
+        if result.returncode != 0:
+            raise AIVirtualEnvError(f'The command "{" ".join(command)}" failed with the exit code '
+                                    f'{result.returncode}: {result.stdout[-2000:]}')
+
+    def link(self, env_path, link_path):
+        """
+        Point link_path to the env atomically, the running application keeps its old env until restart.
+
+        :return:
+        """
+        if os.path.isdir(link_path) and not os.path.islink(link_path):
+            # The env created before the cache existed
+            shutil.rmtree(link_path)
+
+        tmp_link_path = f'{link_path}.{os.getpid()}.tmp'
+        if os.path.lexists(tmp_link_path):
+            os.unlink(tmp_link_path)
+        os.symlink(env_path, tmp_link_path)
+        os.replace(tmp_link_path, link_path)
+
+        links = self.get_links(env_path)
+        if link_path not in links:
+            with open(os.path.join(env_path, self.LINKS_FILE), 'a') as f:
+                f.write(f'{link_path}\n')
+        self.touch(env_path)
+
+    def get_links(self, env_path):
+        links_path = os.path.join(env_path, self.LINKS_FILE)
+        if not os.path.exists(links_path):
+            return []
+        with open(links_path, 'r') as f:
+            return [line.strip() for line in f if line.strip()]
+
+    def is_in_use(self, env_path):
+        real_env_path = os.path.realpath(env_path)
+        return any(os.path.realpath(link) == real_env_path for link in self.get_links(env_path))
+
+    def touch(self, env_path):
+        os.utime(os.path.join(env_path, self.COMPLETE_MARKER))
+
+    def get_env_size(self, env_path):
+        with open(os.path.join(env_path, self.COMPLETE_MARKER), 'r') as f:
+            try:
+                return int(f.read().strip() or 0)
+            except ValueError:
+                return 0
+
+    @staticmethod
+    def get_dir_size(path):
+        size = 0
+        for dir_path, dir_names, file_names in os.walk(path):
+            for file_name in file_names:
+                try:
+                    size += os.lstat(os.path.join(dir_path, file_name)).st_size
+                except OSError:
+                    pass
+        return size
+
+    def get_envs(self):
+        """
+        :return:
+            list of (last used timestamp, size, env path) of the complete envs
+        """
+        envs = []
+        for name in os.listdir(self.root):
+            env_path = os.path.join(self.root, name)
+            if not os.path.isdir(env_path) or not self.is_complete(env_path):
+                continue
+            marker_path = os.path.join(env_path, self.COMPLETE_MARKER)
+            envs.append((os.path.getmtime(marker_path), self.get_env_size(env_path), env_path))
+        return envs
+
+    def evict(self, keep=()):
+        """
+        Remove the least recently used envs which are not linked by any project until the store fits the budget.
+
+        :param keep:
+            env paths which must not be removed
+
+        :return:
+            list of the removed env paths
+        """
+        envs = sorted(self.get_envs())
+        total_size = sum(size for _, size, _ in envs)
+        removed = []
+        for last_used, size, env_path in envs:
+            if total_size <= self.disk_budget:
+                break
+            if env_path in keep or time() - last_used < self.EVICTION_GRACE_PERIOD or self.is_in_use(env_path):
+                continue
+            with self.lock(env_path):
+                logging.info(f'Evicting the virtual env {env_path} ({size} bytes)')
+                shutil.rmtree(env_path, ignore_errors=True)
+            total_size -= size
+            removed.append(env_path)
+        return removed
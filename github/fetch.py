@@ -0,0 +1,136 @@
+from __future__ import unicode_literals
+
+__author__ = 'David Baum'
+
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+
+from django.conf import settings
+from uritools import urisplit
+
+from github.metrics import AIMetricsStore, FETCH_DURATION
+from github.models import AIGitHubProject
+from github.utils import RepoTools
+
+
+class AIProjectFetchResult(object):
+    def __init__(self, project):
+        """
+        The result of fetching a single project.
+
+        :param project:
+            the AIGitHubProject object, its last_commit/last_error are updated in place by the fetch
+        """
+        self.project = project
+        self.previous_commit = project.last_commit
+        self.previous_error = project.last_error
+        self.has_remote_changes = None
+        self.duration = 0.0
+
+    @property
+    def is_changed(self):
+        return bool(self.project.last_commit) and self.project.last_commit != self.previous_commit
+
+    @property
+    def is_dirty(self):
+        return self.is_changed or self.project.last_error != self.previous_error
+
+
+class AIConcurrentFetcher(object):
+    """
+    Fetch the new commits for many projects in parallel.
+
+    The number of simultaneous fetches is capped globally by the worker pool size and for every
+    git host by a semaphore, so one cycle takes roughly as long as the slowest repo.
+    """
+
+    def __init__(self, max_workers=None, max_workers_per_host=None):
+        self.max_workers = max_workers or settings.GIT_FETCH_MAX_WORKERS
+        self.max_workers_per_host = max_workers_per_host or settings.GIT_FETCH_MAX_WORKERS_PER_HOST
+        self._host_semaphores = {}
+        self._lock = threading.Lock()
+
+    def get_host_semaphore(self, url):
+        host = urisplit(url).host or ''
+        with self._lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(self.max_workers_per_host)
+            return self._host_semaphores[host]
+
+    def map(self, func, projects):
+        """
+        Call func(project) for every project in the worker pool, honouring the per host limits.
+
+        :return:
+            list of func results in the order of the projects
+        """
+        projects = list(projects)
+        if not projects:
+            return []
+
+        def limited_func(project):
+            with self.get_host_semaphore(project.url):
+                return func(project)
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(projects))) as executor:
+            return list(executor.map(limited_func, projects))
+
+    def probe_project(self, project):
+        result = AIProjectFetchResult(project)
+        started_at = monotonic()
+        result.has_remote_changes = RepoTools(project).has_remote_changes()
+        result.duration = monotonic() - started_at
+        return result
+
+    def probe(self, projects):
+        """
+        Find the projects whose remote branch moved, without fetching anything.
+
+        :param projects:
+            iterable of AIGitHubProject objects
+
+        :return:
+            list of AIProjectFetchResult in the order of the projects
+        """
+        results = self.map(self.probe_project, projects)
+        AIMetricsStore().observe(FETCH_DURATION, [result.duration for result in results], {'operation': 'probe'})
+        logging.info(f"Probed {len(results)} projects, "
+                     f"{len([result for result in results if result.has_remote_changes])} moved")
+        return results
+
+    def fetch_project(self, project):
+        result = AIProjectFetchResult(project)
+        started_at = monotonic()
+        try:
+            repo_tools = RepoTools(project)
+            result.has_remote_changes = repo_tools.has_remote_changes()
+            if result.has_remote_changes:
+                repo_tools.git_fetch(save=False)
+        except Exception:
+            error = "\n".join(traceback.format_exc().splitlines())
+            logging.error(f"Error occurred while fetching the project {project.name}: {error}")
+            project.last_error = error
+        result.duration = monotonic() - started_at
+        return result
+
+    def fetch(self, projects):
+        """
+        Fetch the projects and save the changed last_commit/last_error values in one batch.
+
+        :param projects:
+            iterable of AIGitHubProject objects
+
+        :return:
+            list of AIProjectFetchResult in the order of the projects
+        """
+        results = self.map(self.fetch_project, projects)
+        AIMetricsStore().observe(FETCH_DURATION, [result.duration for result in results], {'operation': 'fetch'})
+
+        dirty_projects = [result.project for result in results if result.is_dirty]
+        if dirty_projects:
+            AIGitHubProject.objects.bulk_update(dirty_projects, ['last_commit', 'last_error'])
+        logging.info(f"Fetched {len(results)} projects, {len(dirty_projects)} changed")
+        return results
@@ -0,0 +1,90 @@
+from __future__ import unicode_literals
+
+__author__ = 'David Baum'
+
+import logging
+import socket
+import threading
+from contextlib import closing
+from time import monotonic
+
+from django.conf import settings
+
+
+class AIListeningPortsSnapshot(object):
+    """
+    The set of TCP ports listening on the host, read in one pass from /proc/net/tcp and /proc/net/tcp6.
+
+    Where /proc is not available (e.g. macOS) every question falls back to a socket connect.
+    """
+    PROC_NET_FILES = ('/proc/net/tcp', '/proc/net/tcp6')
+    TCP_LISTEN_STATE = '0A'
+
+    def __init__(self):
+        self.created_at = monotonic()
+        self.ports = self.read_listening_ports()
+
+    @classmethod
+    def read_listening_ports(cls):
+        """
+        Parse the kernel socket tables.
+
+        :return:
+            set of the listening ports or None if no table can be read
+        """
+        ports = set()
+        is_readable = False
+        for path in cls.PROC_NET_FILES:
+            try:
+                with open(path, 'r') as f:
+                    next(f, None)  # header
+                    for line in f:
+                        # sl local_address rem_address st ...
+                        fields = line.split()
+                        if len(fields) > 3 and fields[3] == cls.TCP_LISTEN_STATE:
+                            ports.add(int(fields[1].rsplit(':', 1)[1], 16))
+                is_readable = True
+            except OSError:
+                continue
+        return ports if is_readable else None
+
+    @property
+    def age(self):
+        return monotonic() - self.created_at
+
+    def is_listening(self, port):
+        if self.ports is None:
+            return self.is_port_open(port)
+        return port in self.ports
+
+    @staticmethod
+    def is_port_open(port, timeout=5):
+        with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as sock:
+            sock.settimeout(timeout)
+            return sock.connect_ex(("127.0.0.1", port)) == 0
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_listening_ports_snapshot(max_age=None):
+    """
+    Return the shared snapshot, re-reading the socket tables when it is older than max_age seconds.
+
+    :param max_age:
+        0 forces a fresh snapshot, None uses settings.LISTENING_PORTS_SNAPSHOT_MAX_AGE
+
+    :return:
+        AIListeningPortsSnapshot object
+    """
+    global _snapshot
+    if max_age is None:
+        max_age = settings.LISTENING_PORTS_SNAPSHOT_MAX_AGE
+
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.age >= max_age:
+            _snapshot = AIListeningPortsSnapshot()
+            if _snapshot.ports is None:
+                logging.warning('The /proc/net socket tables are not available, probing the ports by connecting')
+        return _snapshot
@@ -0,0 +1,496 @@
+from __future__ import unicode_literals
+
+__author__ = 'David Baum'
+
+import logging
+import os
+import re
+import uuid
+from time import sleep, monotonic, time
+
+import redis
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_etags
+from django.utils.text import compress_sequence
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class AILogFileWindow(object):
+    """
+    The byte window of a log file to serve, the end is fixed when the window is created,
+    so the response stays consistent while the application keeps writing the log.
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            stat = os.stat(path)
+        except OSError:
+            raise Http404
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        self.start = 0
+        self.end = self.size
+
+    @property
+    def length(self):
+        return self.end - self.start
+
+    def since(self, offset):
+        """Serve the bytes written after the offset, the whole log if it was truncated or rotated since."""
+        self.start = offset if 0 <= offset <= self.size else 0
+
+    def tail(self, lines_number):
+        """Serve at most the last lines of the window, reading the log backwards by chunks."""
+        if lines_number <= 0:
+            self.start = self.end
+            return
+        with open(self.path, 'rb') as f:
+            position = self.end
+            newlines = 0
+            while position > self.start:
+                read_size = min(self.CHUNK_SIZE, position - self.start)
+                position -= read_size
+                f.seek(position)
+                chunk = f.read(read_size)
+                if position + read_size == self.end and chunk.endswith(b'\n'):
+                    # The line break closing the last line does not start a new one
+                    chunk = chunk[:-1]
+                index = len(chunk)
+                while True:
+                    index = chunk.rfind(b'\n', 0, index)
+                    if index < 0:
+                        break
+                    newlines += 1
+                    if newlines == lines_number:
+                        self.start = max(self.start, position + index + 1)
+                        return
+
+    def parse_range(self, range_header):
+        """
+        :return:
+            (start, end) of the single bytes range, None when the header is not a satisfiable single range
+        """
+        match = RANGE_RE.match(range_header.strip())
+        if not match or not any(match.groups()):
+            return None
+        first, last = match.groups()
+        if not first:
+            # The suffix range - the last bytes
+            start = max(self.size - int(last), 0)
+            end = self.size
+        else:
+            start = int(first)
+            end = min(int(last) + 1, self.size) if last else self.size
+        if start >= end:
+            return None
+        return start, end
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            f.seek(self.start)
+            remaining = self.length
+            while remaining > 0:
+                chunk = f.read(min(self.CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+
+def serve_log_file(request, log_path, as_attachment=False, content_type='text/plain; charset=utf-8', compress=True):
+    """
+    Stream the log file without reading it into memory.
+
+    Supports single HTTP ranges, the ?tail=N (last lines) and ?since=<offset> (bytes written after the offset)
+    parameters, gzip when the client accepts it and no range is requested, and the conditional GET by the ETag
+    and Last-Modified built from the file mtime and size. The X-Log-Size header is the offset to continue from.
+
+    :param compress:
+        False for the files which are compressed already
+
+    :return:
+        response
+    """
+    window = AILogFileWindow(log_path)
+    not_modified = get_conditional_response(request, etag=window.etag, last_modified=int(window.mtime))
+    if not_modified is not None:
+        return not_modified
+
+    status = 200
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    if range_header and if_range and window.etag not in parse_etags(if_range) and if_range != http_date(window.mtime):
+        # The log changed since the client got the first part
+        range_header = None
+
+    if range_header:
+        byte_range = window.parse_range(range_header)
+        if byte_range is None:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{window.size}'
+            return response
+        window.start, window.end = byte_range
+        status = 206
+    else:
+        try:
+            if 'since' in request.GET:
+                window.since(int(request.GET['since']))
+            if 'tail' in request.GET:
+                window.tail(int(request.GET['tail']))
+        except ValueError:
+            return HttpResponse('The tail and since parameters must be integers', status=400)
+
+    use_gzip = compress and status == 200 and 'gzip' in request.headers.get('Accept-Encoding', '')
+    if use_gzip:
+        response = StreamingHttpResponse(compress_sequence(window), content_type=content_type)
+        response['Content-Encoding'] = 'gzip'
+        # The compressed bytes are not the same on every response
+        response['ETag'] = f'W/{window.etag}'
+    else:
+        response = StreamingHttpResponse(window, content_type=content_type, status=status)
+        response['Content-Length'] = str(window.length)
+    if status == 206:
+        response['Content-Range'] = f'bytes {window.start}-{window.end - 1}/{window.size}'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    response['Accept-Ranges'] = 'bytes'
+    if not response.has_header('ETag'):
+        response['ETag'] = window.etag
+    response['Last-Modified'] = http_date(window.mtime)
+    response['X-Log-Size'] = str(window.size)
+    disposition = 'attachment' if as_attachment else 'inline'
+    response['Content-Disposition'] = f'{disposition}; filename="{os.path.basename(log_path)}"'
+    return response
+
+
+class AILogTailers(object):
+    """
+    Registry of the live log tailers in Redis, capping their number across all the web processes.
+
+    Every tailer holds a web worker thread, so only settings.LOG_TAIL_MAX_CLIENTS of them may run at once.
+    The tailers refresh their registration twice per settings.LOG_TAIL_STALE_AFTER seconds while they stream,
+    the ones which died without releasing it expire after it.
+    """
+    KEY = 'arielinstaller:log-tailers'
+
+    def __init__(self, max_tailers=None, stale_after=None):
+        self.connection = redis.Redis(connection_pool=settings.REDIS_POOL)
+        self.max_tailers = settings.LOG_TAIL_MAX_CLIENTS if max_tailers is None else max_tailers
+        self.stale_after = settings.LOG_TAIL_STALE_AFTER if stale_after is None else stale_after
+
+    def acquire(self, tailer_id):
+        """
+        :return:
+            True if the tailer may start
+        """
+        now = time()
+        try:
+            pipeline = self.connection.pipeline()
+            pipeline.zremrangebyscore(self.KEY, 0, now - self.stale_after)
+            pipeline.zadd(self.KEY, {tailer_id: now})
+            pipeline.zcard(self.KEY)
+            tailers_number = pipeline.execute()[-1]
+            if tailers_number > self.max_tailers:
+                self.connection.zrem(self.KEY, tailer_id)
+                return False
+        except redis.RedisError as e:
+            logging.error(f'Error occurred while registering the log tailer {tailer_id}: {e}')
+        return True
+
+    def refresh(self, tailer_id):
+        try:
+            self.connection.zadd(self.KEY, {tailer_id: time()})
+        except redis.RedisError as e:
+            logging.error(f'Error occurred while refreshing the log tailer {tailer_id}: {e}')
+
+    def release(self, tailer_id):
+        try:
+            self.connection.zrem(self.KEY, tailer_id)
+        except redis.RedisError as e:
+            logging.error(f'Error occurred while releasing the log tailer {tailer_id}: {e}')
+
+
+class AILogFollower(object):
+    """
+    Follow a log file from a byte offset and yield the new complete lines as Server-Sent Events.
+
+    The event id is the offset after the sent lines, so a reconnecting EventSource continues from its
+    Last-Event-ID. The file is polled by stat. A truncated log is followed from its start, a rotated one
+    (another inode at the path) is read to its end and the new file is followed from its start.
+    """
+    MAX_READ_SIZE = 256 * 1024
+    MAX_PARTIAL_LINE_SIZE = 64 * 1024
+
+    def __init__(self, path, offset=0, poll_interval=None, heartbeat_interval=15, max_duration=None,
+                 refresh_interval=None, on_refresh=None, on_close=None):
+        """
+        :param on_refresh:
+            called every refresh_interval seconds while the events, the heartbeats included, are sent
+        """
+        self.path = path
+        self.offset = offset
+        self.poll_interval = settings.LOG_TAIL_POLL_INTERVAL if poll_interval is None else poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.max_duration = settings.LOG_TAIL_MAX_DURATION if max_duration is None else max_duration
+        self.refresh_interval = settings.LOG_TAIL_STALE_AFTER / 2 if refresh_interval is None else refresh_interval
+        self.on_refresh = on_refresh
+        self.on_close = on_close
+        self.partial_line = b''
+
+    def close(self):
+        """Called by the response when the client disconnects, even before the first event is sent."""
+        on_close, self.on_close = self.on_close, None
+        if on_close:
+            on_close()
+
+    @staticmethod
+    def format_event(data=None, event_id=None, event=None):
+        lines = []
+        if event_id is not None:
+            lines.append(f'id: {event_id}')
+        if event:
+            lines.append(f'event: {event}')
+        for line in (data or '').split('\n'):
+            lines.append(f'data: {line}')
+        return '\n'.join(lines) + '\n\n'
+
+    def read_lines(self, f, size):
+        """
+        Read the file from the offset up to the size.
+
+        :return:
+            the event with the new complete lines or None
+        """
+        f.seek(self.offset)
+        data = f.read(min(size - self.offset, self.MAX_READ_SIZE))
+        self.offset += len(data)
+        self.partial_line += data
+        lines, separator, self.partial_line = self.partial_line.rpartition(b'\n')
+        if not separator and len(self.partial_line) >= self.MAX_PARTIAL_LINE_SIZE:
+            lines, self.partial_line = self.partial_line, b''
+        if not lines:
+            return None
+        return self.format_event(lines.decode(errors='replace'), self.offset - len(self.partial_line))
+
+    def __iter__(self):
+        # Refreshed on any event, a busy log may never be idle long enough for a heartbeat
+        refreshed_at = monotonic()
+        for event in self.iter_events():
+            if self.on_refresh and monotonic() - refreshed_at >= self.refresh_interval:
+                self.on_refresh()
+                refreshed_at = monotonic()
+            yield event
+
+    def iter_events(self):
+        started_at = last_sent_at = monotonic()
+        f = None
+        inode = None
+        yield f'retry: {int(self.poll_interval * 1000) + 1000}\n\n'
+        try:
+            while monotonic() - started_at < self.max_duration:
+                try:
+                    stat = os.stat(self.path)
+                except OSError:
+                    stat = None
+
+                if stat is not None and stat.st_ino != inode:
+                    if f is not None:
+                        # Send the rest of the rotated file before switching to the new one
+                        old_size = os.fstat(f.fileno()).st_size
+                        while self.offset < old_size:
+                            event = self.read_lines(f, old_size)
+                            if event:
+                                yield event
+                        f.close()
+                        self.offset = 0
+                        self.partial_line = b''
+                        yield self.format_event('rotated', 0, 'rotated')
+                    f = open(self.path, 'rb')
+                    inode = stat.st_ino
+
+                if f is not None and stat is not None:
+                    if stat.st_size < self.offset:
+                        self.offset = 0
+                        self.partial_line = b''
+                        yield self.format_event('truncated', 0, 'truncated')
+                    if stat.st_size > self.offset:
+                        event = self.read_lines(f, stat.st_size)
+                        if event:
+                            yield event
+                            last_sent_at = monotonic()
+                        # Keep reading without sleeping while the log has unread data
+                        continue
+
+                if monotonic() - last_sent_at >= self.heartbeat_interval:
+                    yield ': heartbeat\n\n'
+                    last_sent_at = monotonic()
+                sleep(self.poll_interval)
+        finally:
+            if f is not None:
+                f.close()
+
+
+def stream_log_events(request, log_path, tail=100):
+    """
+    Stream the new lines of the log as Server-Sent Events.
+
+    Starts from the Last-Event-ID header, the ?since=<offset> parameter or the last ?tail=N lines.
+
+    :return:
+        response, 503 if too many tailers already run
+    """
+    offset = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    try:
+        if offset is not None:
+            offset = int(offset)
+        else:
+            window = AILogFileWindow(log_path)
+            window.tail(int(request.GET.get('tail', tail)))
+            offset = window.start
+    except ValueError:
+        return HttpResponse('The tail and since parameters must be integers', status=400)
+
+    tailers = AILogTailers()
+    tailer_id = uuid.uuid4().hex
+    if not tailers.acquire(tailer_id):
+        response = HttpResponse('Too many live log tailers, try again later', status=503)
+        response['Retry-After'] = '30'
+        return response
+
+    follower = AILogFollower(log_path, offset, on_refresh=lambda: tailers.refresh(tailer_id),
+                             on_close=lambda: tailers.release(tailer_id))
+    response = StreamingHttpResponse(follower, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Disable the response buffering of nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+class AILogCheckpoint(object):
+    """
+    The inode and the byte offset up to which a project log was processed, kept in Redis with the lines
+    carried over to the next run.
+    """
+    KEY_PREFIX = 'arielinstaller:log-checkpoint'
+
+    def __init__(self, consumer, project_id, log_name):
+        self.connection = redis.Redis(connection_pool=settings.REDIS_POOL)
+        self.key = f'{self.KEY_PREFIX}:{consumer}:{project_id}:{log_name}'
+
+    def get(self):
+        """
+        :return:
+            (inode, offset), (None, 0) when the log was never processed
+        """
+        data = self.connection.hgetall(self.key)
+        if not data:
+            return None, 0
+        return int(data[b'inode']), int(data[b'offset'])
+
+    def get_carry(self):
+        """
+        :return:
+            list of the lines the consumer left unprocessed, e.g. the traceback still being written
+        """
+        carry = self.connection.hget(self.key, 'carry')
+        return carry.decode(errors='replace').split('\n') if carry else []
+
+    def set(self, inode, offset, carry=None):
+        self.connection.hset(self.key, mapping={'inode': inode, 'offset': offset, 'carry': '\n'.join(carry or [])})
+
+
+class AIIncrementalLogReader(object):
+    """
+    Read the complete lines appended to a log since the checkpoint, like a log shipper.
+
+    The work is bound by the new bytes. When the log was rotated, the rest of the previous file is read first
+    while it is still uncompressed in the archive directory, a truncated log is read from its start. The lines
+    the consumer carried over by commit() are read again before the new ones.
+    """
+    CHUNK_SIZE = 1024 * 1024
+    MAX_CARRY_SIZE = 64 * 1024
+
+    def __init__(self, path, checkpoint, archive_dir=None, max_bytes=None):
+        self.path = path
+        self.checkpoint = checkpoint
+        self.archive_dir = archive_dir
+        self.max_bytes = max_bytes or settings.LOG_ANALYSIS_MAX_BYTES
+        self.next_checkpoint = None
+
+    def find_rotated(self, inode):
+        if not self.archive_dir or not os.path.isdir(self.archive_dir):
+            return None
+        for entry in os.scandir(self.archive_dir):
+            if entry.is_file() and not entry.name.endswith('.gz') and entry.inode() == inode:
+                return entry.path
+        return None
+
+    def read_file(self, path, offset, max_bytes):
+        """
+        :return:
+            (list of the complete lines, offset after the last complete line, True if the end was reached)
+        """
+        lines = []
+        is_end = False
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            partial_line = b''
+            while max_bytes > 0:
+                chunk = f.read(min(self.CHUNK_SIZE, max_bytes))
+                if not chunk:
+                    is_end = True
+                    break
+                max_bytes -= len(chunk)
+                chunk_lines = (partial_line + chunk).split(b'\n')
+                partial_line = chunk_lines.pop()
+                offset += sum(len(line) + 1 for line in chunk_lines)
+                lines.extend(line.decode(errors='replace') for line in chunk_lines)
+        return lines, offset, is_end
+
+    def read(self):
+        """
+        Read the new lines, commit() moves the checkpoint after them once they are processed.
+
+        :return:
+            list of the carried over and the new complete lines
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return []
+        inode, offset = self.checkpoint.get()
+        lines = self.checkpoint.get_carry()
+        max_bytes = self.max_bytes
+        if inode is not None and inode != stat.st_ino:
+            rotated_path = self.find_rotated(inode)
+            if rotated_path:
+                rotated_lines, rotated_offset, is_end = self.read_file(rotated_path, offset, max_bytes)
+                lines += rotated_lines
+                if not is_end:
+                    # Finish the rotated file by the next run
+                    self.next_checkpoint = (inode, rotated_offset)
+                    return lines
+                max_bytes -= rotated_offset - offset
+            offset = 0
+        elif offset > stat.st_size:
+            offset = 0
+
+        new_lines, offset, is_end = self.read_file(self.path, offset, max_bytes)
+        self.next_checkpoint = (stat.st_ino, offset)
+        return lines + new_lines
+
+    def commit(self, carry=None):
+        """
+        :param carry:
+            list of the read lines to read again by the next run, e.g. the unfinished last record
+        """
+        if carry and sum(len(line) + 1 for line in carry) > self.MAX_CARRY_SIZE:
+            logging.warning(f'Dropping the {len(carry)} lines carried over in {self.path}, they are too long')
+            carry = None
+        if self.next_checkpoint:
+            self.checkpoint.set(*self.next_checkpoint, carry=carry)
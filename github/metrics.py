@@ -0,0 +1,263 @@
+from __future__ import unicode_literals
+
+__author__ = 'David Baum'
+
+import functools
+import logging
+from time import time, monotonic
+
+import django_rq
+import redis
+from django.conf import settings
+from django.db.models import Count
+from rq import Worker
+from rq.registry import (
+    DeferredJobRegistry,
+    FailedJobRegistry,
+    FinishedJobRegistry,
+    ScheduledJobRegistry,
+    StartedJobRegistry
+)
+
+from github.models import AIGitHubProject
+from github.provisioning import AIProvisioningState
+from github.status import AIProjectStatusCache
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+class AIMetric(object):
+    COUNTER = 'counter'
+    GAUGE = 'gauge'
+    HISTOGRAM = 'histogram'
+
+    def __init__(self, name, metric_type, description, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.type = metric_type
+        self.description = description
+        self.buckets = buckets
+
+
+# The metrics updated by the jobs and kept in Redis between the scrapes
+FETCH_DURATION = AIMetric('ariel_git_fetch_duration_seconds', AIMetric.HISTOGRAM,
+                          'Duration of the remote probes and the fetches of the project repos')
+TRANSFER_DURATION = AIMetric('ariel_git_transfer_duration_seconds', AIMetric.HISTOGRAM,
+                             'Duration of the clones and the fetches which received objects')
+TRANSFER_BYTES = AIMetric('ariel_git_transfer_received_bytes_total', AIMetric.COUNTER,
+                          'Bytes received by the clones and the fetches')
+DEPLOY_DURATION = AIMetric('ariel_deploy_duration_seconds', AIMetric.HISTOGRAM,
+                           'Duration of the deployments by the trigger and the outcome')
+DEPLOY_PHASE_DURATION = AIMetric('ariel_deploy_phase_duration_seconds', AIMetric.HISTOGRAM,
+                                 'Duration of the phases of the application starts')
+CYCLE_DURATION = AIMetric('ariel_scheduler_cycle_duration_seconds', AIMetric.HISTOGRAM,
+                          'Duration of the cycles of the scheduled tasks')
+CYCLE_LAST_RUN = AIMetric('ariel_scheduler_cycle_last_run_timestamp_seconds', AIMetric.GAUGE,
+                          'Unix time of the last finished cycle of the scheduled tasks')
+LOG_SIZE = AIMetric('ariel_project_log_size_bytes', AIMetric.GAUGE,
+                    'Size of the project logs measured by the last log rotation check')
+
+STORED_METRICS = (FETCH_DURATION, TRANSFER_DURATION, TRANSFER_BYTES, DEPLOY_DURATION, DEPLOY_PHASE_DURATION,
+                  CYCLE_DURATION, CYCLE_LAST_RUN, LOG_SIZE)
+
+# The metrics read from the database, the status cache and the RQ registries on the scrape
+PROJECTS = AIMetric('ariel_projects', AIMetric.GAUGE, 'Projects by the provisioning state')
+PROJECTS_RUNNING = AIMetric('ariel_projects_running', AIMetric.GAUGE,
+                            'Ready projects by the cached status, unknown when the status expired')
+QUEUE_JOBS = AIMetric('ariel_rq_queue_jobs', AIMetric.GAUGE, 'Jobs waiting in the RQ queue')
+REGISTRY_JOBS = AIMetric('ariel_rq_registry_jobs', AIMetric.GAUGE, 'Jobs in the RQ registries of the queue')
+FAILED_JOBS = AIMetric('ariel_rq_failed_jobs', AIMetric.GAUGE, 'Failed jobs kept in the RQ failed job registry')
+WORKERS = AIMetric('ariel_rq_workers', AIMetric.GAUGE, 'RQ workers listening on the queue')
+
+
+def format_labels(labels):
+    """
+    :return:
+        the labels in the exposition format without the braces, e.g. 'queue="default",registry="failed"'
+    """
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    return ",".join(f'{key}="{escape(value)}"' for key, value in sorted((labels or {}).items()))
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+class AIMetricsStore(object):
+    """
+    Counters, gauges and histograms in Redis hashes, one per metric, updated by the jobs and read by /metrics.
+
+    The hash fields are the formatted labels, the histogram fields are suffixed with the bucket bound, sum and
+    count. The failures are logged and never break the job reporting the metric.
+    """
+    KEY_PREFIX = 'arielinstaller:metrics'
+
+    def __init__(self):
+        self.connection = redis.Redis(connection_pool=settings.REDIS_POOL)
+
+    def get_key(self, metric):
+        return f'{self.KEY_PREFIX}:{metric.name}'
+
+    def execute(self, pipeline, metric):
+        try:
+            pipeline.execute()
+        except redis.RedisError as e:
+            logging.error(f'Error occurred while saving the metric {metric.name}: {e}')
+
+    def observe(self, metric, values, labels=None):
+        """
+        Add the values to the histogram.
+
+        :param values:
+            list of the observed values
+        """
+        key = self.get_key(metric)
+        label_fields = format_labels(labels)
+        pipeline = self.connection.pipeline(transaction=False)
+        for value in values:
+            for bound in metric.buckets + (float('inf'),):
+                if value <= bound:
+                    pipeline.hincrby(key, f'{label_fields}|{format_value(float(bound))}', 1)
+            pipeline.hincrbyfloat(key, f'{label_fields}|sum', value)
+            pipeline.hincrby(key, f'{label_fields}|count', 1)
+        self.execute(pipeline, metric)
+
+    def inc(self, metric, value=1, labels=None):
+        pipeline = self.connection.pipeline(transaction=False)
+        pipeline.hincrbyfloat(self.get_key(metric), format_labels(labels), value)
+        self.execute(pipeline, metric)
+
+    def set_gauges(self, metric, values, replace=False):
+        """
+        :param values:
+            list of (labels dict, value)
+
+        :param replace:
+            drop the label sets missing in the values, e.g. of the deleted projects
+        """
+        key = self.get_key(metric)
+        pipeline = self.connection.pipeline(transaction=True)
+        if replace:
+            pipeline.delete(key)
+        if values:
+            pipeline.hset(key, mapping={format_labels(labels): value for labels, value in values})
+        self.execute(pipeline, metric)
+
+    def get_samples(self, metric, data):
+        """
+        :return:
+            list of (sample name, labels, value) of the metric hash
+        """
+        data = {field.decode(): float(value) for field, value in data.items()}
+        if metric.type != AIMetric.HISTOGRAM:
+            return [(metric.name, field, value) for field, value in sorted(data.items())]
+
+        series = {}
+        for field, value in data.items():
+            label_fields, suffix = field.rsplit('|', 1)
+            series.setdefault(label_fields, {})[suffix] = value
+        samples = []
+        for label_fields, values in sorted(series.items()):
+            # The buckets in the ascending order of the bounds, as the exposition format expects
+            for bound in metric.buckets + (float('inf'),):
+                bound = format_value(float(bound))
+                bound_labels = f'{label_fields},le="{bound}"' if label_fields else f'le="{bound}"'
+                samples.append((f'{metric.name}_bucket', bound_labels, values.get(bound, 0)))
+            samples.append((f'{metric.name}_sum', label_fields, values.get('sum', 0)))
+            samples.append((f'{metric.name}_count', label_fields, values.get('count', 0)))
+        return samples
+
+    def collect(self):
+        """
+        :return:
+            list of (AIMetric, samples) of the stored metrics
+        """
+        pipeline = self.connection.pipeline(transaction=False)
+        for metric in STORED_METRICS:
+            pipeline.hgetall(self.get_key(metric))
+        return [(metric, self.get_samples(metric, data)) for metric, data in zip(STORED_METRICS, pipeline.execute())]
+
+
+class AIMetricsCollector(object):
+    """
+    Render the installer metrics in the Prometheus text exposition format.
+
+    Nothing is probed on the scrape: the stored metrics come from AIMetricsStore, the project statuses from
+    AIProjectStatusCache and the queue sizes from the RQ registries, which are counted by Redis.
+    """
+    QUEUES = ('default', 'low')
+    REGISTRIES = {
+        'started': StartedJobRegistry,
+        'finished': FinishedJobRegistry,
+        'failed': FailedJobRegistry,
+        'deferred': DeferredJobRegistry,
+        'scheduled': ScheduledJobRegistry,
+    }
+
+    def collect_projects(self):
+        rows = AIGitHubProject.objects.values('provisioning_state').annotate(count=Count('id')).order_by()
+        projects = [(format_labels({'state': row['provisioning_state']}), row['count']) for row in rows]
+
+        ready_ids = list(AIGitHubProject.objects.filter(
+            provisioning_state=AIProvisioningState.READY).values_list('id', flat=True))
+        statuses = AIProjectStatusCache().get_many(ready_ids)
+        running = len([status for status in statuses.values() if status.is_running])
+        projects_running = [
+            (format_labels({'status': 'running'}), running),
+            (format_labels({'status': 'stopped'}), len(statuses) - running),
+            (format_labels({'status': 'unknown'}), len(ready_ids) - len(statuses)),
+        ]
+        return [(PROJECTS, [(PROJECTS.name, labels, value) for labels, value in projects]),
+                (PROJECTS_RUNNING, [(PROJECTS_RUNNING.name, labels, value) for labels, value in projects_running])]
+
+    def collect_queues(self):
+        queue_jobs, registry_jobs, failed_jobs, workers = [], [], [], []
+        for queue_name in self.QUEUES:
+            queue = django_rq.get_queue(queue_name)
+            queue_labels = {'queue': queue_name}
+            queue_jobs.append((QUEUE_JOBS.name, format_labels(queue_labels), queue.count))
+            for registry_name, registry_class in self.REGISTRIES.items():
+                count = registry_class(queue.name, queue.connection).count
+                registry_jobs.append((REGISTRY_JOBS.name,
+                                      format_labels({**queue_labels, 'registry': registry_name}), count))
+                if registry_name == 'failed':
+                    failed_jobs.append((FAILED_JOBS.name, format_labels(queue_labels), count))
+            workers.append((WORKERS.name, format_labels(queue_labels),
+                            Worker.count(connection=queue.connection, queue=queue)))
+        return [(QUEUE_JOBS, queue_jobs), (REGISTRY_JOBS, registry_jobs), (FAILED_JOBS, failed_jobs),
+                (WORKERS, workers)]
+
+    def render(self):
+        """
+        :return:
+            the exposition text, the redis.RedisError is raised when Redis is not available
+        """
+        lines = []
+        for metric, samples in self.collect_projects() + self.collect_queues() + AIMetricsStore().collect():
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in samples:
+                lines.append(f'{name}{{{labels}}} {format_value(value)}' if labels else
+                             f'{name} {format_value(value)}')
+        return "\n".join(lines) + "\n"
+
+
+def measure_cycle(task_name):
+    """Record the duration and the finish time of every cycle of the decorated scheduled task."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started_at = monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                store = AIMetricsStore()
+                store.observe(CYCLE_DURATION, [monotonic() - started_at], {'task': task_name})
+                store.set_gauges(CYCLE_LAST_RUN, [({'task': task_name}, time())])
+        return wrapper
+    return decorator
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.2 on 2026-10-17 20:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('github', '0003_aigithubproject_last_commit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aigithubproject',
+            name='last_deploy_plan',
+            field=models.CharField(blank=True, max_length=16, null=True, verbose_name='Last deploy plan'),
+        ),
+        migrations.AddField(
+            model_name='aigithubproject',
+            name='last_deploy_plan_reason',
+            field=models.TextField(blank=True, null=True, verbose_name='Last deploy plan reason'),
+        ),
+        migrations.AddField(
+            model_name='aigithubproject',
+            name='watch_paths',
+            field=models.TextField(blank=True, help_text='Paths or glob patterns, one per line, whose changes are deployed. Empty - every file', null=True, verbose_name='Watch paths'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.2 on 2026-10-17 20:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('github', '0004_aigithubproject_last_deploy_plan_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aigithubproject',
+            name='health_check_path',
+            field=models.CharField(default='/', help_text='HTTP path answering below 500 when the application is ready', max_length=255, verbose_name='Health check path'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.2 on 2026-10-17 20:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('github', '0005_aigithubproject_health_check_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aigithubproject',
+            name='clone_depth',
+            field=models.PositiveIntegerField(blank=True, help_text='Number of the latest commits to clone and fetch, 0 - the full history. Empty - the global GIT_CLONE_DEPTH', null=True, verbose_name='Clone depth'),
+        ),
+        migrations.AddField(
+            model_name='aigithubproject',
+            name='clone_filter',
+            field=models.CharField(blank=True, help_text='Partial clone filter, e.g. blob:none or blob:limit=1m. Empty - the global GIT_CLONE_FILTER', max_length=64, null=True, verbose_name='Clone filter'),
+        ),
+    ]
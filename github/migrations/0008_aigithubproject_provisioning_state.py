@@ -0,0 +1,18 @@
+# Generated by Django 4.2.2 on 2026-10-17 21:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('github', '0007_aigithubproject_family'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aigithubproject',
+            name='provisioning_state',
+            field=models.CharField(default='ready', help_text='The new projects are cloned by a background job', max_length=16, verbose_name='Provisioning state'),
+        ),
+    ]
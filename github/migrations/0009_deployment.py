@@ -0,0 +1,43 @@
+# Generated by Django 4.2.2 on 2026-10-17 21:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('github', '0008_aigithubproject_provisioning_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIDeployment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigger', models.CharField(max_length=16, verbose_name='Trigger')),
+                ('previous_commit', models.CharField(blank=True, max_length=255, null=True, verbose_name='Previous commit')),
+                ('commit', models.CharField(blank=True, max_length=255, null=True, verbose_name='Commit')),
+                ('plan', models.CharField(blank=True, max_length=16, null=True, verbose_name='Plan')),
+                ('plan_reason', models.TextField(blank=True, null=True, verbose_name='Plan reason')),
+                ('outcome', models.CharField(default='running', max_length=16, verbose_name='Outcome')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='Error')),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Started at')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finished at')),
+                ('duration', models.FloatField(blank=True, help_text='Seconds', null=True, verbose_name='Duration')),
+                ('kill_duration', models.FloatField(blank=True, help_text='Seconds to stop the running application', null=True, verbose_name='Kill')),
+                ('venv_duration', models.FloatField(blank=True, help_text='Seconds to create the virtual env', null=True, verbose_name='Virtual env')),
+                ('pip_duration', models.FloatField(blank=True, help_text='Seconds to install the requirements', null=True, verbose_name='Pip')),
+                ('boot_duration', models.FloatField(blank=True, help_text='Seconds to start the gunicorn master', null=True, verbose_name='Gunicorn boot')),
+                ('ready_duration', models.FloatField(blank=True, help_text='Seconds from the start to the application answering', null=True, verbose_name='Time to ready')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deployments', to='github.aigithubproject', verbose_name='Project')),
+            ],
+            options={
+                'verbose_name': 'Deployment',
+                'verbose_name_plural': 'Deployments',
+                'ordering': ['-started_at'],
+                'indexes': [models.Index(fields=['project', '-started_at'], name='github_aide_project_df1861_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.2 on 2026-10-17 21:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('github', '0009_deployment'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='aigithubproject',
+            name='family',
+            field=models.CharField(blank=True, help_text='Projects of the same family, e.g. the forks of one template, share the git objects. Empty - the owner and the repo name', max_length=100, null=True, verbose_name='Family'),
+        ),
+    ]
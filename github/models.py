@@ -4,11 +4,15 @@ __author__ = 'David Baum'
 
 from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from github.deployments import AIDeploymentOutcome, AIDeployPhase
 from github.fields import GitURLField
-from github.utils import RepoTools, AIApplicationRunner
+from github.liveness import get_listening_ports_snapshot
+from github.provisioning import AIProvisioningState
 
 
 class AIGitHubProject(models.Model):
@@ -30,6 +34,24 @@ class AIGitHubProject(models.Model):
     git_password = models.CharField(_('Git password'), max_length=128, blank=True, null=True)
     last_commit = models.CharField(_('Last commit'), max_length=255, blank=True, null=True)
     last_error = models.TextField(null=True, blank=True, help_text=_("Last processing task error"))
+    watch_paths = models.TextField(_('Watch paths'), blank=True, null=True,
+                                   help_text=_('Paths or glob patterns, one per line, whose changes are deployed. '
+                                               'Empty - every file'))
+    health_check_path = models.CharField(_('Health check path'), max_length=255, default='/',
+                                         help_text=_('HTTP path answering below 500 when the application is ready'))
+    clone_depth = models.PositiveIntegerField(_('Clone depth'), blank=True, null=True,
+                                              help_text=_('Number of the latest commits to clone and fetch, 0 - the '
+                                                          'full history. Empty - the global GIT_CLONE_DEPTH'))
+    clone_filter = models.CharField(_('Clone filter'), max_length=64, blank=True, null=True,
+                                    help_text=_('Partial clone filter, e.g. blob:none or blob:limit=1m. '
+                                                'Empty - the global GIT_CLONE_FILTER'))
+    family = models.CharField(_('Family'), max_length=100, blank=True, null=True,
+                              help_text=_('Projects of the same family, e.g. the forks of one template, share '
+                                          'the git objects. Empty - the owner and the repo name'))
+    provisioning_state = models.CharField(_('Provisioning state'), max_length=16, default=AIProvisioningState.READY,
+                                          help_text=_('The new projects are cloned by a background job'))
+    last_deploy_plan = models.CharField(_('Last deploy plan'), max_length=16, blank=True, null=True)
+    last_deploy_plan_reason = models.TextField(_('Last deploy plan reason'), blank=True, null=True)
 
     class Meta:
         verbose_name_plural = _("Projects")
@@ -38,26 +60,93 @@ class AIGitHubProject(models.Model):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.is_cleaned = False
+        # Not read from the deferred field
+        self.original_url = self.__dict__.get('url')
+        # The URL the repo was cloned from before the URL was changed, its checkout is removed by the clone job
+        self.previous_url = None
 
     def __str__(self):
         return "%s" % self.name
 
+    @property
+    def is_ready(self):
+        return self.provisioning_state == AIProvisioningState.READY
+
     def clean(self):
         self.is_cleaned = True
         self.last_error = None
-        is_already_running = AIApplicationRunner(self).is_application_running()
+        is_already_running = get_listening_ports_snapshot(max_age=0).is_listening(self.port)
         if is_already_running:
             raise ValidationError(f"Another process is already running on the port {self.port}")
-
-        repo_tools = RepoTools(project=self)
-        repo_tools.pygit2_clone_repo()
-
-        if self.last_error:
-            raise ValidationError(f"An error occurred while cloning the project: {self.last_error}")
         super(AIGitHubProject, self).clean()
 
     def save(self, *args, **kwargs):
         if not self.is_cleaned:
             self.full_clean()
             self.is_cleaned = True
+        is_url_changed = self.original_url is not None and self.__dict__.get('url') != self.original_url
+        if self.pk is None or is_url_changed:
+            # The repo is cloned by the clone_project_task enqueued on commit, see github.signals
+            self.provisioning_state = AIProvisioningState.PENDING
+        if is_url_changed:
+            self.previous_url = self.original_url
         super(AIGitHubProject, self).save(*args, **kwargs)
+        self.original_url = self.__dict__.get('url')
+
+
+class AIDeployment(models.Model):
+    project = models.ForeignKey(AIGitHubProject, on_delete=models.CASCADE, related_name='deployments',
+                                verbose_name=_('Project'))
+    trigger = models.CharField(_('Trigger'), max_length=16)
+    previous_commit = models.CharField(_('Previous commit'), max_length=255, blank=True, null=True)
+    commit = models.CharField(_('Commit'), max_length=255, blank=True, null=True)
+    plan = models.CharField(_('Plan'), max_length=16, blank=True, null=True)
+    plan_reason = models.TextField(_('Plan reason'), blank=True, null=True)
+    outcome = models.CharField(_('Outcome'), max_length=16, default=AIDeploymentOutcome.RUNNING)
+    error = models.TextField(_('Error'), blank=True, null=True)
+    started_at = models.DateTimeField(_('Started at'), default=timezone.now)
+    finished_at = models.DateTimeField(_('Finished at'), blank=True, null=True)
+    duration = models.FloatField(_('Duration'), blank=True, null=True, help_text=_('Seconds'))
+    kill_duration = models.FloatField(_('Kill'), blank=True, null=True,
+                                      help_text=_('Seconds to stop the running application'))
+    venv_duration = models.FloatField(_('Virtual env'), blank=True, null=True,
+                                      help_text=_('Seconds to create the virtual env'))
+    pip_duration = models.FloatField(_('Pip'), blank=True, null=True,
+                                     help_text=_('Seconds to install the requirements'))
+    boot_duration = models.FloatField(_('Gunicorn boot'), blank=True, null=True,
+                                      help_text=_('Seconds to start the gunicorn master'))
+    ready_duration = models.FloatField(_('Time to ready'), blank=True, null=True,
+                                       help_text=_('Seconds from the start to the application answering'))
+
+    class Meta:
+        verbose_name_plural = _("Deployments")
+        verbose_name = _("Deployment")
+        ordering = ['-started_at']
+        indexes = [models.Index(fields=['project', '-started_at'])]
+
+    def __str__(self):
+        return f"{self.project_id} {self.trigger} {self.started_at:%Y-%m-%d %H:%M:%S}"
+
+    def get_durations_display(self):
+        durations = [(phase, getattr(self, f'{phase}_duration')) for phase in AIDeployPhase.ALL]
+        return ", ".join(f'{phase} {duration:.2f}s' for phase, duration in durations if duration is not None) or '-'
+
+    def finish(self, outcome, error=None, durations=None):
+        """
+        Save the outcome and the phase durations of the deployment and forget the oldest ones of the project.
+
+        :param durations:
+            dict of AIDeployPhase -> seconds
+        """
+        self.outcome = outcome
+        self.error = error
+        self.finished_at = timezone.now()
+        self.duration = (self.finished_at - self.started_at).total_seconds()
+        for phase in AIDeployPhase.ALL:
+            setattr(self, f'{phase}_duration', (durations or {}).get(phase))
+        self.save()
+
+        expired_ids = type(self).objects.filter(project_id=self.project_id).values_list('id', flat=True)[
+            settings.DEPLOYMENT_HISTORY_SIZE:]
+        if expired_ids:
+            type(self).objects.filter(id__in=list(expired_ids)).delete()
@@ -0,0 +1,92 @@
+from __future__ import unicode_literals
+
+__author__ = 'David Baum'
+
+import logging
+from time import time
+
+import redis
+from django.conf import settings
+
+
+class AIProvisioningState(object):
+    # The clone job is queued
+    PENDING = 'pending'
+    CLONING = 'cloning'
+    READY = 'ready'
+    FAILED = 'failed'
+
+
+class AIProjectNotReadyError(Exception):
+    """The repo of the project is not cloned yet, is being cloned again or failed to clone."""
+
+    def __init__(self, project):
+        self.project = project
+        super().__init__(f'The project {project.name} is {project.provisioning_state}, its repo is not ready')
+
+
+class AICloneProgress(object):
+    """
+    Progress of the project clone job in a Redis hash, polled by the admin.
+
+    The hash keeps the provisioning state, the percentage, the received objects and bytes and the error of
+    the failed clone. It expires PROGRESS_TTL seconds after the last update.
+    """
+    KEY_PREFIX = 'arielinstaller:clone-progress'
+    PROGRESS_TTL = 24 * 60 * 60
+
+    def __init__(self, project_id):
+        self.project_id = project_id
+        self.connection = redis.Redis(connection_pool=settings.REDIS_POOL)
+
+    @property
+    def key(self):
+        return f'{self.KEY_PREFIX}:{self.project_id}'
+
+    def save(self, mapping, reset=False):
+        try:
+            pipeline = self.connection.pipeline(transaction=True)
+            if reset:
+                pipeline.delete(self.key)
+            pipeline.hset(self.key, mapping={**mapping, 'updated_at': time()})
+            pipeline.expire(self.key, self.PROGRESS_TTL)
+            pipeline.execute()
+        except redis.RedisError as e:
+            # The clone goes on without the progress
+            logging.error(f'Error occurred while saving the clone progress of the project {self.project_id}: {e}')
+
+    def start(self):
+        self.save({'state': AIProvisioningState.CLONING, 'percentage': 0, 'started_at': time()}, reset=True)
+
+    def update(self, percentage, received_objects=0, total_objects=0, received_bytes=0):
+        self.save({
+            'percentage': percentage,
+            'received_objects': received_objects,
+            'total_objects': total_objects,
+            'received_bytes': received_bytes,
+        })
+
+    def finish(self, state, error=None):
+        mapping = {'state': state, 'error': error or ''}
+        if state == AIProvisioningState.READY:
+            mapping['percentage'] = 100
+        self.save(mapping)
+
+    def get(self):
+        """
+        :return:
+            dict of the progress, empty if there is no clone in progress or recently finished
+        """
+        try:
+            data = self.connection.hgetall(self.key)
+        except redis.RedisError as e:
+            logging.error(f'Error occurred while reading the clone progress of the project {self.project_id}: {e}')
+            return {}
+        data = {key.decode(): value.decode(errors='replace') for key, value in data.items()}
+        for field in ('percentage', 'received_objects', 'total_objects', 'received_bytes'):
+            if field in data:
+                data[field] = int(data[field])
+        for field in ('started_at', 'updated_at'):
+            if field in data:
+                data[field] = float(data[field])
+        return data
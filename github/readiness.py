@@ -0,0 +1,164 @@
+from __future__ import unicode_literals
+
+__author__ = 'David Baum'
+
+import http.client
+import os
+import re
+from time import sleep, monotonic
+
+from github.liveness import get_listening_ports_snapshot
+
+
+class AIReadinessResult(object):
+    def __init__(self, is_ready, duration, error=None):
+        self.is_ready = is_ready
+        self.duration = duration
+        self.error = error
+
+    def __bool__(self):
+        return self.is_ready
+
+    def __str__(self):
+        if self.is_ready:
+            return f'ready in {self.duration:.2f} seconds'
+        return f'not ready after {self.duration:.2f} seconds: {self.error}'
+
+
+class AIReadinessWaiter(object):
+    """
+    Wait for the started application to listen on its port and, optionally, to answer an HTTP path.
+
+    The checks are polled with the exponential backoff up to the deadline. The boot failures are detected
+    early, by the exit of the master or by the gunicorn messages in the new part of the error log, and the
+    tail of the error log is returned as the error.
+    """
+    INITIAL_DELAY = 0.05
+    MAX_DELAY = 1
+    HTTP_TIMEOUT = 2
+    ERROR_LOG_TAIL_LINES = 20
+    BOOT_FAILURE_MARKERS = ('Worker failed to boot', 'Shutting down: Master', 'App failed to load')
+    LISTENING_RE = re.compile(r'\[(\d+)\] \[INFO\] Listening at: (\S+)')
+
+    def __init__(self, port, http_path=None, timeout=300, error_log_path=None, error_log_offset=0,
+                 pid_reader=None, is_alive=None):
+        """
+        :param http_path:
+            the path answering with a status below 500 when the application is ready, None checks the port only
+
+        :param error_log_offset:
+            the size of the error log before the start, only the lines written after it are checked
+
+        :param pid_reader:
+            callable returning the master pid or None when the pid file is not written yet
+
+        :param is_alive:
+            callable checking the pid is alive
+        """
+        self.port = port
+        self.http_path = http_path
+        self.timeout = timeout
+        self.error_log_path = error_log_path
+        self.error_log_offset = error_log_offset
+        self.pid_reader = pid_reader
+        self.is_alive = is_alive
+        self.master_pid = None
+
+    @staticmethod
+    def get_log_offset(log_path):
+        try:
+            return os.path.getsize(log_path)
+        except OSError:
+            return 0
+
+    def read_new_error_log(self):
+        if not self.error_log_path:
+            return ''
+        try:
+            with open(self.error_log_path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size < self.error_log_offset:
+                    # The log was truncated or replaced since the start
+                    self.error_log_offset = 0
+                f.seek(self.error_log_offset)
+                return f.read().decode(errors='replace')
+        except OSError:
+            return ''
+
+    def get_error_log_tail(self):
+        lines = self.read_new_error_log().splitlines()
+        return '\n'.join(lines[-self.ERROR_LOG_TAIL_LINES:])
+
+    def get_boot_failure(self):
+        """
+        :return:
+            the reason of the failed boot or None while the application may still get ready
+        """
+        if self.pid_reader and self.is_alive:
+            # The master removes its pid file when it exits
+            self.master_pid = self.pid_reader() or self.master_pid
+            if self.master_pid and not self.is_alive(self.master_pid):
+                return f'The master {self.master_pid} exited'
+
+        # The log is shared with the masters of the previous releases, which may be shutting down now
+        lines = self.read_new_error_log().splitlines()
+        master_pids = self.get_listening_master_pids(lines)
+        if self.master_pid:
+            master_pids.add(str(self.master_pid))
+        for line in lines:
+            if any(marker in line for marker in self.BOOT_FAILURE_MARKERS) and \
+                    any(f'[{pid}]' in line for pid in master_pids):
+                return line
+        return None
+
+    def get_listening_master_pids(self, lines):
+        """
+        :return:
+            set of the pids of the masters which logged they listen on the port
+        """
+        master_pids = set()
+        for line in lines:
+            match = self.LISTENING_RE.search(line)
+            if match and any(address.endswith(f':{self.port}') for address in match.group(2).split(',')):
+                master_pids.add(match.group(1))
+        return master_pids
+
+    def is_listening(self):
+        return get_listening_ports_snapshot(max_age=0).is_listening(self.port)
+
+    def is_http_ready(self):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=self.HTTP_TIMEOUT)
+        try:
+            connection.request('GET', self.http_path)
+            return connection.getresponse().status < 500
+        except (OSError, http.client.HTTPException):
+            return False
+        finally:
+            connection.close()
+
+    def wait(self):
+        """
+        :return:
+            AIReadinessResult object with the measured time to ready
+        """
+        started_at = monotonic()
+        deadline = started_at + self.timeout
+        delay = self.INITIAL_DELAY
+        while True:
+            if self.is_listening() and (not self.http_path or self.is_http_ready()):
+                return AIReadinessResult(True, monotonic() - started_at)
+
+            failure = self.get_boot_failure()
+            if failure:
+                return AIReadinessResult(False, monotonic() - started_at, self.format_error(failure))
+
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return AIReadinessResult(False, monotonic() - started_at, self.format_error(
+                    f'Not ready on port {self.port}{f" at {self.http_path}" if self.http_path else ""} '
+                    f'in {self.timeout} seconds'))
+            sleep(min(delay, remaining))
+            delay = min(delay * 2, self.MAX_DELAY)
+
+    def format_error(self, reason):
+        tail = self.get_error_log_tail()
+        return f'{reason}\n{tail}' if tail else reason
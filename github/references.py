@@ -0,0 +1,224 @@
+from __future__ import unicode_literals
+
+__author__ = 'David Baum'
+
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import shutil
+from contextlib import contextmanager
+
+from django.conf import settings
+from git import Repo
+from uritools import urisplit
+
+
+class AIReferenceRepo(object):
+    """
+    Bare repository sharing the git objects of a family of projects, e.g. the forks of one template.
+
+    The checkouts of the family borrow the objects of the reference through their objects/info/alternates, so
+    the clone of the next fork downloads and stores only the objects the reference misses. The full checkouts
+    feed their commits back into the reference under refs/checkouts/<checkout key>/. Any object of the
+    reference may be borrowed, so the reference never prunes them, gc.pruneExpire is never and its own gc keeps
+    the unreachable objects. The reference is removed when no checkout borrows from it anymore.
+    """
+    BORROWERS_FILE = 'borrowers'
+    CHECKOUT_REFS = 'refs/checkouts/{key}'
+
+    def __init__(self, family, root=None):
+        self.family = self.normalize_family(family)
+        self.root = os.path.abspath(root or settings.GIT_REFERENCES_DIR)
+        self.path = os.path.join(self.root, f'{self.family}.git')
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def normalize_family(family):
+        family = re.sub(r'[^a-z0-9._-]+', '-', (family or '').lower()).strip('.-')
+        return family or 'default'
+
+    @staticmethod
+    def get_default_family(url):
+        """
+        :return:
+            the owner and the repo name of the URL, the same repo cloned by different URL forms shares the family,
+            the repos of the same name of different owners do not
+        """
+        # The scp-like SSH URLs, e.g. git@github.com:owner/repo.git, are not split by urisplit
+        path = (urisplit(url).path or '').replace(':', '/').rstrip('/')
+        path = path[:-len('.git')] if path.endswith('.git') else path
+        return '/'.join(path.split('/')[-2:]).strip('/')
+
+    @classmethod
+    def for_project(cls, project):
+        return cls(getattr(project, 'family', None) or cls.get_default_family(project.url))
+
+    @classmethod
+    def get_all(cls, root=None):
+        root = os.path.abspath(root or settings.GIT_REFERENCES_DIR)
+        if not os.path.isdir(root):
+            return []
+        return [cls(name[:-len('.git')], root) for name in sorted(os.listdir(root)) if name.endswith('.git')]
+
+    @property
+    def objects_dir(self):
+        return os.path.join(self.path, 'objects')
+
+    @staticmethod
+    def get_checkout_key(local_dir):
+        return hashlib.sha1(os.path.abspath(local_dir).encode()).hexdigest()[:16]
+
+    @staticmethod
+    def get_alternates_path(local_dir):
+        return os.path.join(local_dir, '.git', 'objects', 'info', 'alternates')
+
+    @contextmanager
+    def lock(self):
+        with open(os.path.join(self.root, f'.{self.family}.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, 'HEAD'))
+
+    def create(self):
+        repo = Repo.init(self.path, bare=True, mkdir=True)
+        with repo.config_writer() as config:
+            # A checkout may borrow any object, the unreachable ones included
+            config.set_value('gc', 'pruneExpire', 'never')
+            config.set_value('gc', 'auto', '0')
+        logging.info(f'Created the reference repo {self.path}')
+
+    def get_tips(self):
+        """
+        :return:
+            list of hexsha of the commits fed into the reference
+        """
+        if not self.exists():
+            return []
+        output = Repo(self.path).git.for_each_ref('--format=%(objectname)', 'refs/checkouts/')
+        return sorted(set(output.split()))
+
+    def get_borrowers(self):
+        borrowers_path = os.path.join(self.path, self.BORROWERS_FILE)
+        if not os.path.exists(borrowers_path):
+            return []
+        with open(borrowers_path, 'r') as f:
+            return [line.strip() for line in f if line.strip()]
+
+    def set_borrowers(self, borrowers):
+        borrowers_path = os.path.join(self.path, self.BORROWERS_FILE)
+        with open(f'{borrowers_path}.tmp', 'w') as f:
+            f.writelines(f'{borrower}\n' for borrower in borrowers)
+        os.replace(f'{borrowers_path}.tmp', borrowers_path)
+
+    def is_borrowed_by(self, local_dir):
+        try:
+            with open(self.get_alternates_path(local_dir), 'r') as f:
+                return self.objects_dir in (line.strip() for line in f)
+        except OSError:
+            return False
+
+    def link(self, local_dir):
+        """
+        Make the checkout borrow the objects of the reference. Must be called under the lock.
+
+        :return:
+            True if the checkout did not borrow from the reference before
+        """
+        if not self.exists():
+            self.create()
+        borrowers = self.get_borrowers()
+        if local_dir not in borrowers:
+            # Registered before the alternates are written, the reference is never removed under a borrower
+            self.set_borrowers(borrowers + [local_dir])
+        if self.is_borrowed_by(local_dir):
+            return False
+
+        alternates_path = self.get_alternates_path(local_dir)
+        os.makedirs(os.path.dirname(alternates_path), exist_ok=True)
+        with open(alternates_path, 'a') as f:
+            f.write(f'{self.objects_dir}\n')
+        return True
+
+    def feed(self, local_dir):
+        """
+        Fetch the commits of the full checkout into the reference. Must be called under the lock.
+        """
+        refs = self.CHECKOUT_REFS.format(key=self.get_checkout_key(local_dir))
+        Repo(self.path).git.fetch('--no-tags', '--prune', '--quiet', local_dir, f'+refs/remotes/origin/*:{refs}/*')
+
+    def attach(self, local_dir, feed=True, repack=False):
+        """
+        Link the checkout to the reference and drop its own copies of the shared objects.
+
+        :param feed:
+            fetch the commits of the checkout into the reference, only the full clones may feed it
+
+        :param repack:
+            repack the checkout without the borrowed objects even if it was linked before
+
+        :return:
+            True if the checkout was linked now
+        """
+        with self.lock():
+            is_linked = self.link(local_dir)
+            if feed:
+                self.feed(local_dir)
+            if is_linked or repack:
+                # -l leaves out the objects available from the alternates
+                Repo(local_dir).git.repack('-a', '-d', '-l', '-q')
+        if is_linked:
+            logging.info(f'The repo {local_dir} borrows the objects of the reference repo {self.path}')
+        return is_linked
+
+    def release(self, local_dir):
+        """
+        Forget the removed checkout and remove the reference when nobody borrows from it anymore.
+
+        :return:
+        """
+        with self.lock():
+            if not self.exists():
+                return
+            refs = self.CHECKOUT_REFS.format(key=self.get_checkout_key(local_dir))
+            repo = Repo(self.path)
+            for ref in repo.git.for_each_ref('--format=%(refname)', f'{refs}/').split():
+                repo.git.update_ref('-d', ref)
+            self.set_borrowers([borrower for borrower in self.get_borrowers() if borrower != local_dir])
+            self.remove_if_unused()
+
+    def remove_if_unused(self):
+        """
+        Must be called under the lock.
+
+        :return:
+            True if the reference was removed
+        """
+        if any(self.is_borrowed_by(borrower) for borrower in self.get_borrowers()):
+            return False
+        logging.info(f'Removing the reference repo {self.path}, nobody borrows its objects')
+        shutil.rmtree(self.path, ignore_errors=True)
+        return True
+
+    def gc(self):
+        """
+        Repack the reference keeping the unreachable objects, the borrowers may still use them.
+
+        :return:
+        """
+        with self.lock():
+            if not self.exists():
+                return
+            # The checkouts removed by hand or cloned again without the reference
+            self.set_borrowers([borrower for borrower in self.get_borrowers() if self.is_borrowed_by(borrower)])
+            if self.remove_if_unused():
+                return
+            repo = Repo(self.path)
+            repo.git.repack('-a', '-d', '--keep-unreachable', '-q')
+            repo.git.pack_refs('--all')
@@ -0,0 +1,193 @@
+from __future__ import unicode_literals
+
+__author__ = 'David Baum'
+
+import fcntl
+import logging
+import os
+import shutil
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from django.conf import settings
+from git import GitCommandError, Repo
+
+
+class AIReleaseError(Exception):
+    pass
+
+
+class AIRelease(object):
+    """A checkout of one commit of the project in its releases dir."""
+
+    def __init__(self, path, activated_at, is_current=False):
+        self.path = path
+        self.commit = os.path.basename(path)
+        self.activated_at = activated_at
+        self.is_current = is_current
+
+    @property
+    def activated_at_datetime(self):
+        return datetime.fromtimestamp(self.activated_at, tz=timezone.utc)
+
+    @property
+    def env_path(self):
+        """
+        :return:
+            path of the cached virtual env the release is linked to or None
+        """
+        link_path = os.path.join(self.path, '.env')
+        if not os.path.islink(link_path):
+            return None
+        return os.path.realpath(link_path)
+
+
+class AIReleaseStore(object):
+    """
+    Release dirs of a project addressed by commit with an atomic "current" symlink to the running one.
+
+    Every release is a detached git worktree of the project repo with its own .env link to the cached virtual
+    env, so the env of a kept release is not evicted. The application is started in the "current" link, which
+    is swapped by os.replace(), and the last kept releases make the rollback a pointer swap and a restart.
+    """
+    CURRENT_LINK = 'current'
+    ACTIVATED_MARKER = '.release-activated'
+
+    def __init__(self, local_dir, root=None):
+        """
+        :param local_dir:
+            the project repo, the releases are kept under the same relative path in the root
+        """
+        self.local_dir = os.path.abspath(local_dir)
+        self.root = os.path.abspath(root or settings.GIT_RELEASES_DIR)
+        self.path = os.path.join(self.root, os.path.relpath(self.local_dir, os.path.abspath(settings.GIT_REPOS_DIR)))
+
+    @property
+    def current_path(self):
+        return os.path.join(self.path, self.CURRENT_LINK)
+
+    def get_release_path(self, commit):
+        return os.path.join(self.path, commit)
+
+    @contextmanager
+    def lock(self):
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_current(self):
+        """
+        :return:
+            path of the release the current link points to or None
+        """
+        if not os.path.islink(self.current_path) or not os.path.isdir(self.current_path):
+            return None
+        return os.path.realpath(self.current_path)
+
+    def get_current_commit(self):
+        current = self.get_current()
+        return os.path.basename(current) if current else None
+
+    def get_releases(self):
+        """
+        :return:
+            list of AIRelease objects, the most recently activated first
+        """
+        if not os.path.isdir(self.path):
+            return []
+        current = self.get_current()
+        releases = []
+        for entry in os.scandir(self.path):
+            if entry.name.startswith('.') or entry.name == self.CURRENT_LINK or entry.is_symlink() or \
+                    not entry.is_dir():
+                continue
+            marker_path = os.path.join(entry.path, self.ACTIVATED_MARKER)
+            activated_at = os.path.getmtime(marker_path) if os.path.exists(marker_path) else entry.stat().st_mtime
+            releases.append(AIRelease(entry.path, activated_at, is_current=os.path.realpath(entry.path) == current))
+        return sorted(releases, key=lambda release: release.activated_at, reverse=True)
+
+    def get_release(self, commit):
+        return next((release for release in self.get_releases() if release.commit == commit), None)
+
+    def get_previous(self):
+        """
+        :return:
+            the most recently activated release but the current one or None
+        """
+        return next((release for release in self.get_releases() if not release.is_current), None)
+
+    def prepare(self, commit):
+        """
+        Check out the commit into its release dir unless it is there already.
+
+        :return:
+            path of the release
+        """
+        path = self.get_release_path(commit)
+        with self.lock():
+            if os.path.exists(os.path.join(path, '.git')) and \
+                    os.path.isdir(os.path.join(self.local_dir, '.git', 'worktrees', commit)):
+                return path
+            if os.path.exists(path):
+                # Leftover of the interrupted checkout
+                shutil.rmtree(path)
+            logging.info(f'Checking out the release {commit} of {self.local_dir}')
+            repo = Repo(self.local_dir)
+            try:
+                repo.git.worktree('prune')
+                repo.git.worktree('add', '--detach', path, commit)
+            except GitCommandError as e:
+                shutil.rmtree(path, ignore_errors=True)
+                raise AIReleaseError(f'The release {commit} of {self.local_dir} was not checked out: {e}')
+        return path
+
+    def activate(self, path):
+        """
+        Point the current link to the release atomically, the running application keeps its release until restart.
+
+        :return:
+            path of the previously current release or None
+        """
+        with self.lock():
+            previous = self.get_current()
+            tmp_link_path = f'{self.current_path}.{os.getpid()}.tmp'
+            if os.path.lexists(tmp_link_path):
+                os.unlink(tmp_link_path)
+            os.symlink(os.path.basename(path), tmp_link_path)
+            os.replace(tmp_link_path, self.current_path)
+            marker_path = os.path.join(path, self.ACTIVATED_MARKER)
+            with open(marker_path, 'a'):
+                os.utime(marker_path)
+        logging.info(f'Activated the release {os.path.basename(path)} of {self.local_dir}')
+        return previous
+
+    def prune(self, keep):
+        """
+        Remove all the releases but the current one and the last activated ones.
+
+        :return:
+            list of the removed release paths
+        """
+        removed = []
+        with self.lock():
+            for release in self.get_releases()[keep:]:
+                if release.is_current:
+                    continue
+                logging.info(f'Removing the release {release.commit} of {self.local_dir}')
+                try:
+                    Repo(self.local_dir).git.worktree('remove', '--force', release.path)
+                except GitCommandError as e:
+                    logging.error(f'Error occurred while removing the worktree {release.path}: {e}')
+                    shutil.rmtree(release.path, ignore_errors=True)
+                removed.append(release.path)
+        return removed
+
+    def delete(self):
+        """Remove all the releases, the worktrees metadata goes with the project repo."""
+        if os.path.exists(self.path):
+            logging.info(f'Removing the releases {self.path}')
+            shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,218 @@
+from __future__ import unicode_literals
+
+__author__ = 'David Baum'
+
+import gzip
+import logging
+import os
+import shutil
+import signal
+from datetime import datetime
+from time import time
+
+import redis
+from django.conf import settings
+
+from github.logs import AILogCheckpoint
+
+
+class AILogArchive(object):
+    ROTATED_AT_FORMAT = '%Y%m%d-%H%M%S-%f'
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        stat = os.stat(path)
+        self.inode = stat.st_ino
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.ctime = stat.st_ctime
+
+    @property
+    def rotated_at(self):
+        """
+        :return:
+            time of the rename by the rotation, the mtime is the time of the last line written before it
+        """
+        name = self.name[:-len('.gz')] if self.is_compressed else self.name
+        try:
+            return datetime.strptime(name.rsplit('.', 1)[-1], self.ROTATED_AT_FORMAT).timestamp()
+        except ValueError:
+            # The rename updates the ctime
+            return self.ctime
+
+    @property
+    def is_compressed(self):
+        return self.name.endswith('.gz')
+
+    @property
+    def modified_at(self):
+        return datetime.fromtimestamp(self.mtime)
+
+
+class AILogRotator(object):
+    """
+    Rotate the project logs into gzip archives under logs/archive without restarting the application.
+
+    A log is rotated when it exceeds settings.LOG_ROTATE_MAX_SIZE or was last rotated more than
+    settings.LOG_ROTATE_INTERVAL seconds ago. The log is renamed and the gunicorn master is told to reopen its
+    log files by USR1. The renamed log is compressed by a later pass, once the workers had time to reopen it
+    and the log readers of the analytics read its rest, a reader left behind loses the rest after
+    UNREAD_GRACE_PERIOD seconds. The archives older than settings.LOG_ARCHIVE_RETENTION seconds or beyond
+    settings.LOG_ARCHIVE_MAX_SIZE per project are removed.
+    """
+    ARCHIVE_DIR = 'archive'
+    ROTATED_MARKER = '.{log_name}.rotated'
+    # Seconds the workers get to reopen the log before the renamed one is compressed
+    REOPEN_GRACE_PERIOD = 10
+    # Seconds the log readers get to read the rest of the renamed log before it is compressed anyway
+    UNREAD_GRACE_PERIOD = 60 * 60
+    # The checkpoint consumers of AIAccessLogAnalyzer and AIErrorLogAnalyzer, which read the uncompressed archives
+    LOG_CONSUMERS = ('traffic', 'tracebacks')
+
+    def __init__(self, runner):
+        self.runner = runner
+        self.logs_dir = os.path.dirname(runner.access_log_path)
+        self.archive_dir = os.path.join(self.logs_dir, self.ARCHIVE_DIR)
+        os.makedirs(self.archive_dir, exist_ok=True)
+
+    @property
+    def log_paths(self):
+        return [self.runner.access_log_path, self.runner.error_log_path]
+
+    def get_marker_path(self, log_path):
+        return os.path.join(self.archive_dir, self.ROTATED_MARKER.format(log_name=os.path.basename(log_path)))
+
+    def get_last_rotated_at(self, log_path):
+        marker_path = self.get_marker_path(log_path)
+        if not os.path.exists(marker_path):
+            open(marker_path, 'a').close()
+        return os.path.getmtime(marker_path)
+
+    def should_rotate(self, log_path, force=False):
+        try:
+            size = os.path.getsize(log_path)
+        except OSError:
+            return False
+        if size == 0:
+            return False
+        return (force or size >= settings.LOG_ROTATE_MAX_SIZE or
+                time() - self.get_last_rotated_at(log_path) >= settings.LOG_ROTATE_INTERVAL)
+
+    def rotate(self, log_path):
+        """
+        :return:
+            path of the renamed log
+        """
+        archive_path = os.path.join(
+            self.archive_dir,
+            f'{os.path.basename(log_path)}.{datetime.now().strftime(AILogArchive.ROTATED_AT_FORMAT)}')
+        os.replace(log_path, archive_path)
+        open(log_path, 'a').close()
+        marker_path = self.get_marker_path(log_path)
+        open(marker_path, 'a').close()
+        os.utime(marker_path)
+        logging.info(f'Rotated {log_path} to {archive_path}')
+        return archive_path
+
+    def rotate_if_needed(self, force=False):
+        """
+        :return:
+            list of the renamed logs
+        """
+        rotated = [self.rotate(log_path) for log_path in self.log_paths if self.should_rotate(log_path, force)]
+        pid = self.runner.supervisor.get_pid()
+        if rotated and pid:
+            self.runner.supervisor.signal(pid, signal.SIGUSR1)
+        # The logs renamed by this pass are compressed by a later one
+        self.compress_pending(grace_period=self.REOPEN_GRACE_PERIOD if pid else 0, skip=rotated)
+        self.prune()
+        return rotated
+
+    def compress(self, archive_path):
+        compressed_path = f'{archive_path}.gz'
+        with open(archive_path, 'rb') as source, gzip.open(f'{compressed_path}.tmp', 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.replace(f'{compressed_path}.tmp', compressed_path)
+        shutil.copystat(archive_path, compressed_path)
+        os.unlink(archive_path)
+        return compressed_path
+
+    def is_unread(self, archive):
+        """
+        :return:
+            True if a log reader stopped in the archive before its end and reads its rest by the next run
+        """
+        log_name = archive.name.rsplit('.', 1)[0]
+        try:
+            for consumer in self.LOG_CONSUMERS:
+                inode, offset = AILogCheckpoint(consumer, self.runner.project.pk, log_name).get()
+                if inode == archive.inode and offset < archive.size:
+                    return True
+        except redis.RedisError as e:
+            logging.error(f'Error occurred while reading the log checkpoints of {archive.path}: {e}')
+            return True
+        return False
+
+    def compress_pending(self, grace_period=0, skip=()):
+        """
+        :param skip:
+            list of the archive paths to keep uncompressed, e.g. renamed by the current pass
+        """
+        for archive in self.get_archives():
+            if archive.is_compressed or archive.path in skip:
+                continue
+            rotated_for = time() - archive.rotated_at
+            if rotated_for < grace_period or (rotated_for < self.UNREAD_GRACE_PERIOD and self.is_unread(archive)):
+                continue
+            try:
+                self.compress(archive.path)
+            except OSError as e:
+                logging.error(f'Error occurred while compressing the log archive {archive.path}: {e}')
+
+    def get_archives(self):
+        """
+        :return:
+            list of AILogArchive objects, the newest first
+        """
+        archives = []
+        for entry in os.scandir(self.archive_dir):
+            if entry.is_file() and not entry.name.startswith('.') and not entry.name.endswith('.tmp'):
+                try:
+                    archives.append(AILogArchive(entry.path))
+                except OSError:
+                    continue
+        return sorted(archives, key=lambda archive: archive.mtime, reverse=True)
+
+    def get_archive(self, name):
+        """
+        :return:
+            AILogArchive object or None if there is no such archive
+        """
+        for archive in self.get_archives():
+            if archive.name == name:
+                return archive
+        return None
+
+    def prune(self):
+        """
+        Remove the expired archives and the oldest ones beyond the size budget.
+
+        :return:
+            list of the removed archive paths
+        """
+        removed = []
+        total_size = 0
+        for archive in self.get_archives():
+            total_size += archive.size
+            if time() - archive.mtime < settings.LOG_ARCHIVE_RETENTION and \
+                    total_size <= settings.LOG_ARCHIVE_MAX_SIZE:
+                continue
+            try:
+                os.unlink(archive.path)
+                removed.append(archive.path)
+            except OSError as e:
+                logging.error(f'Error occurred while removing the log archive {archive.path}: {e}')
+        if removed:
+            logging.info(f'Removed {len(removed)} log archives from {self.archive_dir}')
+        return removed
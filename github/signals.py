@@ -2,14 +2,25 @@ from __future__ import unicode_literals
 
 __author__ = 'David Baum'
 
-from django.db.models.signals import pre_delete
+from django.db import transaction
+from django.db.models.signals import post_save, pre_delete
 from django.dispatch import receiver
 
 from github.models import AIGitHubProject
+from github.provisioning import AIProvisioningState
 from github.utils import RepoTools
+from utils.jobs.scheduler import enqueue_clone_project
 
 
 @receiver(pre_delete, sender=AIGitHubProject)
 def log_deleted_question(sender, instance, using, **kwargs):
     repo_tools = RepoTools(instance)
     repo_tools.delete_repo()
+
+
+@receiver(post_save, sender=AIGitHubProject)
+def provision_project(sender, instance, using, **kwargs):
+    if instance.provisioning_state == AIProvisioningState.PENDING:
+        project_id = instance.pk
+        previous_url = instance.previous_url
+        transaction.on_commit(lambda: enqueue_clone_project(project_id, previous_url), using=using)
@@ -0,0 +1,125 @@
+from __future__ import unicode_literals
+
+__author__ = 'David Baum'
+
+import logging
+from datetime import datetime, timezone
+from time import time
+
+import redis
+from django.conf import settings
+
+from github.liveness import get_listening_ports_snapshot
+
+
+class AIProjectStatus(object):
+    def __init__(self, project_id, is_running, probed_at, last_commit=None, last_error=None):
+        self.project_id = project_id
+        self.is_running = is_running
+        self.probed_at = probed_at
+        self.last_commit = last_commit
+        self.last_error = last_error
+
+    @property
+    def probed_at_datetime(self):
+        return datetime.fromtimestamp(self.probed_at, tz=timezone.utc)
+
+    def to_redis(self):
+        return {
+            'is_running': int(self.is_running),
+            'probed_at': self.probed_at,
+            'last_commit': self.last_commit or '',
+            'last_error': self.last_error or '',
+        }
+
+    @classmethod
+    def from_redis(cls, project_id, data):
+        if not data:
+            return None
+        data = {key.decode(): value.decode() for key, value in data.items()}
+        return cls(
+            project_id,
+            is_running=data.get('is_running') == '1',
+            probed_at=float(data.get('probed_at') or 0),
+            last_commit=data.get('last_commit') or None,
+            last_error=data.get('last_error') or None,
+        )
+
+
+class AIProjectStatusCache(object):
+    """
+    Project statuses kept in Redis by the background jobs, so the admin never probes the projects while rendering.
+
+    Every status expires after settings.PROJECT_STATUS_CACHE_TTL seconds.
+    """
+    KEY_PREFIX = 'arielinstaller:project-status'
+
+    def __init__(self):
+        self.connection = redis.Redis(connection_pool=settings.REDIS_POOL)
+        self.ttl = settings.PROJECT_STATUS_CACHE_TTL
+
+    def get_key(self, project_id):
+        return f'{self.KEY_PREFIX}:{project_id}'
+
+    def get_many(self, project_ids):
+        """
+        Read the statuses of the projects in one round-trip.
+
+        :return:
+            dict of project id -> AIProjectStatus, the projects without a cached status are missing
+        """
+        project_ids = list(project_ids)
+        if not project_ids:
+            return {}
+        try:
+            pipeline = self.connection.pipeline(transaction=False)
+            for project_id in project_ids:
+                pipeline.hgetall(self.get_key(project_id))
+            rows = pipeline.execute()
+        except redis.RedisError as e:
+            logging.error(f'Error occurred while reading the project statuses: {e}')
+            return {}
+
+        statuses = {}
+        for project_id, data in zip(project_ids, rows):
+            status = AIProjectStatus.from_redis(project_id, data)
+            if status:
+                statuses[project_id] = status
+        return statuses
+
+    def get(self, project_id):
+        return self.get_many([project_id]).get(project_id)
+
+    def set_many(self, statuses):
+        try:
+            pipeline = self.connection.pipeline(transaction=False)
+            for status in statuses:
+                key = self.get_key(status.project_id)
+                pipeline.hset(key, mapping=status.to_redis())
+                pipeline.expire(key, self.ttl)
+            pipeline.execute()
+        except redis.RedisError as e:
+            logging.error(f'Error occurred while saving the project statuses: {e}')
+
+    def refresh(self, projects, snapshot=None):
+        """
+        Probe the projects from one listening ports snapshot and store their statuses.
+
+        :param projects:
+            iterable of AIGitHubProject objects
+
+        :param snapshot:
+            AIListeningPortsSnapshot to use, a fresh one is read by default
+
+        :return:
+            dict of project id -> AIProjectStatus
+        """
+        snapshot = snapshot or get_listening_ports_snapshot(max_age=0)
+        probed_at = time()
+        statuses = {
+            project.pk: AIProjectStatus(project.pk, snapshot.is_listening(project.port), probed_at,
+                                        project.last_commit, project.last_error)
+            for project in projects
+        }
+        self.set_many(statuses.values())
+        return statuses
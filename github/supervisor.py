@@ -0,0 +1,295 @@
+from __future__ import unicode_literals
+
+__author__ = 'David Baum'
+
+import logging
+import os
+import signal
+from time import sleep, monotonic, time
+
+import redis
+from django.conf import settings
+
+from github.liveness import get_listening_ports_snapshot
+
+
+class AIProjectLockedError(Exception):
+    pass
+
+
+class AIProjectLock(object):
+    """
+    Redis lock serializing the changes of the running application of a project: the deploy and the health
+    restart jobs, the admin starts, stops and rollbacks and the removal of the previous checkout.
+
+    The lock expires after PROJECT_LOCK_TIMEOUT seconds, so a killed worker does not block the project forever.
+    Without Redis the change goes on unlocked, as the jobs cannot run then anyway.
+    """
+    KEY_PREFIX = 'arielinstaller:project-lock'
+
+    def __init__(self, project_id, blocking_timeout=None):
+        """
+        :param blocking_timeout:
+            seconds to wait for the lock, None waits up to the lock timeout
+        """
+        self.project_id = project_id
+        self.blocking_timeout = settings.PROJECT_LOCK_TIMEOUT if blocking_timeout is None else blocking_timeout
+        self.lock = redis.Redis(connection_pool=settings.REDIS_POOL).lock(
+            f'{self.KEY_PREFIX}:{project_id}', timeout=settings.PROJECT_LOCK_TIMEOUT)
+        self.is_acquired = False
+
+    def __enter__(self):
+        try:
+            self.is_acquired = self.lock.acquire(blocking_timeout=self.blocking_timeout)
+        except redis.RedisError as e:
+            logging.error(f'Error occurred while locking the project {self.project_id}: {e}')
+            return self
+        if not self.is_acquired:
+            raise AIProjectLockedError(f'The project {self.project_id} is being changed by another job, '
+                                       f'try again later')
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if not self.is_acquired:
+            return
+        try:
+            self.lock.release()
+        except redis.RedisError as e:
+            # Expired, the change took longer than PROJECT_LOCK_TIMEOUT
+            logging.error(f'Error occurred while unlocking the project {self.project_id}: {e}')
+
+
+class AIProcessSupervisor(object):
+    """
+    Supervise the gunicorn master of a project by its pid file.
+
+    The pid and the process start time are also recorded in Redis, so a pid reused by another process after
+    a reboot or a crash is never signalled. Without a matching record, e.g. after a Redis flush, only a gunicorn
+    master writing to the logs dir of the project is trusted. Stopping signals the whole process group of the
+    master and waits for the real exit of the processes and the release of the port instead of sleeping.
+    """
+    KEY_PREFIX = 'arielinstaller:project-process'
+
+    def __init__(self, project, pid_path):
+        self.project = project
+        self.pid_path = pid_path
+        self.connection = redis.Redis(connection_pool=settings.REDIS_POOL)
+
+    @property
+    def key(self):
+        return f'{self.KEY_PREFIX}:{self.project.pk}'
+
+    @staticmethod
+    def get_process_start_time(pid):
+        """
+        :return:
+            the process start time in clock ticks since boot or None if the process does not exist
+        """
+        try:
+            with open(f'/proc/{pid}/stat', 'r') as f:
+                stat = f.read()
+        except OSError:
+            return None
+        # The process name in parentheses may contain spaces, the fields after it are space separated
+        fields = stat[stat.rindex(')') + 2:].split()
+        return int(fields[19])
+
+    @staticmethod
+    def is_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def is_project_master(self, pid):
+        """
+        :return:
+            True if the process is a gunicorn master started with the log files of this project
+        """
+        try:
+            with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                cmdline = [arg.decode(errors='replace') for arg in f.read().split(b'\0') if arg]
+        except OSError:
+            return False
+        if not any('gunicorn' in arg for arg in cmdline[:2]):
+            return False
+        logs_dir = os.path.dirname(os.path.abspath(self.pid_path)) + os.sep
+        if any(arg.startswith(logs_dir) for arg in cmdline):
+            return True
+        # The arguments are gone when setproctitle renamed the master, its error log is still open
+        try:
+            fd_paths = [os.readlink(entry.path) for entry in os.scandir(f'/proc/{pid}/fd')]
+        except OSError:
+            return False
+        return any(path.startswith(logs_dir) for path in fd_paths)
+
+    def read_pid_file(self, pid_path=None):
+        try:
+            with open(pid_path or self.pid_path, 'r') as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def wait_for_pid_file(self, started_after, timeout):
+        """
+        Wait for the pid file written by the master started after the timestamp, gunicorn writes it after the fork.
+
+        :return:
+            the pid or None if the file was not written in time
+        """
+        def is_written():
+            try:
+                # 1 second of slack for the file systems with the coarse modification times
+                is_fresh = os.path.getmtime(self.pid_path) >= started_after - 1
+            except OSError:
+                return False
+            pid = self.read_pid_file()
+            return is_fresh and bool(pid) and self.is_alive(pid)
+
+        return self.read_pid_file() if self.wait(is_written, timeout) else None
+
+    def record(self, pid=None, started_after=None):
+        """
+        Remember the pid and the start time of the running master.
+
+        :param pid:
+            the master pid, read from the pid file by default
+
+        :param started_after:
+            the start timestamp of the master, the stale pid file of the previous master is not recorded
+        """
+        if not pid and started_after is not None:
+            pid = self.wait_for_pid_file(started_after, settings.APPLICATION_STOP_TIMEOUT)
+            if not pid:
+                logging.warning(f'The pid file {self.pid_path} of {self.project.name} was not written, '
+                                f'the process is not recorded')
+                return
+        pid = pid or self.read_pid_file()
+        if not pid or not self.project.pk:
+            return
+        try:
+            self.connection.hset(self.key, mapping={
+                'pid': pid,
+                'start_time': self.get_process_start_time(pid) or '',
+                'recorded_at': time(),
+            })
+        except redis.RedisError as e:
+            logging.error(f'Error occurred while recording the process {pid} of {self.project.name}: {e}')
+
+    def forget(self):
+        if os.path.exists(self.pid_path):
+            os.unlink(self.pid_path)
+        if not self.project.pk:
+            return
+        try:
+            self.connection.delete(self.key)
+        except redis.RedisError as e:
+            logging.error(f'Error occurred while forgetting the process of {self.project.name}: {e}')
+
+    def get_pid(self):
+        """
+        :return:
+            the pid of the running master or None if it is not running or the pid now belongs to another process
+        """
+        pid = self.read_pid_file()
+        if not pid or not self.is_alive(pid):
+            return None
+
+        try:
+            record = self.connection.hgetall(self.key) if self.project.pk else {}
+        except redis.RedisError as e:
+            logging.error(f'Error occurred while reading the process record of {self.project.name}: {e}')
+            record = {}
+        if record and int(record.get(b'pid', 0)) == pid and record.get(b'start_time'):
+            if int(record[b'start_time']) != self.get_process_start_time(pid):
+                logging.warning(f'The pid {pid} of {self.project.name} was reused by another process')
+                return None
+            return pid
+        # The stale pid file after a reboot or a Redis flush may name any process
+        if not self.is_project_master(pid):
+            logging.warning(f'The pid {pid} of {self.project.name} is not recorded and is not its gunicorn master')
+            return None
+        return pid
+
+    def signal(self, pid, signal_number, process_group=False):
+        if not self.is_project_master(pid):
+            logging.error(f'Refused to send {signal_number} to {pid}, it is not the gunicorn master of '
+                          f'{self.project.name}')
+            return False
+        try:
+            if process_group:
+                os.killpg(os.getpgid(pid), signal_number)
+            else:
+                os.kill(pid, signal_number)
+            return True
+        except OSError as e:
+            logging.error(f'Error occurred while sending {signal_number} to the application {pid}: {e}')
+            return False
+
+    def wait(self, condition, timeout):
+        """
+        Poll the condition with the exponential backoff.
+
+        :return:
+            True if the condition became true before the timeout
+        """
+        deadline = monotonic() + timeout
+        delay = 0.01
+        while True:
+            if condition():
+                return True
+            if monotonic() >= deadline:
+                return False
+            sleep(min(delay, max(deadline - monotonic(), 0)))
+            delay = min(delay * 2, 0.5)
+
+    def stop(self, timeout=None):
+        """
+        Stop the master and its workers, killing them when they do not exit in time.
+
+        :return:
+            True if the supervised master was stopped, False if there was no supervised master
+        """
+        timeout = settings.APPLICATION_STOP_TIMEOUT if timeout is None else timeout
+        pid = self.get_pid()
+        if not pid:
+            return False
+
+        try:
+            process_group = os.getpgid(pid)
+        except ProcessLookupError:
+            self.forget()
+            return True
+
+        logging.info(f'Stopping the application {pid} running on port {self.project.port}')
+        started_at = monotonic()
+        self.signal(pid, signal.SIGTERM, process_group=True)
+        if not self.wait(lambda: not self.is_process_group_alive(process_group), timeout):
+            logging.warning(f'The application {pid} did not stop in {timeout} seconds, killing it')
+            # The master may be gone already, the group verified before the SIGTERM is killed with its workers
+            try:
+                os.killpg(process_group, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            self.wait(lambda: not self.is_process_group_alive(process_group), timeout)
+        self.wait_for_port_release(timeout)
+        logging.info(f'Stopped the application {pid} in {monotonic() - started_at:.2f} seconds')
+        self.forget()
+        return True
+
+    @staticmethod
+    def is_process_group_alive(process_group):
+        try:
+            os.killpg(process_group, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def wait_for_port_release(self, timeout):
+        return self.wait(lambda: not get_listening_ports_snapshot(max_age=0).is_listening(self.project.port),
+                         timeout)
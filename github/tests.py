@@ -1,3 +1,665 @@
-from django.test import TestCase
+from __future__ import unicode_literals
 
-# Create your tests here.
+__author__ = 'David Baum'
+
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import signal
+import tempfile
+from time import time
+from types import SimpleNamespace
+from unittest import mock
+
+from django.http import Http404
+from git import Repo
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from github.analytics import AIAccessLogAnalyzer, AITrafficBucket
+from github.deploy import AIDeployPlan, AIDeployPlanner
+from github.deployments import AIDeploymentTrigger
+from github.logs import AIIncrementalLogReader, AILogFileWindow, serve_log_file
+from github.models import AIGitHubProject
+from github.provisioning import AIProvisioningState
+from github.rotation import AILogRotator
+from github.tracebacks import AITraceback, AITracebackParser
+from github.views import AIGitHubWebhookView
+
+
+@override_settings(GITHUB_WEBHOOK_SECRET='webhook-secret')
+class AIGitHubWebhookViewTestCase(TestCase):
+    def setUp(self):
+        self.project = AIGitHubProject.objects.create(name='app', url='ssh://git@github.com/owner/app.git', port=5901)
+        # Cloned by the background job in production
+        AIGitHubProject.objects.filter(pk=self.project.pk).update(provisioning_state=AIProvisioningState.READY)
+        enqueue_patcher = mock.patch('github.views.enqueue_fetch_and_deploy_project')
+        self.enqueue = enqueue_patcher.start()
+        self.enqueue.return_value = mock.Mock(id='fetch-and-deploy-project-1')
+        self.addCleanup(enqueue_patcher.stop)
+
+    def get_payload(self, **repository):
+        repository = repository or {
+            'clone_url': 'https://github.com/owner/app.git',
+            'html_url': 'https://github.com/owner/app',
+            'ssh_url': 'git@github.com:owner/app.git',
+            'git_url': 'git://github.com/owner/app.git',
+        }
+        return json.dumps({'ref': 'refs/heads/master', 'repository': repository}).encode()
+
+    def sign(self, body, secret='webhook-secret'):
+        return 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+    def post(self, body, signature=None, event='push'):
+        headers = {'HTTP_X_GITHUB_EVENT': event}
+        if signature is not None:
+            headers['HTTP_X_HUB_SIGNATURE_256'] = signature
+        return self.client.post(reverse('github:webhook'), body, content_type='application/json', **headers)
+
+    def test_valid_signature_queues_deploy(self):
+        body = self.get_payload()
+        response = self.post(body, self.sign(body))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'queued')
+        self.enqueue.assert_called_once_with(self.project.pk, AIDeploymentTrigger.WEBHOOK)
+
+    def test_pending_job_is_not_queued_twice(self):
+        self.enqueue.return_value = None
+        body = self.get_payload()
+        response = self.post(body, self.sign(body))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'pending')
+
+    def test_invalid_signature(self):
+        body = self.get_payload()
+        self.assertEqual(self.post(body, self.sign(body, secret='another-secret')).status_code, 403)
+        self.assertEqual(self.post(body, 'sha256=').status_code, 403)
+        self.enqueue.assert_not_called()
+
+    def test_missing_signature(self):
+        self.assertEqual(self.post(self.get_payload()).status_code, 403)
+        self.enqueue.assert_not_called()
+
+    @override_settings(GITHUB_WEBHOOK_SECRET='')
+    def test_missing_secret_disables_webhooks(self):
+        body = self.get_payload()
+        self.assertEqual(self.post(body, self.sign(body, secret='')).status_code, 403)
+        self.enqueue.assert_not_called()
+
+    def test_ping(self):
+        body = b'{}'
+        response = self.post(body, self.sign(body), event='ping')
+        self.assertEqual(response.json(), {'status': 'pong'})
+
+    def test_unknown_repository(self):
+        body = self.get_payload(clone_url='https://github.com/owner/another.git')
+        self.assertEqual(self.post(body, self.sign(body)).status_code, 404)
+
+    def test_project_being_cloned_is_ignored(self):
+        AIGitHubProject.objects.filter(pk=self.project.pk).update(provisioning_state=AIProvisioningState.CLONING)
+        body = self.get_payload()
+        response = self.post(body, self.sign(body))
+        self.assertEqual(response.json()['status'], 'ignored')
+        self.enqueue.assert_not_called()
+
+    def test_https_url_variants(self):
+        AIGitHubProject.objects.filter(pk=self.project.pk).update(url='https://github.com/owner/app')
+        body = self.get_payload(clone_url='https://github.com/owner/app.git')
+        self.assertEqual(self.post(body, self.sign(body)).status_code, 202)
+
+    def test_scp_ssh_url_matches_ssh_url_without_user(self):
+        AIGitHubProject.objects.filter(pk=self.project.pk).update(url='ssh://github.com/owner/app')
+        body = self.get_payload(ssh_url='git@github.com:owner/app.git')
+        self.assertEqual(self.post(body, self.sign(body)).status_code, 202)
+
+    def test_repository_urls(self):
+        urls = AIGitHubWebhookView().get_repository_urls({
+            'clone_url': 'https://github.com/owner/app.git',
+            'ssh_url': 'git@github.com:owner/app.git',
+            'url': None,
+        })
+        for url in ('https://github.com/owner/app', 'https://github.com/owner/app/',
+                    'https://github.com/owner/app.git', 'ssh://git@github.com/owner/app.git',
+                    'ssh://github.com/owner/app.git', 'ssh://github.com/owner/app'):
+            self.assertIn(url, urls)
+
+
+class AILogFileTestCase(SimpleTestCase):
+    LINES = [f'line {index}\n'.encode() for index in range(10)]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'access.log')
+        with open(self.path, 'wb') as f:
+            f.writelines(self.LINES)
+        self.content = b''.join(self.LINES)
+        self.factory = RequestFactory()
+
+    def serve(self, path='/', **headers):
+        return serve_log_file(self.factory.get(path, **headers), self.path)
+
+    def test_whole_file(self):
+        response = self.serve()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(response['X-Log-Size'], str(len(self.content)))
+
+    def test_satisfiable_range(self):
+        response = self.serve(HTTP_RANGE='bytes=7-13')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[7:14])
+        self.assertEqual(response['Content-Range'], f'bytes 7-13/{len(self.content)}')
+
+    def test_suffix_range(self):
+        response = self.serve(HTTP_RANGE='bytes=-7')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[-7:])
+
+    def test_unsatisfiable_range(self):
+        response = self.serve(HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_range_of_changed_file_serves_whole_file(self):
+        response = self.serve(HTTP_RANGE='bytes=0-4', HTTP_IF_RANGE='"outdated"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_tail(self):
+        response = self.serve('/?tail=3')
+        self.assertEqual(b''.join(response.streaming_content), b''.join(self.LINES[-3:]))
+
+    def test_tail_across_chunks(self):
+        window = AILogFileWindow(self.path)
+        with mock.patch.object(AILogFileWindow, 'CHUNK_SIZE', 4):
+            window.tail(4)
+        self.assertEqual(b''.join(window), b''.join(self.LINES[-4:]))
+
+    def test_tail_more_lines_than_file(self):
+        response = self.serve('/?tail=100')
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_since(self):
+        offset = len(b''.join(self.LINES[:6]))
+        response = self.serve(f'/?since={offset}')
+        self.assertEqual(b''.join(response.streaming_content), b''.join(self.LINES[6:]))
+
+    def test_since_after_truncation_serves_whole_file(self):
+        response = self.serve(f'/?since={len(self.content) + 100}')
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_since_and_tail(self):
+        offset = len(b''.join(self.LINES[:2]))
+        response = self.serve(f'/?since={offset}&tail=2')
+        self.assertEqual(b''.join(response.streaming_content), b''.join(self.LINES[-2:]))
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.serve('/?tail=many').status_code, 400)
+
+    def test_not_modified(self):
+        etag = self.serve()['ETag']
+        response = self.serve(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_modified(self):
+        etag = self.serve()['ETag']
+        with open(self.path, 'ab') as f:
+            f.write(b'line 10\n')
+        self.assertEqual(self.serve(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_gzip(self):
+        response = self.serve(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(response['ETag'].startswith('W/'))
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.content)
+
+    def test_range_is_not_compressed(self):
+        response = self.serve(HTTP_RANGE='bytes=0-4', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), self.content[:5])
+
+    def test_missing_file(self):
+        with self.assertRaises(Http404):
+            serve_log_file(self.factory.get('/'), os.path.join(self.dir, 'missing.log'))
+
+
+class AIDeployPlannerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.repo = Repo.init(os.path.join(self.dir, 'app'))
+        with self.repo.config_writer() as config:
+            config.set_value('user', 'name', 'Test')
+            config.set_value('user', 'email', 'test@example.com')
+        self.first_commit = self.commit({'app.py': 'app = None\n', 'requirements.txt': 'gunicorn\n',
+                                         'templates/index.html': '<html></html>\n', 'docs/README.md': '# App\n'})
+
+    def commit(self, files):
+        for path, content in files.items():
+            full_path = os.path.join(self.repo.working_dir, path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, 'w') as f:
+                f.write(content)
+        self.repo.index.add(list(files))
+        return self.repo.index.commit('Change').hexsha
+
+    def plan(self, old_commit, new_commit, watch_paths=None):
+        planner = AIDeployPlanner(AIGitHubProject(watch_paths=watch_paths), self.repo.working_dir)
+        return planner.plan(old_commit, new_commit)
+
+    def test_first_deploy_rebuilds(self):
+        self.assertEqual(self.plan(None, self.first_commit).action, AIDeployPlan.REBUILD)
+
+    def test_same_commit_does_nothing(self):
+        self.assertEqual(self.plan(self.first_commit, self.first_commit).action, AIDeployPlan.NOTHING)
+
+    def test_requirements_change_rebuilds(self):
+        commit = self.commit({'requirements.txt': 'gunicorn\ndjango\n', 'app.py': 'app = 1\n'})
+        plan = self.plan(self.first_commit, commit)
+        self.assertEqual(plan.action, AIDeployPlan.REBUILD)
+        self.assertEqual(sorted(plan.changed_files), ['app.py', 'requirements.txt'])
+
+    def test_python_change_reloads(self):
+        commit = self.commit({'app.py': 'app = 1\n', 'views/home.py': 'home = 1\n'})
+        self.assertEqual(self.plan(self.first_commit, commit).action, AIDeployPlan.RELOAD)
+
+    def test_other_change_restarts(self):
+        commit = self.commit({'app.py': 'app = 1\n', 'templates/index.html': '<html>1</html>\n'})
+        plan = self.plan(self.first_commit, commit)
+        self.assertEqual(plan.action, AIDeployPlan.RESTART)
+        self.assertIn('templates/index.html', plan.reason)
+
+    def test_unwatched_change_does_nothing(self):
+        commit = self.commit({'docs/README.md': '# App 1\n'})
+        self.assertEqual(self.plan(self.first_commit, commit, watch_paths='app.py\ntemplates/').action,
+                         AIDeployPlan.NOTHING)
+
+    def test_watch_paths_match_dirs_and_globs(self):
+        planner = AIDeployPlanner(AIGitHubProject(watch_paths='templates/\n  *.py  \n\nstatic'), self.dir)
+        self.assertTrue(planner.is_watched('templates/index.html'))
+        self.assertTrue(planner.is_watched('views/home.py'))
+        self.assertTrue(planner.is_watched('static/css/app.css'))
+        self.assertFalse(planner.is_watched('docs/README.md'))
+        self.assertFalse(planner.is_watched('templates.txt'))
+
+    def test_empty_watch_paths_watch_everything(self):
+        self.assertTrue(AIDeployPlanner(AIGitHubProject(watch_paths=''), self.dir).is_watched('docs/README.md'))
+
+    def test_requirements_change_rebuilds_even_when_not_watched(self):
+        commit = self.commit({'requirements.txt': 'gunicorn\ndjango\n'})
+        self.assertEqual(self.plan(self.first_commit, commit, watch_paths='templates/').action,
+                         AIDeployPlan.REBUILD)
+
+    def test_unknown_previous_commit_rebuilds(self):
+        commit = self.commit({'app.py': 'app = 1\n'})
+        plan = self.plan('0' * 40, commit)
+        self.assertEqual(plan.action, AIDeployPlan.REBUILD)
+        self.assertIn('Failed comparing', plan.reason)
+
+    def test_previous_commit_beyond_shallow_history(self):
+        commit = self.commit({'app.py': 'app = 1\n'})
+        shallow_repo = Repo.clone_from(f'file://{self.repo.working_dir}', os.path.join(self.dir, 'shallow'), depth=1)
+        planner = AIDeployPlanner(AIGitHubProject(), shallow_repo.working_dir)
+        plan = planner.plan(self.first_commit, commit)
+        self.assertEqual(plan.action, AIDeployPlan.REBUILD)
+        self.assertIn('shallow history', plan.reason)
+        # The clone is not deepened
+        self.assertTrue(os.path.exists(os.path.join(shallow_repo.git_dir, 'shallow')))
+        self.assertEqual(len(list(shallow_repo.iter_commits())), 1)
+
+
+class AIAccessLogAnalyzerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.analyzer = AIAccessLogAnalyzer(AIGitHubProject(), runner=None)
+
+    def get_line(self, log_time, status=200, duration='1534'):
+        line = f'127.0.0.1 - - [{log_time}] "GET /items?page=2 HTTP/1.1" {status} 512 "-" "curl/8.0 \\"quoted\\""'
+        return f'{line} {duration}' if duration is not None else line
+
+    def test_response_time_field(self):
+        bucket, = self.analyzer.aggregate([self.get_line('17/Oct/2026:20:51:05 +0000', duration='1534')])
+        self.assertEqual(bucket.requests, 1)
+        self.assertEqual(bucket.status_codes, {'200': 1})
+        # 1534 microseconds
+        self.assertEqual(bucket.counters['rt:5'], 1)
+        self.assertEqual(bucket.counters['rt_sum_us'], 1534)
+        self.assertAlmostEqual(bucket.mean_response_time, 1.534)
+
+    def test_slow_response_goes_to_unbounded_bucket(self):
+        bucket, = self.analyzer.aggregate([self.get_line('17/Oct/2026:20:51:05 +0000', duration='20000000')])
+        self.assertEqual(bucket.counters['rt:inf'], 1)
+        self.assertEqual(bucket.format_percentile(99), '> 10000 ms')
+
+    def test_line_without_response_time(self):
+        bucket, = self.analyzer.aggregate([self.get_line('17/Oct/2026:20:51:05 +0000', status=404, duration=None)])
+        self.assertEqual(bucket.requests, 1)
+        self.assertEqual(bucket.count_status_class('4'), 1)
+        self.assertIsNone(bucket.mean_response_time)
+        self.assertEqual(bucket.format_percentile(95), '-')
+
+    def test_malformed_lines_are_skipped(self):
+        buckets = self.analyzer.aggregate([
+            '',
+            'not an access log line',
+            '127.0.0.1 - - [17/Oct/2026:20:51:05 +0000] "GET / HTTP/1.1" OK 512 "-" "curl/8.0" 1534',
+            self.get_line('99/Foo/2026:20:51:05 +0000'),
+            self.get_line('17/Oct/2026:20:51:05 +0000'),
+        ])
+        self.assertEqual([bucket.requests for bucket in buckets], [1])
+
+    def test_bucket_rollover(self):
+        buckets = self.analyzer.aggregate([
+            self.get_line('17/Oct/2026:20:51:00 +0000'),
+            self.get_line('17/Oct/2026:20:51:59 +0000', status=500),
+            self.get_line('17/Oct/2026:20:52:00 +0000'),
+            # The same minute in another time zone
+            self.get_line('17/Oct/2026:22:52:30 +0200'),
+        ])
+        buckets = sorted(buckets, key=lambda bucket: bucket.minute)
+        self.assertEqual([bucket.requests for bucket in buckets], [2, 2])
+        self.assertEqual(buckets[1].minute - buckets[0].minute, 60)
+        self.assertEqual(buckets[0].minute % 60, 0)
+        self.assertEqual(buckets[0].count_status_class('5'), 1)
+
+    def test_merged_percentiles(self):
+        summary = AITrafficBucket(None)
+        for bucket in self.analyzer.aggregate([self.get_line('17/Oct/2026:20:51:05 +0000', duration='3000')] * 9 +
+                                              [self.get_line('17/Oct/2026:20:52:05 +0000', duration='700000')]):
+            summary.merge(bucket)
+        self.assertEqual(summary.requests, 10)
+        self.assertEqual(summary.format_percentile(50), '≤ 5 ms')
+        self.assertEqual(summary.format_percentile(99), '≤ 1000 ms')
+
+
+class AIMemoryLogCheckpoint(object):
+    """AILogCheckpoint kept in memory."""
+
+    def __init__(self):
+        self.inode = None
+        self.offset = 0
+        self.carry = []
+
+    def get(self):
+        return self.inode, self.offset
+
+    def get_carry(self):
+        return list(self.carry)
+
+    def set(self, inode, offset, carry=None):
+        self.inode, self.offset, self.carry = inode, offset, list(carry or [])
+
+
+class AIIncrementalLogReaderTestCase(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'error.log')
+        self.archive_dir = os.path.join(self.dir, 'archive')
+        os.makedirs(self.archive_dir)
+        self.checkpoint = AIMemoryLogCheckpoint()
+        self.write('')
+
+    def write(self, text, mode='a', path=None):
+        with open(path or self.path, mode) as f:
+            f.write(text)
+
+    def read(self, commit=True, carry=None, max_bytes=None):
+        reader = AIIncrementalLogReader(self.path, self.checkpoint, archive_dir=self.archive_dir,
+                                        max_bytes=max_bytes)
+        lines = reader.read()
+        if commit:
+            reader.commit(carry=carry)
+        return lines
+
+    def test_reads_complete_lines_since_checkpoint(self):
+        self.write('one\ntwo\nthr')
+        self.assertEqual(self.read(), ['one', 'two'])
+        self.write('ee\nfour\n')
+        self.assertEqual(self.read(), ['three', 'four'])
+        self.assertEqual(self.read(), [])
+
+    def test_uncommitted_lines_are_read_again(self):
+        self.write('one\n')
+        self.assertEqual(self.read(commit=False), ['one'])
+        self.assertEqual(self.read(), ['one'])
+
+    def test_rotated_log_is_finished_first(self):
+        self.write('one\n')
+        self.assertEqual(self.read(), ['one'])
+        self.write('two\n')
+        os.rename(self.path, os.path.join(self.archive_dir, 'error.log.1'))
+        self.write('three\n', mode='w')
+        self.assertEqual(self.read(), ['two', 'three'])
+        self.assertEqual(self.checkpoint.inode, os.stat(self.path).st_ino)
+
+    def test_compressed_rotated_log_is_skipped(self):
+        self.write('one\n')
+        self.read()
+        self.write('two\n')
+        # The archive was compressed already, the rest of it is lost
+        os.rename(self.path, os.path.join(self.archive_dir, 'error.log.1.gz'))
+        self.write('three\n', mode='w')
+        self.assertEqual(self.read(), ['three'])
+
+    def test_rotated_log_is_finished_by_next_run_when_limited(self):
+        self.write('one\n')
+        self.read()
+        self.write('two\n' * 3)
+        os.rename(self.path, os.path.join(self.archive_dir, 'error.log.1'))
+        self.write('three\n', mode='w')
+        self.assertEqual(self.read(max_bytes=8), ['two', 'two'])
+        self.assertEqual(self.read(), ['two', 'three'])
+
+    def test_truncated_log_is_read_from_start(self):
+        self.write('one\ntwo\n')
+        self.read()
+        self.write('new\n', mode='w')
+        self.assertEqual(self.read(), ['new'])
+
+    def test_carried_lines_are_read_again(self):
+        self.write('Traceback (most recent call last):\n')
+        lines = self.read(carry=['Traceback (most recent call last):'])
+        self.assertEqual(lines, ['Traceback (most recent call last):'])
+        self.write('ValueError: boom\n')
+        self.assertEqual(self.read(), ['Traceback (most recent call last):', 'ValueError: boom'])
+        self.assertEqual(self.read(), [])
+
+    def test_too_long_carry_is_dropped(self):
+        self.write('one\n')
+        self.read(carry=['x' * AIIncrementalLogReader.MAX_CARRY_SIZE])
+        self.assertEqual(self.checkpoint.carry, [])
+
+
+class AITracebackParserTestCase(SimpleTestCase):
+    LINES = [
+        '[2026-10-17 20:51:05 +0000] [42] [ERROR] Error handling request /items',
+        'Traceback (most recent call last):',
+        '  File "/srv/repos/app/items.py", line 12, in get',
+        '    return int(value)',
+        '           ^^^^^^^^^^',
+        'ValueError: invalid literal for int() with base 10: \'x\'',
+    ]
+
+    def test_traceback_with_log_time(self):
+        traceback, = AITracebackParser().parse(['[2026-10-17 20:51:04 +0000] [42] [INFO] Booting worker'] +
+                                               self.LINES)
+        self.assertEqual(traceback.exception_type, 'ValueError')
+        self.assertEqual(traceback.message, 'invalid literal for int() with base 10: \'x\'')
+        self.assertEqual(traceback.seen_at, 1792270265)
+        # The carets are not kept
+        self.assertEqual(traceback.lines, self.LINES[1:4] + self.LINES[5:])
+
+    def test_chained_exceptions(self):
+        lines = self.LINES + [
+            '',
+            'During handling of the above exception, another exception occurred:',
+            '',
+            'Traceback (most recent call last):',
+            '  File "/srv/repos/app/views.py", line 30, in dispatch',
+            '    raise Http404()',
+            'django.http.response.Http404',
+            '[2026-10-17 20:51:06 +0000] [42] [INFO] Worker exiting',
+        ]
+        traceback, = AITracebackParser().parse(lines)
+        self.assertEqual(traceback.exception_type, 'django.http.response.Http404')
+        self.assertEqual(traceback.get_frames(), ['/srv/repos/app/items.py:get', '/srv/repos/app/views.py:dispatch'])
+
+    def test_separate_tracebacks(self):
+        tracebacks = AITracebackParser().parse(self.LINES + self.LINES[:2] + [
+            '  File "/srv/repos/app/items.py", line 14, in post',
+            'KeyError: \'id\'',
+        ])
+        self.assertEqual([traceback.exception_type for traceback in tracebacks], ['ValueError', 'KeyError'])
+
+    def test_unfinished_traceback_is_carried(self):
+        parser = AITracebackParser()
+        self.assertEqual(parser.parse(['[2026-10-17 20:51:04 +0000] [42] [INFO] Booting worker'] + self.LINES[:3]),
+                         [])
+        self.assertEqual(parser.unfinished_lines, self.LINES[:3])
+
+        traceback, = parser.parse(parser.unfinished_lines + self.LINES[3:])
+        self.assertEqual(traceback.seen_at, 1792270265)
+        self.assertEqual(parser.unfinished_lines, [])
+
+
+class AITracebackFingerprintTestCase(SimpleTestCase):
+    def get_traceback(self, frames, exception='ValueError: boom'):
+        lines = ['Traceback (most recent call last):']
+        for frame in frames:
+            lines += [f'  File {frame}', '    code()']
+        return AITraceback(lines + [exception], seen_at=0)
+
+    def test_line_numbers_are_ignored(self):
+        traceback = self.get_traceback(['"/srv/repos/app/items.py", line 12, in get'])
+        edited = self.get_traceback(['"/srv/repos/app/items.py", line 40, in get'], exception='ValueError: other')
+        self.assertEqual(traceback.get_fingerprint(), edited.get_fingerprint())
+
+    def test_frames_without_line_numbers(self):
+        traceback = self.get_traceback(['"<frozen importlib._bootstrap>", in _call_with_frames_removed',
+                                        '"/srv/repos/app/items.py", line None, in get'])
+        self.assertEqual(traceback.get_frames(), ['<frozen importlib._bootstrap>:_call_with_frames_removed',
+                                                  '/srv/repos/app/items.py:get'])
+        numbered = self.get_traceback(['"<frozen importlib._bootstrap>", line 241, in _call_with_frames_removed',
+                                       '"/srv/repos/app/items.py", line 12, in get'])
+        self.assertEqual(traceback.get_fingerprint(), numbered.get_fingerprint())
+
+    def test_site_packages_paths_are_normalized(self):
+        traceback = self.get_traceback([
+            '"/srv/envs/abc/lib/python3.11/site-packages/django/core/handlers/base.py", line 197, in _get_response',
+            '"/usr/lib/python3.11/json/decoder.py", line 337, in decode',
+        ])
+        self.assertEqual(traceback.get_frames(), ['django/core/handlers/base.py:_get_response',
+                                                  'json/decoder.py:decode'])
+        other_host = self.get_traceback([
+            '"/home/app/.venv/lib/python3.12/site-packages/django/core/handlers/base.py", line 181, in _get_response',
+            '"/usr/local/lib/python3.12/json/decoder.py", line 340, in decode',
+        ])
+        self.assertEqual(traceback.get_fingerprint(), other_host.get_fingerprint())
+
+    def test_project_and_release_paths_are_normalized(self):
+        project_dir = '/srv/repos/owner/app'
+        releases_dir = '/srv/releases/owner/app'
+        traceback = self.get_traceback(['"/srv/repos/owner/app/items/views.py", line 12, in get'])
+        release = self.get_traceback([f'"{releases_dir}/0beceaa3c285d653953d63c73d66e988cca48dcb/items/views.py", '
+                                      'line 12, in get'])
+        other_release = self.get_traceback([f'"{releases_dir}/db062fc32e4ea5c536b5dc7c90ba53b3647bcf01/items/views.py"'
+                                            ', line 14, in get'])
+        self.assertEqual(release.get_frames(project_dir, releases_dir), ['items/views.py:get'])
+        self.assertEqual(len({traceback.get_fingerprint(project_dir, releases_dir),
+                              release.get_fingerprint(project_dir, releases_dir),
+                              other_release.get_fingerprint(project_dir, releases_dir)}), 1)
+
+    def test_different_exceptions_and_functions(self):
+        traceback = self.get_traceback(['"/srv/repos/app/items.py", line 12, in get'])
+        self.assertNotEqual(traceback.get_fingerprint(),
+                            self.get_traceback(['"/srv/repos/app/items.py", line 12, in get'],
+                                               exception='KeyError: \'id\'').get_fingerprint())
+        self.assertNotEqual(traceback.get_fingerprint(),
+                            self.get_traceback(['"/srv/repos/app/items.py", line 12, in post']).get_fingerprint())
+
+
+class AILogRotatorTestCase(SimpleTestCase):
+    def setUp(self):
+        logs_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, logs_dir)
+        self.runner = SimpleNamespace(
+            project=SimpleNamespace(pk=1),
+            access_log_path=os.path.join(logs_dir, 'access.log'),
+            error_log_path=os.path.join(logs_dir, 'error.log'),
+            supervisor=mock.Mock(**{'get_pid.return_value': 42}),
+        )
+        self.checkpoints = {}
+        patcher = mock.patch('github.rotation.AILogCheckpoint', side_effect=self.get_checkpoint)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.rotator = AILogRotator(self.runner)
+        self.write_quiet_log()
+
+    def get_checkpoint(self, consumer, project_id, log_name):
+        return self.checkpoints.setdefault((consumer, log_name), AIMemoryLogCheckpoint())
+
+    def write_quiet_log(self):
+        with open(self.runner.access_log_path, 'w') as f:
+            f.write('one\ntwo\n')
+        # Written long before the rotation
+        os.utime(self.runner.access_log_path, (time() - 3600, time() - 3600))
+
+    def rotate_later(self, seconds):
+        with mock.patch('github.rotation.time', return_value=time() + seconds):
+            return self.rotator.rotate_if_needed()
+
+    def test_quiet_log_is_compressed_after_reopen_grace_period(self):
+        archive_path, = self.rotator.rotate_if_needed(force=True)
+        self.runner.supervisor.signal.assert_called_once_with(42, signal.SIGUSR1)
+        # The workers may still write the renamed log
+        self.assertTrue(os.path.exists(archive_path))
+        self.assertEqual(self.rotate_later(1), [])
+        self.assertTrue(os.path.exists(archive_path))
+
+        self.rotate_later(AILogRotator.REOPEN_GRACE_PERIOD + 1)
+        self.assertFalse(os.path.exists(archive_path))
+        archive, = self.rotator.get_archives()
+        self.assertTrue(archive.is_compressed)
+        with gzip.open(archive.path, 'rt') as f:
+            self.assertEqual(f.read(), 'one\ntwo\n')
+
+    def test_unread_archive_is_kept_for_the_log_reader(self):
+        checkpoint = self.get_checkpoint('traffic', 1, 'access.log')
+        reader = AIIncrementalLogReader(self.runner.access_log_path, checkpoint,
+                                        archive_dir=self.rotator.archive_dir)
+        self.assertEqual(reader.read(), ['one', 'two'])
+        reader.commit()
+        with open(self.runner.access_log_path, 'a') as f:
+            f.write('three\n')
+
+        archive_path, = self.rotator.rotate_if_needed(force=True)
+        self.rotate_later(AILogRotator.REOPEN_GRACE_PERIOD + 1)
+        self.assertTrue(os.path.exists(archive_path))
+
+        reader = AIIncrementalLogReader(self.runner.access_log_path, checkpoint,
+                                        archive_dir=self.rotator.archive_dir)
+        self.assertEqual(reader.read(), ['three'])
+        reader.commit()
+        self.rotate_later(AILogRotator.REOPEN_GRACE_PERIOD + 1)
+        self.assertFalse(os.path.exists(archive_path))
+
+    def test_unread_archive_is_compressed_after_unread_grace_period(self):
+        archive_path, = self.rotator.rotate_if_needed(force=True)
+        self.get_checkpoint('tracebacks', 1, 'access.log').set(os.stat(archive_path).st_ino, 0)
+        self.rotate_later(AILogRotator.REOPEN_GRACE_PERIOD + 1)
+        self.assertTrue(os.path.exists(archive_path))
+        self.rotate_later(AILogRotator.UNREAD_GRACE_PERIOD + 1)
+        self.assertFalse(os.path.exists(archive_path))
+
+    def test_stopped_application_log_is_compressed_by_next_pass(self):
+        self.runner.supervisor.get_pid.return_value = None
+        archive_path, = self.rotator.rotate_if_needed(force=True)
+        self.runner.supervisor.signal.assert_not_called()
+        self.assertTrue(os.path.exists(archive_path))
+        self.rotator.rotate_if_needed()
+        self.assertFalse(os.path.exists(archive_path))
@@ -0,0 +1,336 @@
+from __future__ import unicode_literals
+
+__author__ = 'David Baum'
+
+import hashlib
+import logging
+import os
+import re
+from datetime import datetime, timezone
+from time import time
+
+import redis
+from django.conf import settings
+
+from github.logs import AILogCheckpoint, AIIncrementalLogReader
+from github.rotation import AILogRotator
+
+
+class AITraceback(object):
+    # The line number is missing or "None" in the frames of the code without the line table
+    FRAME_RE = re.compile(r'^\s*File "(?P<path>[^"]+)"(?:, line (?:-?\d+|None))?, in (?P<function>.+)$')
+    # The parts of the paths which differ between the hosts, releases and envs of the same code
+    PATH_PREFIX_RE = re.compile(r'^.*/(site-packages|dist-packages|lib/python\d+(\.\d+)?)/')
+
+    def __init__(self, lines, seen_at):
+        self.lines = lines
+        self.seen_at = seen_at
+
+    @property
+    def exception_line(self):
+        return self.lines[-1].strip()
+
+    @property
+    def exception_type(self):
+        return self.exception_line.split(':', 1)[0].strip()
+
+    @property
+    def message(self):
+        parts = self.exception_line.split(':', 1)
+        return parts[1].strip() if len(parts) > 1 else ''
+
+    @property
+    def text(self):
+        return '\n'.join(self.lines)
+
+    def normalize_path(self, path, project_dir, releases_dir=None):
+        """
+        :param releases_dir:
+            the releases of the project, the release dir named by the commit is stripped with it
+        """
+        if self.PATH_PREFIX_RE.match(path):
+            return self.PATH_PREFIX_RE.sub('', path)
+        if releases_dir and path.startswith(releases_dir.rstrip('/') + '/'):
+            release_path = path[len(releases_dir.rstrip('/')) + 1:]
+            return release_path.split('/', 1)[1] if '/' in release_path else release_path
+        if project_dir and path.startswith(project_dir.rstrip('/') + '/'):
+            return path[len(project_dir.rstrip('/')) + 1:]
+        return path
+
+    def get_frames(self, project_dir=None, releases_dir=None):
+        """
+        :return:
+            list of "path:function" of the frames, without the line numbers which change with every edit
+        """
+        frames = []
+        for line in self.lines:
+            match = self.FRAME_RE.match(line)
+            if match:
+                path = self.normalize_path(match.group("path"), project_dir, releases_dir)
+                frames.append(f'{path}:{match.group("function")}')
+        return frames
+
+    def get_fingerprint(self, project_dir=None, releases_dir=None):
+        digest = hashlib.sha1(self.exception_type.encode())
+        for frame in self.get_frames(project_dir, releases_dir):
+            digest.update(b'\n')
+            digest.update(frame.encode())
+        return digest.hexdigest()
+
+
+class AITracebackParser(object):
+    """
+    Extract the python tracebacks from the lines of a gunicorn error log.
+
+    A traceback starts with the "Traceback (most recent call last):" line and ends with the first line which is
+    not indented, the exception. The chained exceptions are kept in the traceback of the last one. The traceback
+    still being written at the end of the lines is left in unfinished_lines, with its log line, to be parsed
+    again with the next lines.
+    """
+    TRACEBACK_START = 'Traceback (most recent call last):'
+    CHAINED_MARKERS = ('During handling of the above exception', 'The above exception was the direct cause')
+    LOG_TIME_RE = re.compile(r'^\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} [+-]\d{4})\]')
+    # The 3.11+ lines pointing to the failed expression
+    CARETS_RE = re.compile(r'^\s*[\^~]+\s*$')
+    MAX_LINES = 500
+
+    def __init__(self):
+        self.unfinished_lines = []
+
+    def parse(self, lines):
+        """
+        :return:
+            list of AITraceback objects
+        """
+        lines = list(lines)
+        tracebacks = []
+        # The lines of the traceback being read and of the complete one which may be followed by a chained one
+        current = None
+        complete = None
+        is_chained = False
+        # The time of the log line preceding the traceback
+        seen_at = None
+        traceback_seen_at = None
+        # The index of the first line of the traceback being read
+        start_index = 0
+        for index, line in enumerate(lines):
+            match = self.LOG_TIME_RE.match(line)
+            if match:
+                try:
+                    seen_at = datetime.strptime(match.group(1), '%Y-%m-%d %H:%M:%S %z').timestamp()
+                except ValueError:
+                    pass
+
+            if current is not None:
+                if line.startswith(self.TRACEBACK_START):
+                    current = [line]
+                    start_index = index
+                elif not line.strip() or self.CARETS_RE.match(line):
+                    continue
+                elif line[0].isspace():
+                    if len(current) < self.MAX_LINES:
+                        current.append(line)
+                else:
+                    current.append(line)
+                    complete, current = current, None
+                continue
+
+            if line.startswith(self.TRACEBACK_START):
+                if complete is not None and is_chained:
+                    current = complete + [line]
+                else:
+                    if complete is not None:
+                        tracebacks.append(AITraceback(complete, traceback_seen_at))
+                    current = [line]
+                    traceback_seen_at = seen_at or time()
+                    # The log line of the error precedes the traceback and gives its time
+                    is_logged = index and self.LOG_TIME_RE.match(lines[index - 1])
+                    start_index = index - 1 if is_logged else index
+                complete = None
+                is_chained = False
+            elif complete is not None:
+                if any(line.startswith(marker) for marker in self.CHAINED_MARKERS):
+                    complete.append(line)
+                    is_chained = True
+                elif line.strip():
+                    tracebacks.append(AITraceback(complete, traceback_seen_at))
+                    complete = None
+                    is_chained = False
+
+        if complete is not None:
+            tracebacks.append(AITraceback(complete, traceback_seen_at))
+        self.unfinished_lines = lines[start_index:] if current is not None else []
+        return tracebacks
+
+
+class AITracebackGroups(object):
+    """
+    The traceback groups of the projects in Redis.
+
+    Every group is a hash with the occurrences count, the first and last seen timestamps, the last message and
+    a sample traceback. The groups of a project are indexed by a sorted set scored by the last seen timestamp,
+    the groups not seen for settings.TRACEBACK_GROUPS_RETENTION seconds expire. The number of the groups and of
+    their occurrences are kept in a totals hash per project for the admin list.
+    """
+    KEY_PREFIX = 'arielinstaller:tracebacks'
+    MAX_SAMPLE_SIZE = 8 * 1024
+    # ZADD GT without requiring Redis 6.2, only the later last seen score replaces the indexed one
+    ZADD_LATER_SCRIPT = """
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not score or tonumber(score) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+end
+"""
+
+    def __init__(self):
+        self.connection = redis.Redis(connection_pool=settings.REDIS_POOL)
+
+    def get_index_key(self, project_id):
+        return f'{self.KEY_PREFIX}:{project_id}'
+
+    def get_group_key(self, project_id, fingerprint):
+        return f'{self.KEY_PREFIX}:{project_id}:{fingerprint}'
+
+    def get_totals_key(self, project_id):
+        return f'{self.KEY_PREFIX}:{project_id}:totals'
+
+    def expire_groups(self, project_id):
+        """
+        Drop the groups not seen for the retention period from the index and the totals.
+
+        :return:
+        """
+        index_key = self.get_index_key(project_id)
+        fingerprints = self.connection.zrangebyscore(index_key, 0, time() - settings.TRACEBACK_GROUPS_RETENTION)
+        if not fingerprints:
+            return
+        pipeline = self.connection.pipeline(transaction=False)
+        for fingerprint in fingerprints:
+            pipeline.hget(self.get_group_key(project_id, fingerprint.decode()), 'count')
+        occurrences = sum(int(count or 0) for count in pipeline.execute())
+
+        pipeline = self.connection.pipeline(transaction=False)
+        pipeline.zrem(index_key, *fingerprints)
+        pipeline.delete(*[self.get_group_key(project_id, fingerprint.decode()) for fingerprint in fingerprints])
+        pipeline.hincrby(self.get_totals_key(project_id), 'groups', -len(fingerprints))
+        pipeline.hincrby(self.get_totals_key(project_id), 'occurrences', -occurrences)
+        pipeline.execute()
+
+    def add(self, project_id, tracebacks, project_dir=None, releases_dir=None):
+        retention = settings.TRACEBACK_GROUPS_RETENTION
+        index_key = self.get_index_key(project_id)
+        totals_key = self.get_totals_key(project_id)
+        self.expire_groups(project_id)
+        zadd_later = self.connection.register_script(self.ZADD_LATER_SCRIPT)
+        pipeline = self.connection.pipeline(transaction=False)
+        # The positions of the HINCRBY of the counts in the pipeline results
+        count_indexes = []
+        for traceback in tracebacks:
+            fingerprint = traceback.get_fingerprint(project_dir, releases_dir)
+            key = self.get_group_key(project_id, fingerprint)
+            count_indexes.append(len(pipeline))
+            pipeline.hincrby(key, 'count', 1)
+            pipeline.hsetnx(key, 'first_seen', traceback.seen_at)
+            pipeline.hsetnx(key, 'sample', traceback.text[:self.MAX_SAMPLE_SIZE])
+            pipeline.hset(key, mapping={
+                'exception_type': traceback.exception_type,
+                'message': traceback.message[:1000],
+                'last_seen': traceback.seen_at,
+            })
+            pipeline.expire(key, retention)
+            zadd_later(keys=[index_key], args=[fingerprint, traceback.seen_at], client=pipeline)
+        pipeline.expire(index_key, retention)
+        results = pipeline.execute()
+
+        # The count is 1 in the new groups
+        new_groups = len([index for index in count_indexes if results[index] == 1])
+        pipeline = self.connection.pipeline(transaction=False)
+        pipeline.hincrby(totals_key, 'groups', new_groups)
+        pipeline.hincrby(totals_key, 'occurrences', len(tracebacks))
+        pipeline.expire(totals_key, retention)
+        pipeline.execute()
+
+    def get_groups(self, project_id, limit=100):
+        """
+        :return:
+            list of dicts of the groups seen last first
+        """
+        try:
+            fingerprints = self.connection.zrevrange(self.get_index_key(project_id), 0, limit - 1)
+            pipeline = self.connection.pipeline(transaction=False)
+            for fingerprint in fingerprints:
+                pipeline.hgetall(self.get_group_key(project_id, fingerprint.decode()))
+            rows = pipeline.execute()
+        except redis.RedisError as e:
+            logging.error(f'Error occurred while reading the traceback groups of the project {project_id}: {e}')
+            return []
+
+        groups = []
+        for fingerprint, data in zip(fingerprints, rows):
+            if not data:
+                continue
+            data = {key.decode(): value.decode(errors='replace') for key, value in data.items()}
+            groups.append({
+                'fingerprint': fingerprint.decode(),
+                'exception_type': data.get('exception_type', ''),
+                'message': data.get('message', ''),
+                'count': int(data.get('count', 0)),
+                'first_seen': datetime.fromtimestamp(float(data.get('first_seen', 0)), tz=timezone.utc),
+                'last_seen': datetime.fromtimestamp(float(data.get('last_seen', 0)), tz=timezone.utc),
+                'sample': data.get('sample', ''),
+            })
+        return groups
+
+    def get_summaries(self, project_ids):
+        """
+        :return:
+            dict of (number of the groups, number of the occurrences) by the project id, read in one round-trip
+        """
+        try:
+            pipeline = self.connection.pipeline(transaction=False)
+            for project_id in project_ids:
+                pipeline.hmget(self.get_totals_key(project_id), 'groups', 'occurrences')
+            rows = pipeline.execute()
+        except redis.RedisError as e:
+            logging.error(f'Error occurred while reading the traceback totals of the projects {project_ids}: {e}')
+            return {}
+        return {project_id: (max(int(groups or 0), 0), max(int(occurrences or 0), 0))
+                for project_id, (groups, occurrences) in zip(project_ids, rows)}
+
+    def get_summary(self, project_id):
+        """
+        :return:
+            (number of the groups, number of the occurrences)
+        """
+        return self.get_summaries([project_id]).get(project_id, (0, 0))
+
+
+class AIErrorLogAnalyzer(object):
+    """Fingerprint the tracebacks of the new lines of the project error log into the traceback groups."""
+    CONSUMER = 'tracebacks'
+
+    def __init__(self, project, runner):
+        self.project = project
+        self.runner = runner
+
+    def analyze(self):
+        """
+        :return:
+            number of the found tracebacks
+        """
+        log_path = self.runner.error_log_path
+        reader = AIIncrementalLogReader(
+            log_path,
+            AILogCheckpoint(self.CONSUMER, self.project.pk, os.path.basename(log_path)),
+            archive_dir=os.path.join(os.path.dirname(log_path), AILogRotator.ARCHIVE_DIR)
+        )
+        parser = AITracebackParser()
+        tracebacks = parser.parse(reader.read())
+        if tracebacks:
+            # The application runs in the release dirs of the commits when the releases are enabled
+            releases_dir = self.runner.releases.path if self.runner.releases else None
+            AITracebackGroups().add(self.project.pk, tracebacks, project_dir=self.runner.local_dir,
+                                    releases_dir=releases_dir)
+        # The traceback still being written is parsed again with the next lines
+        reader.commit(carry=parser.unfinished_lines)
+        return len(tracebacks)
@@ -0,0 +1,209 @@
+from __future__ import unicode_literals
+
+__author__ = 'David Baum'
+
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from time import time, monotonic
+
+import redis
+from django.conf import settings
+from git import RemoteProgress
+
+from github.metrics import AIMetricsStore, TRANSFER_BYTES, TRANSFER_DURATION
+
+
+class AITransfer(object):
+    """A finished clone or fetch of a project repo."""
+
+    def __init__(self, operation, duration, received_bytes, received_objects, finished_at=None):
+        self.operation = operation
+        self.duration = duration
+        self.received_bytes = received_bytes
+        self.received_objects = received_objects
+        self.finished_at = finished_at or time()
+
+    @property
+    def throughput(self):
+        """
+        :return:
+            received bytes per second or None if the transfer took no measurable time
+        """
+        if self.duration <= 0:
+            return None
+        return self.received_bytes / self.duration
+
+    @property
+    def finished_at_datetime(self):
+        return datetime.fromtimestamp(self.finished_at, tz=timezone.utc)
+
+    def to_dict(self):
+        return {
+            'operation': self.operation,
+            'duration': round(self.duration, 3),
+            'received_bytes': self.received_bytes,
+            'received_objects': self.received_objects,
+            'finished_at': self.finished_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['operation'], data['duration'], data['received_bytes'], data['received_objects'],
+                   data['finished_at'])
+
+
+class AITransferMetrics(object):
+    """
+    The recent clones and fetches of the projects in Redis lists, the newest first, to spot the slow remotes.
+    """
+    KEY_PREFIX = 'arielinstaller:transfers'
+    MAX_TRANSFERS = 50
+
+    def __init__(self):
+        self.connection = redis.Redis(connection_pool=settings.REDIS_POOL)
+
+    def get_key(self, project_id):
+        return f'{self.KEY_PREFIX}:{project_id}'
+
+    def add(self, project_id, transfer):
+        throughput = transfer.throughput
+        logging.info(f'Transfer project={project_id} operation={transfer.operation} '
+                     f'duration={transfer.duration:.3f} bytes={transfer.received_bytes} '
+                     f'objects={transfer.received_objects} '
+                     f'throughput={f"{throughput:.0f}" if throughput is not None else "-"}')
+        metrics = AIMetricsStore()
+        metrics.observe(TRANSFER_DURATION, [transfer.duration], {'operation': transfer.operation})
+        metrics.inc(TRANSFER_BYTES, transfer.received_bytes, {'operation': transfer.operation})
+        if project_id is None:
+            # The project is not saved yet
+            return
+        try:
+            pipeline = self.connection.pipeline(transaction=False)
+            pipeline.lpush(self.get_key(project_id), json.dumps(transfer.to_dict()))
+            pipeline.ltrim(self.get_key(project_id), 0, self.MAX_TRANSFERS - 1)
+            pipeline.execute()
+        except redis.RedisError as e:
+            logging.error(f'Error occurred while saving the transfer metrics of the project {project_id}: {e}')
+
+    def get_recent(self, project_id, limit=MAX_TRANSFERS):
+        """
+        :return:
+            list of AITransfer objects, the newest first
+        """
+        try:
+            rows = self.connection.lrange(self.get_key(project_id), 0, limit - 1)
+        except redis.RedisError as e:
+            logging.error(f'Error occurred while reading the transfer metrics of the project {project_id}: {e}')
+            return []
+        transfers = []
+        for row in rows:
+            try:
+                transfers.append(AITransfer.from_dict(json.loads(row)))
+            except (ValueError, KeyError):
+                continue
+        return transfers
+
+
+class AITransferProgressReporter(object):
+    """
+    Throttle the transfer progress callbacks of libgit2 and GitPython, which come thousands of times per clone.
+
+    The progress is logged every LOG_PERCENTAGE_STEP percents or LOG_INTERVAL seconds and published to the
+    AICloneProgress at most every PUBLISH_INTERVAL seconds. The finished transfer is recorded in the
+    AITransferMetrics.
+    """
+    LOG_PERCENTAGE_STEP = 10
+    LOG_INTERVAL = 5
+    PUBLISH_INTERVAL = 0.5
+
+    def __init__(self, project, operation, progress=None):
+        """
+        :param operation:
+            clone or fetch
+
+        :param progress:
+            AICloneProgress object the progress is published to
+        """
+        self.project = project
+        self.operation = operation
+        self.progress = progress
+        self.started_at = monotonic()
+        self.percentage = -1
+        self.logged_percentage = -self.LOG_PERCENTAGE_STEP
+        self.logged_at = 0
+        self.published_at = 0
+        self.received_objects = 0
+        self.total_objects = 0
+        self.received_bytes = 0
+
+    @property
+    def project_id(self):
+        return getattr(self.project, 'pk', None)
+
+    def update(self, received_objects, total_objects, received_bytes=0, indexed_deltas=0, total_deltas=0):
+        self.received_objects = received_objects
+        self.total_objects = total_objects
+        self.received_bytes = received_bytes
+
+        phase, processed, total = 'Receiving objects', received_objects, total_objects
+        if received_objects == total_objects and total_deltas:
+            phase, processed, total = 'Resolving deltas', indexed_deltas, total_deltas
+        percentage = int(100 * (float(processed) / float(total))) if total else 100
+        if percentage == self.percentage:
+            return
+        self.percentage = percentage
+
+        now = monotonic()
+        is_complete = processed == total
+        if percentage - self.logged_percentage >= self.LOG_PERCENTAGE_STEP or \
+                now - self.logged_at >= self.LOG_INTERVAL or is_complete:
+            self.logged_percentage = percentage
+            self.logged_at = now
+            logging.info(f'{self.operation.capitalize()} of the project {self.project.name}. '
+                         f'{phase}: {processed}/{total} ({percentage}%), {received_bytes} bytes')
+        if self.progress and (now - self.published_at >= self.PUBLISH_INTERVAL or is_complete):
+            self.published_at = now
+            self.progress.update(percentage, received_objects, total_objects, received_bytes)
+
+    def update_from_git(self, op_code, cur_count, max_count=None, message=''):
+        """GitPython progress callback of the clones done by the git command."""
+        if not max_count:
+            return
+        stage = op_code & RemoteProgress.OP_MASK
+        if stage == RemoteProgress.RECEIVING:
+            self.update(int(cur_count), int(max_count), self.received_bytes)
+        elif stage == RemoteProgress.RESOLVING:
+            self.update(self.total_objects, self.total_objects, self.received_bytes, int(cur_count), int(max_count))
+
+    @staticmethod
+    def get_packs_size(local_dir):
+        """
+        :return:
+            size of the packs of the repo, the git command does not report the received bytes
+        """
+        packs_dir = os.path.join(local_dir, '.git', 'objects', 'pack')
+        try:
+            return sum(entry.stat().st_size for entry in os.scandir(packs_dir) if entry.name.endswith('.pack'))
+        except OSError:
+            return 0
+
+    def finish(self, received_bytes=None):
+        """
+        Record the finished transfer, the fetches which got nothing are skipped.
+
+        :param received_bytes:
+            the received bytes if the callbacks did not report them
+
+        :return:
+            AITransfer object or None
+        """
+        if received_bytes is not None:
+            self.received_bytes = received_bytes
+        if self.operation != 'clone' and not self.received_objects:
+            return None
+        transfer = AITransfer(self.operation, monotonic() - self.started_at, self.received_bytes,
+                              self.received_objects)
+        AITransferMetrics().add(self.project_id, transfer)
+        return transfer
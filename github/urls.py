@@ -1,9 +1,13 @@
 from django.urls import path
 
-from github.views import AIProjectAccessLogFileReadView, AIProjectErrorLogFileReadView
+from github.views import AIProjectAccessLogFileReadView, AIProjectErrorLogFileReadView, AIGitHubWebhookView, \
+    AIProjectLogTailView, AIProjectLogTailPageView
 
 app_name = "github"
 urlpatterns = [
     path("<int:project_id>/access-logs/", AIProjectAccessLogFileReadView.as_view(), name="read_access_logs"),
     path("<int:project_id>/error-logs/", AIProjectErrorLogFileReadView.as_view(), name="read_error_logs"),
+    path("<int:project_id>/<str:log_type>-logs/live/", AIProjectLogTailPageView.as_view(), name="tail_logs"),
+    path("<int:project_id>/<str:log_type>-logs/events/", AIProjectLogTailView.as_view(), name="tail_logs_events"),
+    path("webhook/", AIGitHubWebhookView.as_view(), name="webhook"),
 ]
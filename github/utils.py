@@ -8,31 +8,53 @@ import sys
 import logging
 import socket
 import urllib
+import signal
 import traceback
 import subprocess
-from time import sleep
 from contextlib import closing
+from time import time
 
 from django.conf import settings
 
 from git import (
     GitCommandError,
     InvalidGitRepositoryError,
-    Repo, FetchInfo)
-from git.util import rmtree, IterableList
-from pygit2 import RemoteCallbacks, GitError, UserPass, KeypairFromMemory, clone_repository
+    Repo)
+from git.util import rmtree
+from pygit2 import (
+    RemoteCallbacks, GitError, UserPass, KeypairFromMemory, clone_repository, init_repository, Repository,
+    GIT_CHECKOUT_SAFE, GIT_MERGE_ANALYSIS_FASTFORWARD, GIT_MERGE_ANALYSIS_UP_TO_DATE)
 from uritools import urisplit
 
+from github.deploy import AIDeployPlan, AIDeployPlanner
+from github.deployments import AIDeploymentTrigger, AIDeploymentOutcome, AIDeployPhase, AIDeployTimer
+from github.envs import AIVirtualEnvCache, AIVirtualEnvError
+from github.liveness import get_listening_ports_snapshot
+from github.metrics import AIMetricsStore, DEPLOY_DURATION, DEPLOY_PHASE_DURATION
+from github.provisioning import AIProjectNotReadyError
+from github.readiness import AIReadinessWaiter, AIReadinessResult
+from github.references import AIReferenceRepo
+from github.releases import AIReleaseStore, AIReleaseError
+from github.status import AIProjectStatusCache
+from github.supervisor import AIProcessSupervisor
+from github.transfers import AITransferProgressReporter
+
 
 class PyGit2Callbacks(RemoteCallbacks):
-    def __init__(self, project, credentials=None, certificate=None):
+    def __init__(self, project, credentials=None, certificate=None, progress=None, operation='clone'):
         """
         Class for pygit2 remote callbacks.
 
+        :param progress:
+            AICloneProgress object the transfer progress is published to
+
+        :param operation:
+            clone or fetch, the name of the transfer in the progress logs and metrics
+
         :return:
         """
         self.project = project
-        self.processed_percentage = -1
+        self.reporter = AITransferProgressReporter(project, operation, progress)
         # 'x-oauth-basic' password is used only for projects imported from Github
         self.github_password = 'x-oauth-basic'
         # When the credentials are wrong libgit2 asks credentials infinitely. Let's prevent it by this flag
@@ -41,18 +63,8 @@ class PyGit2Callbacks(RemoteCallbacks):
         super(PyGit2Callbacks, self).__init__(credentials, certificate)
 
     def transfer_progress(self, stats):
-        processed = stats.received_objects
-        total = stats.total_objects
-        line = 'Cloning repo. Receiving objects: {0}/{1}'.format(processed, total)
-        logging.info(line)
-        if processed == total and stats.total_deltas:
-            processed = stats.indexed_deltas
-            total = stats.total_deltas
-            line = 'Cloning repo. Resolving deltas: {0}/{1}'.format(processed, total)
-            logging.info(line)
-        new_percentage = int(100 * (float(processed) / float(total)))
-        if self.processed_percentage != new_percentage:
-            self.processed_percentage = new_percentage
+        self.reporter.update(stats.received_objects, stats.total_objects, stats.received_bytes,
+                             stats.indexed_deltas, stats.total_deltas)
 
     def credentials(self, url, username_from_url, allowed_types):
         url_parts = urisplit(url)
@@ -87,12 +99,21 @@ class PyGit2Callbacks(RemoteCallbacks):
 
 
 class RepoTools(object):
-    def __init__(self, project):
+    # The reference repo tips advertised as the local commits while cloning
+    REFERENCE_TIPS_REFS = 'refs/reference-tips'
+
+    def __init__(self, project, progress=None):
+        """
+        :param progress:
+            AICloneProgress object the clone progress is published to
+        """
         self.project = project
+        self.progress = progress
         self.repo = None
         url_parts = urisplit(self.project.url)
         self.local_dir = f'{settings.GIT_REPOS_DIR}{url_parts.path}'
         self.local_dir = os.path.abspath(self.local_dir)
+        self.reference = AIReferenceRepo.for_project(project) if settings.GIT_SHARED_OBJECTS else None
 
     def get_repo_url(self, new_scheme=None, new_username=None):
         """
@@ -169,12 +190,22 @@ class RepoTools(object):
         """
         Remove the local repo dir.
 
+        Only the checkout is removed, the objects it borrows stay in the family reference repo, which is removed
+        with its last borrower.
+
         :return:
         """
         if os.path.exists(self.local_dir):
             logging.info("Removing the local repo {0}".format(self.local_dir))
 
             rmtree(self.local_dir)
+        AIReleaseStore(self.local_dir).delete()
+
+        if self.reference:
+            try:
+                self.reference.release(self.local_dir)
+            except (GitCommandError, OSError) as e:
+                logging.error(f"Error occurred while releasing the reference repo {self.reference.path}: {e}")
 
     def update_repo(self):
         """
@@ -187,25 +218,234 @@ class RepoTools(object):
 
             rmtree(self.local_dir)
 
-    def git_fetch(self):
+    @property
+    def clone_depth(self):
+        depth = getattr(self.project, 'clone_depth', None)
+        return settings.GIT_CLONE_DEPTH if depth is None else depth
+
+    @property
+    def clone_filter(self):
+        return getattr(self.project, 'clone_filter', None) or settings.GIT_CLONE_FILTER
+
+    def is_partial_clone(self):
+        """Whether the project is cloned shallow or without some objects."""
+        return bool(self.clone_depth or self.clone_filter)
+
+    def can_clone_by_git(self):
+        """
+        pygit2 can neither clone shallow nor partially, the git command does, but it gets no credentials
+        from the installer, so it clones only the repos it has access to by itself.
+        """
+        return not self.project.ssh_key and not self.project.git_password
+
+    def is_shallow(self):
+        return os.path.exists(os.path.join(self.local_dir, '.git', 'shallow'))
+
+    def is_full_clone(self):
+        """Whether the local repo has all the objects of its history, whatever the project settings are now."""
+        if self.is_shallow():
+            return False
+        with Repo(self.local_dir).config_reader() as config:
+            return not config.has_option('remote "origin"', 'partialclonefilter')
+
+    def pygit2_clone_borrowing_repo(self, git_repo_url, callbacks):
+        """
+        Clone the repo by pygit2 borrowing the objects of the family reference repo.
+
+        libgit2 clones into empty repos only and negotiates the fetch with the local refs, so the clone is done
+        by hand: the temporary refs to the reference tips make the remote send only the objects the reference
+        misses, then the remote default branch is checked out.
+
+        :return:
+        """
+        init_repository(self.local_dir)
+        with self.reference.lock():
+            self.reference.link(self.local_dir)
+            tips = self.reference.get_tips()
+        # Reopened to read the alternates
+        repository = Repository(self.local_dir)
+        for index, tip in enumerate(tips):
+            repository.references.create(f'{self.REFERENCE_TIPS_REFS}/{index}', tip, force=True)
+
+        remote = repository.remotes.create('origin', git_repo_url)
+        remote_heads = remote.ls_remotes(callbacks=callbacks)
+        # The fetch asks for the credentials again, the flag guards against the loop of a single request only
+        callbacks.was_asked_for_credentials = False
+        remote.fetch(callbacks=callbacks)
+        for name in list(repository.references):
+            if name.startswith(f'{self.REFERENCE_TIPS_REFS}/'):
+                repository.references.delete(name)
+
+        head_ref = next((head['symref_target'] for head in remote_heads if head['name'] == 'HEAD'), None)
+        if not head_ref:
+            # An empty remote
+            return
+        branch_name = head_ref[len('refs/heads/'):]
+        commit = repository.get(repository.references[f'refs/remotes/origin/{branch_name}'].target)
+        branch = repository.branches.local.create(branch_name, commit)
+        branch.upstream = repository.branches.remote[f'origin/{branch_name}']
+        repository.checkout(branch)
+
+    def share_objects(self, repack=False):
+        """
+        Borrow the objects of the family reference repo and feed it with the commits of the full clone.
+
+        :param repack:
+            drop the local copies of the objects the reference got since the repo was linked
+
+        :return:
+        """
+        if not self.reference or not os.path.exists(self.local_dir):
+            return
+        try:
+            self.reference.attach(self.local_dir, feed=self.is_full_clone(), repack=repack)
+        except (GitCommandError, OSError) as e:
+            logging.error(f"Error occurred while sharing the objects of {self.local_dir} with the reference repo "
+                          f"{self.reference.path}: {e}")
+
+    def gc(self):
+        """
+        Compact the local repo. The borrowed objects are never removed, the reference repo does not prune.
+
+        :return:
+        """
+        if not os.path.exists(self.local_dir):
+            return
+        if self.reference:
+            self.share_objects(repack=True)
+        else:
+            try:
+                Repo(self.local_dir).git.gc('--auto', '--quiet')
+            except GitCommandError as e:
+                logging.error(f"Error occurred while collecting the garbage of {self.local_dir}: {e}")
+
+    def git_partial_clone_repo(self, git_repo_url):
+        """
+        Clone the project branch tip by the git command with the configured depth and filter.
+
+        :return:
+            git.Repo object
+        """
+        options = {}
+        if self.clone_depth:
+            options['depth'] = self.clone_depth
+        if self.clone_filter:
+            options['filter'] = self.clone_filter
+        reporter = AITransferProgressReporter(self.project, 'clone', self.progress)
+        if not self.reference:
+            logging.info(f"Cloning {git_repo_url} into {self.local_dir} with {options}")
+            repo = Repo.clone_from(git_repo_url, self.local_dir, progress=reporter.update_from_git, **options)
+        else:
+            # Locked until the clone writes its alternates, the reference must not be removed under it
+            with self.reference.lock():
+                if self.reference.exists():
+                    options['reference_if_able'] = self.reference.path
+                logging.info(f"Cloning {git_repo_url} into {self.local_dir} with {options}")
+                repo = Repo.clone_from(git_repo_url, self.local_dir, progress=reporter.update_from_git, **options)
+                self.reference.link(self.local_dir)
+        reporter.finish(received_bytes=reporter.get_packs_size(self.local_dir))
+        return repo
+
+    def get_remote_head(self):
+        """
+        Ask the remote for the tip of the deployed branch.
+
+        Only the ref advertisement is downloaded, no objects are fetched.
+
+        :return:
+            hexsha of the remote branch tip or None if the remote has no such branch
+        """
+        repository = Repository(self.local_dir)
+        branch_ref = f'refs/heads/{repository.head.shorthand}'
+        remote = repository.remotes['origin']
+        for remote_ref in remote.ls_remotes(callbacks=PyGit2Callbacks(self.project)):
+            if remote_ref['name'] == branch_ref:
+                return str(remote_ref['oid'])
+        return None
+
+    def has_remote_changes(self):
+        """
+        Check whether the remote branch moved since the last fetch.
+
+        :return:
+            False only when the remote branch tip is known to be the project last_commit
+        """
+        if not self.project.last_commit or not os.path.exists(self.local_dir):
+            return True
+        try:
+            remote_head = self.get_remote_head()
+        except Exception:
+            error = "\n".join(traceback.format_exc().splitlines())
+            logging.error(f"Error occurred while probing the remote head of {self.local_dir}: {error}. "
+                          f"Falling back to fetching")
+            return True
+        return remote_head != self.project.last_commit
+
+    def git_fetch(self, save=True):
+        """
+        Pull the new commits of the project into the local repo.
+
+        :param save:
+            save the project after fetching. The concurrent fetcher passes False and stores
+            the changed projects in one batch instead
+
+        :return:
+        """
         git_repo_url = self.get_repo_url()
         if os.path.exists(self.local_dir):
             logging.info(f"Fetching the new commits for {self.local_dir}")
             self.repo = Repo(self.local_dir)
             try:
-                origin = self.repo.remotes.origin
-                response: IterableList[FetchInfo] = origin.pull()
-                for fetch_info in response:
-                    if fetch_info.commit:
-                        self.project.last_commit = fetch_info.commit
-            except GitCommandError as e:
+                if self.is_full_clone() and not self.repo.head.is_detached:
+                    self.project.last_commit = self.pygit2_fetch()
+                else:
+                    # libgit2 neither fetches into the shallow repos nor gets the missing objects of the partial ones
+                    origin = self.repo.remotes.origin
+                    if self.clone_depth and self.is_shallow():
+                        # Keep the repo shallow, otherwise every pull deepens its history. The shallow history has
+                        # no merge base with the new commits, so the branch is moved to the fetched tip
+                        origin.fetch(self.repo.active_branch.name, depth=self.clone_depth)
+                        self.repo.git.reset('--hard', 'FETCH_HEAD')
+                    else:
+                        origin.pull()
+                    # The pull reports every fetched branch, the deployed commit is the one checked out
+                    self.project.last_commit = self.repo.head.commit.hexsha
+                self.share_objects()
+            except (GitCommandError, GitError) as e:
                 error = f"Error occurred while cloning the repo with url {git_repo_url} to {self.local_dir}: {e}. "
                 logging.error("Error occurred while cloning the repo with url {0} to {1}: {2}. "
                               "Finishing the task".format(git_repo_url, self.local_dir, e))
                 self.project.last_error = error
-            if self.project.pk:
+            if save and self.project.pk:
                 self.project.save()
 
+    def pygit2_fetch(self):
+        """
+        Fetch the deployed branch by pygit2 and fast-forward the checkout to it, without spawning git.
+
+        :return:
+            hexsha of the checked out commit
+        """
+        repository = Repository(self.local_dir)
+        branch_name = repository.head.shorthand
+        remote_ref = f'refs/remotes/origin/{branch_name}'
+        callbacks = PyGit2Callbacks(self.project, operation='fetch')
+        repository.remotes['origin'].fetch([f'+refs/heads/{branch_name}:{remote_ref}'], callbacks=callbacks)
+        callbacks.reporter.finish()
+
+        remote_oid = repository.references[remote_ref].target
+        merge_analysis, _ = repository.merge_analysis(remote_oid)
+        if merge_analysis & GIT_MERGE_ANALYSIS_UP_TO_DATE:
+            return str(repository.head.target)
+        if not merge_analysis & GIT_MERGE_ANALYSIS_FASTFORWARD:
+            raise GitError(f'The branch {branch_name} diverged from {remote_ref}, it cannot be fast-forwarded')
+
+        # The safe checkout fails on the local changes instead of overwriting them, like the pull does
+        repository.checkout_tree(repository.get(remote_oid), strategy=GIT_CHECKOUT_SAFE)
+        repository.references[f'refs/heads/{branch_name}'].set_target(
+            remote_oid, f'pull: Fast-forward to {remote_oid}')
+        return str(remote_oid)
+
     def pygit2_clone_repo(self):
         """
         Clone the repo by pygit2 for the project and returns repo object.
@@ -220,20 +460,29 @@ class RepoTools(object):
         else:
             try:
                 self.delete_repo()
-                if self.project:
+                if self.project and self.is_partial_clone() and self.can_clone_by_git():
+                    self.repo = self.git_partial_clone_repo(git_repo_url)
+                    self.project.last_commit = self.repo.head.commit.hexsha
+                elif self.project:
+                    if self.is_partial_clone():
+                        logging.info(f"Cloning the full history of {git_repo_url}, the git command cannot use "
+                                     f"the project credentials")
                     logging.error("Cloning {0} into {1}".format(git_repo_url, self.local_dir))
-                    pygit2_callbacks = PyGit2Callbacks(self.project)
-                    clone_repository(git_repo_url, self.local_dir, callbacks=pygit2_callbacks)
+                    pygit2_callbacks = PyGit2Callbacks(self.project, progress=self.progress)
+                    if self.reference:
+                        self.pygit2_clone_borrowing_repo(git_repo_url, pygit2_callbacks)
+                    else:
+                        clone_repository(git_repo_url, self.local_dir, callbacks=pygit2_callbacks)
                     logging.error('Finished cloning {0} into {1}'.format(git_repo_url, self.local_dir))
+                    pygit2_callbacks.reporter.finish()
                     if os.path.exists(self.local_dir):
                         self.repo = Repo(self.local_dir)
 
                         try:
                             origin = self.repo.remotes.origin
-                            response: IterableList[FetchInfo] = origin.pull()
-                            for fetch_info in response:
-                                if fetch_info.commit:
-                                    self.project.last_commit = fetch_info.commit
+                            origin.pull()
+                            self.project.last_commit = self.repo.head.commit.hexsha
+                            self.share_objects(repack=True)
                         except GitCommandError as e:
                             error = f"Error occurred while cloning the repo with url {git_repo_url} to {self.local_dir}: {e}. "
                             logging.error("Error occurred while cloning the repo with url {0} to {1}: {2}. "
@@ -320,78 +569,388 @@ class AIApplicationRunner(object):
     LOGS_DIR = "logs"
     ACCESS_LOG = f"{LOGS_DIR}/access.log"
     ERROR_LOG = f"{LOGS_DIR}/error.log"
+    PID_FILE = f"{LOGS_DIR}/gunicorn.pid"
+    NEXT_PID_FILE = f"{LOGS_DIR}/gunicorn.next.pid"
+    # The gunicorn default format with the request time in microseconds appended for the traffic analytics
+    ACCESS_LOG_FORMAT = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s" %(D)s'
     ENV_DIR = ".env"
 
     def __init__(self, project):
+        """
+        The repo is cloned by the clone_project_task only, AIProjectNotReadyError is raised until it is ready.
+        """
         self.project = project
 
         self.url_parts = urisplit(self.project.url)
         self.local_dir = f'{settings.GIT_REPOS_DIR}{self.url_parts.path}'
         self.local_dir = os.path.abspath(self.local_dir)
-        if not os.path.exists(self.local_dir):
-            error_message = f'The project does not exist in {self.local_dir}'
-            logging.info(error_message)
-
-            repo_tools = RepoTools(project=project)
-            repo_tools.pygit2_clone_repo()
+        if not project.is_ready or not os.path.exists(self.local_dir):
+            raise AIProjectNotReadyError(project)
         if not os.path.exists(f'{self.local_dir}/{self.LOGS_DIR}'):
             os.mkdir(f'{self.local_dir}/{self.LOGS_DIR}')
         dirname = os.path.dirname(self.local_dir)
         self.dirname = os.path.basename(dirname)
+        self.supervisor = AIProcessSupervisor(project, self.pid_path)
+        self.releases = AIReleaseStore(self.local_dir) if settings.GIT_RELEASES else None
+
+    def run(self, trigger=AIDeploymentTrigger.ADMIN, deployment=None, commit=None):
+        """
+        Start or restart the application and wait until it is ready, the phase timings are recorded in the
+        deployment history.
 
-    def run(self):
-        self.kill_application()
+        :param trigger:
+            AIDeploymentTrigger of the new deployment record
 
-        if os.path.exists(self.env_path):
-            rmtree(self.env_path)
+        :param deployment:
+            AIDeployment object started by deploy(), None creates a new one
 
-        shell_command = ""
-        if settings.CREATE_VIRTUAL_ENV:
-            self.create_env()
-            shell_command = f"""
-                source {self.env_path}/bin/activate
+        :param commit:
+            the release to start, None restarts the current release
+
+        :return:
+            AIReadinessResult object, the error is also set to the project last_error
+        """
+        commit = commit or self.get_release_commit()
+        deployment = deployment or self.start_deployment(trigger, commit=commit)
+        timer = AIDeployTimer()
+        try:
+            result = self.run_phases(timer, commit)
+        except Exception:
+            self.finish_deployment(deployment, AIDeploymentOutcome.FAILED, traceback.format_exc(), timer)
+            raise
+        self.finish_deployment(deployment, AIDeploymentOutcome.SUCCEEDED if result else AIDeploymentOutcome.FAILED,
+                               result.error, timer)
+        return result
+
+    def run_phases(self, timer, commit=None):
+        # Prepare the release and its env first, so the running application is not stopped when they cannot be built
+        try:
+            app_dir, env_path = self.prepare_release(commit, timer=timer)
+        except (AIVirtualEnvError, AIReleaseError) as e:
+            logging.error(f'Error occurred while preparing the release {commit} of {self.local_dir}: {e}')
+            self.project.last_error = str(e)
+            if self.project.pk:
+                type(self.project).objects.filter(pk=self.project.pk).update(last_error=self.project.last_error)
+            return AIReadinessResult(False, 0, str(e))
+        env_shell_command = f"""
+            pip install --find-links {settings.WHEELHOUSE_DIR} -r {app_dir}/requirements.txt
+        """
+        if env_path:
+            # Activate the content-addressed env itself, the .env link may be swapped by the next deploy
+            env_shell_command = f"""
+                source {env_path}/bin/activate
             """
+        previous_release = self.releases.activate(app_dir) if self.releases else None
 
-        shell_command = f"""
-        {shell_command}
-        pip install -r {self.local_dir}/requirements.txt
-        cd {self.local_dir}
-        printf 'from app import app' 'if __name__ == '__main__':' '    app.run()' > start.py
-        gunicorn -b 0.0.0.0:{self.project.port} start:app --access-logfile {self.access_log_path} --error-logfile {self.error_log_path} --daemon
-        """
-        result = subprocess.run(
-            shell_command,
-            stdout=subprocess.PIPE,
-            universal_newlines=True,
-            shell=True
-        )
-        for line in result.stdout.split("\n"):
-            logging.info(line)
-        sleep(1)
+        if settings.BLUE_GREEN_DEPLOYS and self.is_blue_green_possible():
+            result = self.run_blue_green(env_shell_command, timer=timer)
+        else:
+            with timer.measure(AIDeployPhase.KILL):
+                self.kill_application()
+            started_at = time()
+            result = self.start_application(env_shell_command, [f'0.0.0.0:{self.project.port}'], self.pid_path,
+                                            self.project.port, self.project.health_check_path or None, timer=timer)
+            if result:
+                self.supervisor.record(started_after=started_at)
+        if not result:
+            self.project.last_error = result.error
+            if self.project.pk:
+                type(self.project).objects.filter(pk=self.project.pk).update(last_error=result.error)
+            if previous_release and previous_release != app_dir:
+                # The restart by the health check brings back the release which worked
+                logging.info(f'Pointing the current release of {self.project.name} back to {previous_release}')
+                self.releases.activate(previous_release)
+        elif self.releases:
+            self.releases.prune(settings.GIT_RELEASES_KEEP)
+            if os.path.islink(f"{self.local_dir}/{self.ENV_DIR}"):
+                # The env link of the repo started before the releases, it would keep its env from the eviction
+                os.unlink(f"{self.local_dir}/{self.ENV_DIR}")
+        self.refresh_status()
+        return result
+
+    def prepare_release(self, commit, timer=None):
+        """
+        Check out the release of the commit beside the running one and link its env.
 
-    def create_env(self):
-        if os.path.exists(self.local_dir):
-            logging.info(f'Creating virtual env in {self.local_dir}')
+        :return:
+            (path of the application dir, path of the env or None if the virtual envs are not created)
+        """
+        app_dir = self.releases.prepare(commit) if self.releases else self.local_dir
+        # The gunicorn entry point is in every release, the HUP reload imports the release without a restart
+        with open(f"{app_dir}/start.py", 'w') as f:
+            f.write('from app import app\n')
+        env_path = self.create_env(app_dir, timer=timer) if settings.CREATE_VIRTUAL_ENV else None
+        return app_dir, env_path
+
+    def get_release_commit(self):
+        """
+        :return:
+            the commit of the current release, the project last_commit or the repo HEAD for the first release
+        """
+        if not self.releases:
+            return self.project.last_commit
+        commit = self.releases.get_current_commit() or self.project.last_commit
+        if not commit:
+            commit = Repo(self.local_dir).head.commit.hexsha
+        return commit
+
+    def rollback(self, commit=None):
+        """
+        Point the current release to a kept one and restart the application, its env is reused.
+
+        :param commit:
+            the release to roll back to, None is the previously activated one
 
-            command = f"virtualenv -p python3 {self.env_path}"
+        :return:
+            AIReadinessResult object
+        """
+        if not self.releases:
+            raise AIReleaseError('The releases are disabled by GIT_RELEASES')
+        release = self.releases.get_release(commit) if commit else self.releases.get_previous()
+        if release is None:
+            raise AIReleaseError(f'There is no release {commit or "before the current one"} to roll back to')
+        logging.info(f'Rolling back the project {self.project.name} to the release {release.commit}')
+        deployment = self.start_deployment(AIDeploymentTrigger.ROLLBACK,
+                                           previous_commit=self.releases.get_current_commit(),
+                                           commit=release.commit)
+        return self.run(deployment=deployment, commit=release.commit)
+
+    def start_application(self, env_shell_command, binds, pid_path, port, http_path=None, timer=None):
+        """
+        Start the gunicorn master as a daemon and wait until it is ready on the port.
+
+        The port is bound with SO_REUSEPORT, so the next release can bind it while this one still serves.
+
+        :param http_path:
+            the path to probe by HTTP, None waits for the port only
+
+        :param timer:
+            AIDeployTimer object the boot and time-to-ready durations are added to
+
+        :return:
+            AIReadinessResult object
+        """
+        waiter = AIReadinessWaiter(
+            port,
+            http_path=http_path,
+            timeout=settings.DEPLOY_READINESS_TIMEOUT,
+            error_log_path=self.error_log_path,
+            error_log_offset=AIReadinessWaiter.get_log_offset(self.error_log_path),
+            pid_reader=lambda: self.supervisor.read_pid_file(pid_path),
+            is_alive=self.supervisor.is_alive
+        )
+        binds = " ".join(f"-b {bind}" for bind in binds)
+        # The release link itself is the gunicorn dir, so the HUP reload imports the newly activated release
+        shell_command = f"""
+        {env_shell_command}
+        cd {self.app_dir}
+        gunicorn {binds} --chdir {self.app_dir} --reuse-port start:app --access-logfile {self.access_log_path} --access-logformat '{self.ACCESS_LOG_FORMAT}' --error-logfile {self.error_log_path} --pid {pid_path} --daemon
+        """
+        timer = timer or AIDeployTimer()
+        with timer.measure(AIDeployPhase.BOOT):
             result = subprocess.run(
-                command,
+                shell_command,
                 stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
                 universal_newlines=True,
-                shell=True
+                shell=True,
+                executable='/bin/bash'  # "source" is not available in every /bin/sh
             )
-            for line in result.stdout.split("\n"):
-                logging.info(line)
+        for line in result.stdout.split("\n"):
+            logging.info(line)
+        if result.returncode != 0:
+            error = f'The application failed to start with the exit code {result.returncode}: {result.stdout[-2000:]}'
+            logging.error(error)
+            return AIReadinessResult(False, 0, error)
+
+        readiness = waiter.wait()
+        timer.add(AIDeployPhase.READY, readiness.duration)
+        logging.info(f'The application {self.project.name} on port {port} is {readiness}')
+        return readiness
+
+    def is_blue_green_possible(self):
+        """The running release must be started with --reuse-port to let the new one bind the same port."""
+        pid = self.supervisor.get_pid()
+        if not pid or not self.is_application_running():
+            return False
+        try:
+            with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                cmdline = f.read().split(b'\0')
+        except OSError:
+            return False
+        return b'--reuse-port' in cmdline
 
-    def is_application_running(self):
+    def run_blue_green(self, env_shell_command, timer=None):
+        """
+        Start the new release beside the running one and retire the old master only when the new one is ready.
+
+        The new master binds the project port with SO_REUSEPORT and a free loopback side port used by the
+        readiness probe. When the new release does not get ready, it is stopped and the old one keeps serving.
+
+        :return:
+            AIReadinessResult object, ready if the new release replaced the old one
+        """
+        old_pid = self.supervisor.get_pid()
+        side_port = self.get_free_port()
+        logging.info(f'Starting the new release of {self.project.name} beside the master {old_pid}, '
+                     f'probing it on port {side_port}')
+        if os.path.exists(self.next_pid_path):
+            os.unlink(self.next_pid_path)
+        started_at = time()
+        result = self.start_application(env_shell_command,
+                                        [f'0.0.0.0:{self.project.port}', f'127.0.0.1:{side_port}'],
+                                        self.next_pid_path, side_port, self.project.health_check_path or '/',
+                                        timer=timer)
+        if not result:
+            result.error = f'The new release failed, keeping the running release. {result.error}'
+            logging.error(result.error)
+            new_pid = self.supervisor.read_pid_file(self.next_pid_path)
+            if new_pid and self.supervisor.is_alive(new_pid):
+                self.supervisor.signal(new_pid, signal.SIGTERM, process_group=True)
+            return result
+
+        os.replace(self.next_pid_path, self.pid_path)
+        self.supervisor.record(started_after=started_at)
+        logging.info(f'The new release of {self.project.name} is ready, retiring the master {old_pid}')
+        # The old workers finish their requests in the background, the port is still served by the new release
+        with (timer or AIDeployTimer()).measure(AIDeployPhase.KILL):
+            self.supervisor.signal(old_pid, signal.SIGTERM, process_group=True)
+        return result
+
+    @staticmethod
+    def get_free_port():
         with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as sock:
-            sock.settimeout(5)
-            result = sock.connect_ex(("127.0.0.1", self.project.port))
-            return result == 0
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    def deploy(self, previous_commit, trigger=AIDeploymentTrigger.SCHEDULER):
+        """
+        Deploy the project last_commit by the cheapest safe action for the diff from previous_commit.
+
+        :param previous_commit:
+            the commit the application was running before the fetch
+
+        :param trigger:
+            AIDeploymentTrigger of the deployment record
+
+        :return:
+            AIDeployPlan object
+        """
+        if self.releases:
+            # The rolled back release is running, not the commit before the fetch
+            previous_commit = self.releases.get_current_commit() or previous_commit
+        plan = AIDeployPlanner(self.project, self.local_dir).plan(previous_commit, self.project.last_commit)
+        logging.info(f'Deploy plan of the project {self.project.name} {previous_commit}..{self.project.last_commit}: '
+                     f'{plan}')
+        self.project.last_deploy_plan = plan.action
+        self.project.last_deploy_plan_reason = plan.reason
+        if self.project.pk:
+            type(self.project).objects.filter(pk=self.project.pk).update(
+                last_deploy_plan=plan.action,
+                last_deploy_plan_reason=plan.reason
+            )
+        deployment = self.start_deployment(trigger, previous_commit=previous_commit, plan=plan)
+
+        if plan.action == AIDeployPlan.NOTHING and self.is_application_running():
+            self.finish_deployment(deployment, AIDeploymentOutcome.SKIPPED)
+            return plan
+        if plan.action == AIDeployPlan.RELOAD and self.reload_application(commit=self.project.last_commit):
+            self.finish_deployment(deployment, AIDeploymentOutcome.SUCCEEDED)
+            return plan
+        self.run(deployment=deployment, commit=self.project.last_commit)
+        return plan
+
+    def start_deployment(self, trigger, previous_commit=None, plan=None, commit=None):
+        """
+        :param commit:
+            the deployed commit, None is the project last_commit
+
+        :return:
+            AIDeployment object or None if the project is not saved
+        """
+        if not self.project.pk:
+            return None
+        return self.project.deployments.create(
+            trigger=trigger,
+            previous_commit=previous_commit,
+            commit=commit or self.project.last_commit,
+            plan=plan.action if plan else None,
+            plan_reason=plan.reason if plan else None
+        )
+
+    @staticmethod
+    def finish_deployment(deployment, outcome, error=None, timer=None):
+        if not deployment:
+            return
+        deployment.finish(outcome, error=error, durations=timer.durations if timer else None)
+        metrics = AIMetricsStore()
+        metrics.observe(DEPLOY_DURATION, [deployment.duration], {'trigger': deployment.trigger, 'outcome': outcome})
+        for phase, duration in (timer.durations if timer else {}).items():
+            metrics.observe(DEPLOY_PHASE_DURATION, [duration], {'phase': phase})
+        logging.info(f'Deployment {deployment.pk} of the project {deployment.project_id} {outcome} '
+                     f'in {deployment.duration:.2f} seconds, phases: {deployment.get_durations_display()}')
+
+    def reload_application(self, commit=None):
+        """
+        Gracefully reload the gunicorn workers with the new code by HUP signal to the master.
+
+        :param commit:
+            the release activated before the reload, None reloads the current one
+
+        :return:
+            True if the signal was sent
+        """
+        pid = self.supervisor.get_pid()
+        if not pid or not self.is_application_running():
+            return False
+        if self.releases and commit:
+            try:
+                app_dir, env_path = self.prepare_release(commit)
+            except (AIVirtualEnvError, AIReleaseError) as e:
+                logging.error(f'Error occurred while preparing the release {commit} of {self.local_dir}: {e}')
+                return False
+            self.releases.activate(app_dir)
+            self.releases.prune(settings.GIT_RELEASES_KEEP)
+        if not self.supervisor.signal(pid, signal.SIGHUP):
+            return False
+        logging.info(f'Reloaded the application {pid} on port {self.project.port}')
+        return True
+
+    def create_env(self, app_dir=None, timer=None):
+        """
+        Link the .env of the application dir to the cached env built from its requirements.txt.
+
+        The env is reused when the requirements and the python version did not change.
+
+        :param app_dir:
+            the release dir, None is the current application dir
+
+        :param timer:
+            AIDeployTimer object the virtualenv and pip durations are added to
+
+        :return:
+            path of the env
+        """
+        app_dir = app_dir or self.app_dir
+        env_cache = AIVirtualEnvCache()
+        env_path, is_created = env_cache.ensure_env(f"{app_dir}/requirements.txt", timer=timer)
+        env_cache.link(env_path, f"{app_dir}/{self.ENV_DIR}")
+        return env_path
+
+    def is_application_running(self, max_age=0):
+        """
+        Check the project port is listening.
+
+        :param max_age:
+            the acceptable age of the listening ports snapshot in seconds, 0 reads a fresh one
+
+        :return:
+        """
+        return get_listening_ports_snapshot(max_age).is_listening(self.project.port)
 
     def kill_application(self):
-        is_running = self.is_application_running()
-        if is_running:
+        # The application started before the pid files were kept is found by its port
+        if not self.supervisor.stop() and self.is_application_running():
             logging.info(f'Killing the application running on port {self.project.port}')
             pids = subprocess.run(
                 ['lsof', '-t', f'-i:{self.project.port}'], text=True, capture_output=True
@@ -401,16 +960,35 @@ class AIApplicationRunner(object):
                     if subprocess.run(['kill', '-TERM', pid]).returncode != 0:
                         result = subprocess.run(['kill', '-KILL', pid], check=True)
                         logging.info(result)
-                sleep(1)  # Give OS time to free up the PORT usage
+                self.supervisor.wait_for_port_release(settings.APPLICATION_STOP_TIMEOUT)
+        self.refresh_status()
 
-        if os.path.exists(self.access_log_path):
-            os.unlink(self.access_log_path)
-        if os.path.exists(self.error_log_path):
-            os.unlink(self.error_log_path)
+    def refresh_status(self):
+        if self.project.pk:
+            AIProjectStatusCache().refresh([self.project])
+
+    @property
+    def app_dir(self):
+        """The current release link or the repo itself when the releases are disabled or not created yet."""
+        if self.releases and self.releases.get_current():
+            return self.releases.current_path
+        return self.local_dir
 
     @property
     def env_path(self):
-        return f"{self.local_dir}/{self.ENV_DIR}"
+        return f"{self.app_dir}/{self.ENV_DIR}"
+
+    @property
+    def pid_path(self):
+        return f"{self.local_dir}/{self.PID_FILE}"
+
+    @property
+    def next_pid_path(self):
+        return f"{self.local_dir}/{self.NEXT_PID_FILE}"
+
+    @property
+    def requirements_path(self):
+        return f"{self.app_dir}/requirements.txt"
 
     @property
     def error_log_path(self):
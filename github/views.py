@@ -2,56 +2,237 @@ from __future__ import unicode_literals
 
 __author__ = 'David Baum'
 
-import os
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
 
-from django.http import Http404, HttpResponse
+import redis
+
+from django.conf import settings
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    HttpResponseRedirect,
+    JsonResponse
+)
+from django.shortcuts import render
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date
 from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from uritools import urisplit
 
+from github.deployments import AIDeploymentTrigger
+from github.logs import serve_log_file, stream_log_events
+from github.metrics import AIMetricsCollector
 from github.models import AIGitHubProject
+from github.provisioning import AIProjectNotReadyError
+from github.status import AIProjectStatusCache
 from github.utils import AIApplicationRunner
+from utils.jobs.scheduler import enqueue_fetch_and_deploy_project
+
+
+def add_project_status_headers(response, project_id):
+    """Expose the cached project status without probing the application."""
+    status = AIProjectStatusCache().get(project_id)
+    if status:
+        response['X-Project-Running'] = '1' if status.is_running else '0'
+        response['X-Project-Status-Probed-At'] = http_date(status.probed_at)
+
+
+def redirect_to_provisioning(project_id):
+    """The logs of the project which repo is not cloned yet are replaced by its provisioning page."""
+    meta = AIGitHubProject._meta
+    return HttpResponseRedirect(reverse(f'admin:{meta.app_label}_{meta.model_name}_provisioning', args=[project_id]))
 
 
 class AIProjectAccessLogFileReadView(View):
-    content_type_value = 'text/plain'
+    content_type_value = 'text/plain; charset=utf-8'
     model = AIGitHubProject
 
     def get(self, request, project_id):
         try:
             instance = self.model.objects.get(pk=project_id)
-            access_logs_path = AIApplicationRunner(instance).access_log_path
-            if os.path.exists(access_logs_path):
-                with open(access_logs_path, 'r') as f:
-                    file_data = f.read()
-                    response = HttpResponse(
-                        file_data,
-                        content_type=self.content_type_value
-                    )
-                    response['Content-Disposition'] = 'inline; filename=' + os.path.basename(access_logs_path)
-                    return response
-            else:
-                raise Http404
         except self.model.DoesNotExist:
             raise Http404
+        try:
+            access_logs_path = AIApplicationRunner(instance).access_log_path
+        except AIProjectNotReadyError:
+            return redirect_to_provisioning(instance.pk)
+        response = serve_log_file(request, access_logs_path, content_type=self.content_type_value)
+        add_project_status_headers(response, instance.pk)
+        return response
 
 
 class AIProjectErrorLogFileReadView(View):
-    content_type_value = 'text/plain'
+    content_type_value = 'text/plain; charset=utf-8'
     model = AIGitHubProject
 
     def get(self, request, project_id):
         try:
             instance = self.model.objects.get(pk=project_id)
+        except self.model.DoesNotExist:
+            raise Http404
+        try:
             error_log_path = AIApplicationRunner(instance).error_log_path
-            if os.path.exists(error_log_path):
-                with open(error_log_path, 'r') as f:
-                    file_data = f.read()
-                    response = HttpResponse(
-                        file_data,
-                        content_type=self.content_type_value
-                    )
-                    response['Content-Disposition'] = 'inline; filename=' + os.path.basename(error_log_path)
-                    return response
-            else:
-                raise Http404
+        except AIProjectNotReadyError:
+            return redirect_to_provisioning(instance.pk)
+        response = serve_log_file(request, error_log_path, content_type=self.content_type_value)
+        add_project_status_headers(response, instance.pk)
+        return response
+
+
+class AIProjectLogTailView(View):
+    """Server-Sent Events with the new lines of the project access or error log."""
+    model = AIGitHubProject
+    log_types = ('access', 'error')
+
+    def get_log_path(self, project_id, log_type):
+        if log_type not in self.log_types:
+            raise Http404
+        try:
+            instance = self.model.objects.get(pk=project_id)
         except self.model.DoesNotExist:
             raise Http404
+        runner = AIApplicationRunner(instance)
+        return instance, runner.access_log_path if log_type == 'access' else runner.error_log_path
+
+    def get(self, request, project_id, log_type):
+        try:
+            instance, log_path = self.get_log_path(project_id, log_type)
+        except AIProjectNotReadyError:
+            return redirect_to_provisioning(project_id)
+        return stream_log_events(request, log_path)
+
+
+class AIProjectLogTailPageView(AIProjectLogTailView):
+    """The page following the project log live."""
+    template_name = 'github/log_tail.html'
+
+    def get(self, request, project_id, log_type):
+        try:
+            instance, log_path = self.get_log_path(project_id, log_type)
+        except AIProjectNotReadyError:
+            return redirect_to_provisioning(project_id)
+        return render(request, self.template_name, {
+            'project': instance,
+            'log_type': log_type,
+            'events_url': reverse('github:tail_logs_events', args=[instance.pk, log_type]),
+        })
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AIGitHubWebhookView(View):
+    """
+    Receive GitHub push events and redeploy the pushed project.
+
+    The payload must be signed with settings.GITHUB_WEBHOOK_SECRET (X-Hub-Signature-256 header).
+    """
+    model = AIGitHubProject
+    repository_url_keys = ('clone_url', 'html_url', 'ssh_url', 'git_url', 'svn_url', 'url')
+
+    def post(self, request):
+        secret = settings.GITHUB_WEBHOOK_SECRET
+        if not secret:
+            return HttpResponseForbidden('Webhooks are disabled')
+
+        signature = request.headers.get('X-Hub-Signature-256', '')
+        expected_signature = 'sha256=' + hmac.new(secret.encode(), request.body, hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(signature, expected_signature):
+            return HttpResponseForbidden('Invalid signature')
+
+        event = request.headers.get('X-GitHub-Event', 'push')
+        if event == 'ping':
+            return JsonResponse({'status': 'pong'})
+        if event != 'push':
+            return JsonResponse({'status': 'ignored', 'event': event})
+
+        try:
+            if request.content_type == 'application/x-www-form-urlencoded':
+                payload = json.loads(request.POST.get('payload', ''))
+            else:
+                payload = json.loads(request.body)
+        except ValueError:
+            return HttpResponseBadRequest('Invalid payload')
+        if payload.get('deleted'):
+            return JsonResponse({'status': 'ignored', 'reason': 'deleted ref'})
+
+        urls = self.get_repository_urls(payload.get('repository') or {})
+        project = self.model.objects.filter(url__in=urls).first()
+        if not project:
+            raise Http404
+        if not project.is_ready:
+            # The commits pushed during the clone are found by the polling once the project is ready
+            return JsonResponse({'status': 'ignored', 'reason': f'project is {project.provisioning_state}'})
+
+        job = enqueue_fetch_and_deploy_project(project.pk, AIDeploymentTrigger.WEBHOOK)
+        if not job:
+            return JsonResponse({'status': 'pending', 'project_id': project.pk}, status=202)
+        logging.info(f"Push to {payload.get('ref')} of the project {project.name}, queued the job {job.id}")
+        return JsonResponse({'status': 'queued', 'project_id': project.pk, 'job_id': job.id}, status=202)
+
+    def get_repository_urls(self, repository):
+        """
+        Build all spellings of the repository URLs the project may be registered with.
+
+        :param repository:
+            the "repository" object of the push payload
+
+        :return:
+            list of URLs
+        """
+        urls = set()
+        for key in self.repository_url_keys:
+            url = repository.get(key)
+            if not url or not isinstance(url, str):
+                continue
+            if '://' not in url and '@' in url and ':' in url:
+                # scp-like SSH URL git@github.com:owner/repo.git
+                user_host, path = url.split(':', 1)
+                url = f'ssh://{user_host}/{path}'
+            url = url.rstrip('/')
+            if url.endswith('.git'):
+                url = url[:-len('.git')]
+            urls.update([url, f'{url}/', f'{url}.git'])
+            url_parts = urisplit(url)
+            if url_parts.scheme == 'ssh' and url_parts.userinfo:
+                # ssh://github.com/owner/repo form without the git@ user
+                url = f'ssh://{url_parts.host}{url_parts.path}'
+                urls.update([url, f'{url}/', f'{url}.git'])
+        return list(urls)
+
+
+class AIMetricsView(View):
+    """
+    The installer metrics in the Prometheus text exposition format.
+
+    When settings.METRICS_TOKEN is set, the scrape must send it in the "Authorization: Bearer" header,
+    otherwise only the loopback clients are served.
+    """
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    @staticmethod
+    def is_loopback(address):
+        try:
+            return ipaddress.ip_address(address or '').is_loopback
+        except ValueError:
+            return False
+
+    def get(self, request):
+        token = settings.METRICS_TOKEN
+        if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponseForbidden('Invalid token')
+        if not token and not self.is_loopback(request.META.get('REMOTE_ADDR')):
+            return HttpResponseForbidden('Set METRICS_TOKEN to scrape the metrics from another host')
+
+        try:
+            text = AIMetricsCollector().render()
+        except redis.RedisError as e:
+            logging.error(f'Error occurred while collecting the metrics: {e}')
+            return HttpResponse(f'Redis is not available: {e}\n', status=503, content_type=self.content_type)
+        return HttpResponse(text, content_type=self.content_type)
@@ -0,0 +1,76 @@
+from __future__ import unicode_literals
+
+__author__ = 'David Baum'
+
+import logging
+import os
+
+from django.conf import settings
+
+
+class AIWheelhouse(object):
+    """
+    Host-wide directory of wheels shared by the pip installs of all the projects.
+
+    The installs run offline from the wheelhouse first, only the missing wheels are downloaded or built,
+    so installing an already seen set of requirements is bound by I/O instead of compilation.
+    """
+    WHEEL_EXTENSION = '.whl'
+
+    def __init__(self, path=None, disk_budget=None):
+        self.path = os.path.abspath(path or settings.WHEELHOUSE_DIR)
+        self.disk_budget = disk_budget if disk_budget is not None else settings.WHEELHOUSE_DISK_BUDGET
+        os.makedirs(self.path, exist_ok=True)
+
+    def get_install_command(self, pip, requirements_path):
+        """The command installing the requirements from the wheelhouse only."""
+        return [*pip, 'install', '--no-index', '--find-links', self.path, '-r', requirements_path]
+
+    def get_wheel_command(self, pip, requirements_path):
+        """The command adding the missing wheels of the requirements to the wheelhouse."""
+        return [*pip, 'wheel', '--wheel-dir', self.path, '--find-links', self.path, '-r', requirements_path]
+
+    def get_wheels(self):
+        """
+        :return:
+            list of (last used timestamp, size, wheel path)
+        """
+        wheels = []
+        for entry in os.scandir(self.path):
+            if entry.is_file() and entry.name.endswith(self.WHEEL_EXTENSION):
+                stat = entry.stat()
+                wheels.append((max(stat.st_atime, stat.st_mtime), stat.st_size, entry.path))
+        return wheels
+
+    def get_size(self):
+        """
+        :return:
+            (number of wheels, total size in bytes)
+        """
+        wheels = self.get_wheels()
+        return len(wheels), sum(size for _, size, _ in wheels)
+
+    def prune(self, disk_budget=None):
+        """
+        Remove the least recently used wheels until the wheelhouse fits the budget.
+
+        :return:
+            list of the removed wheel paths
+        """
+        disk_budget = self.disk_budget if disk_budget is None else disk_budget
+        wheels = sorted(self.get_wheels())
+        total_size = sum(size for _, size, _ in wheels)
+        removed = []
+        for last_used, size, wheel_path in wheels:
+            if total_size <= disk_budget:
+                break
+            try:
+                os.unlink(wheel_path)
+            except OSError as e:
+                logging.error(f'Error occurred while removing the wheel {wheel_path}: {e}')
+                continue
+            total_size -= size
+            removed.append(wheel_path)
+        if removed:
+            logging.info(f'Pruned {len(removed)} wheels from {self.path}')
+        return removed
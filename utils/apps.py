@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class UtilsConfig(AppConfig):
@@ -8,5 +9,8 @@ class UtilsConfig(AppConfig):
     def ready(self):
         from utils.jobs.scheduler import AITasksScheduler
         tasks_scheduler = AITasksScheduler()
-        tasks_scheduler.check_new_commits()
+        tasks_scheduler.check_new_commits(interval=settings.CHECK_NEW_COMMITS_INTERVAL)
         tasks_scheduler.check_running_projects()
+        tasks_scheduler.rotate_logs(interval=settings.LOG_ROTATE_CHECK_INTERVAL)
+        tasks_scheduler.analyze_logs(interval=settings.LOG_ANALYSIS_INTERVAL)
+        tasks_scheduler.gc_git_repos(interval=settings.GIT_GC_INTERVAL)
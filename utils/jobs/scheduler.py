@@ -2,51 +2,269 @@ from __future__ import unicode_literals
 
 __author__ = 'David Baum'
 
-import django_rq, logging
+import copy, django_rq, logging, os, redis, traceback
 from datetime import datetime
 
 from django.core.paginator import Paginator
+from git import GitCommandError
 
+from github.analytics import AIAccessLogAnalyzer
+from github.deployments import AIDeploymentTrigger
+from github.fetch import AIConcurrentFetcher
+from github.liveness import get_listening_ports_snapshot
+from github.metrics import AIMetricsStore, LOG_SIZE, measure_cycle
 from github.models import AIGitHubProject
+from github.provisioning import AIProvisioningState, AICloneProgress, AIProjectNotReadyError
+from github.references import AIReferenceRepo
+from github.rotation import AILogRotator
+from github.status import AIProjectStatusCache
+from github.supervisor import AIProcessSupervisor, AIProjectLock, AIProjectLockedError
+from github.tracebacks import AIErrorLogAnalyzer
 from github.utils import AIApplicationRunner, RepoTools
+from utils.rq import enqueue_unique
 
 from scheduler import job
 
+
+def enqueue_fetch_and_deploy_project(project_id, trigger=AIDeploymentTrigger.SCHEDULER):
+    return enqueue_unique('default', fetch_and_deploy_project_task, f'fetch-and-deploy-project-{project_id}',
+                          project_id, trigger)
+
+
+def enqueue_check_project_running(project_id, trigger=AIDeploymentTrigger.HEALTH):
+    return enqueue_unique('default', check_project_running_task, f'check-project-running-{project_id}',
+                          project_id, trigger)
+
+
+def enqueue_clone_project(project_id, previous_url=None):
+    return enqueue_unique('default', clone_project_task, f'clone-project-{project_id}', project_id, previous_url)
+
+
+def remove_previous_checkout(project, previous_url):
+    """
+    Stop the application started from the checkout of the previous URL of the project and remove the checkout.
+
+    :return:
+    """
+    previous_project = copy.copy(project)
+    previous_project.url = previous_url
+    repo_tools = RepoTools(previous_project)
+    if repo_tools.local_dir == RepoTools(project).local_dir or not os.path.exists(repo_tools.local_dir):
+        return
+    if AIGitHubProject.objects.exclude(pk=project.pk).filter(url=previous_url).exists():
+        # Another project still runs from the checkout
+        return
+    logging.info(f"Removing the checkout {repo_tools.local_dir} of the previous URL of the project {project.name}")
+    pid_path = os.path.join(repo_tools.local_dir, AIApplicationRunner.PID_FILE)
+    AIProcessSupervisor(project, pid_path).stop()
+    repo_tools.delete_repo()
+
+
+@job
+def clone_project_task(project_id, previous_url=None):
+    """
+    :param previous_url:
+        the URL the project was cloned from before the URL was changed, its checkout is removed after the clone
+    """
+    logging.info(f"Cloning the project {project_id}")
+
+    project = AIGitHubProject.objects.filter(pk=project_id).first()
+    if not project:
+        return
+
+    project.is_cleaned = True
+    project.last_error = None
+    project.provisioning_state = AIProvisioningState.CLONING
+    AIGitHubProject.objects.filter(pk=project_id).update(provisioning_state=project.provisioning_state,
+                                                         last_error=None)
+    progress = AICloneProgress(project_id)
+    progress.start()
+
+    repo_tools = RepoTools(project, progress=progress)
+    is_cloned_before = os.path.exists(repo_tools.local_dir)
+    try:
+        with AIProjectLock(project_id):
+            repo_tools.pygit2_clone_repo()
+    except Exception:
+        project.last_error = "\n".join(traceback.format_exc().splitlines())
+        logging.error(f"Error occurred while cloning the project {project.name}: {project.last_error}")
+
+    if project.last_error:
+        if not is_cloned_before:
+            # The next attempt clones from scratch instead of fetching into the broken repo
+            repo_tools.delete_repo()
+        project.provisioning_state = AIProvisioningState.FAILED
+        AIGitHubProject.objects.filter(pk=project_id).update(provisioning_state=project.provisioning_state,
+                                                             last_error=project.last_error)
+        progress.finish(project.provisioning_state, project.last_error)
+        return
+
+    if previous_url:
+        try:
+            with AIProjectLock(project_id):
+                remove_previous_checkout(project, previous_url)
+        except (OSError, AIProjectLockedError) as e:
+            logging.error(f"Error occurred while removing the previous checkout of the project {project.name}: {e}")
+
+    project.provisioning_state = AIProvisioningState.READY
+    AIGitHubProject.objects.filter(pk=project_id).update(provisioning_state=project.provisioning_state,
+                                                         last_commit=project.last_commit)
+    progress.finish(project.provisioning_state)
+    enqueue_check_project_running(project_id, AIDeploymentTrigger.PROVISIONING)
+
+
 @job
+@measure_cycle('check_new_commits')
 def check_new_commits_task():
     logging.info("Running checking new commits task")
 
-    queryset = AIGitHubProject.objects.all().order_by('id')
+    queryset = AIGitHubProject.objects.filter(provisioning_state=AIProvisioningState.READY).order_by('id')
     paginator = Paginator(queryset, 200)
 
     for page_number in paginator.page_range:
         page = paginator.page(page_number)
 
-        for obj in page.object_list:
-            last_commit = obj.last_commit
-            obj.is_cleaned = True
-            repo_tools = RepoTools(obj)
-            repo_tools.git_fetch()
-            saved_instance = AIGitHubProject.objects.filter(pk=obj.pk).first()
-            if saved_instance and last_commit != saved_instance.last_commit:
-                AIApplicationRunner(saved_instance).run()
+        results = AIConcurrentFetcher().probe(page.object_list)
+        for result in results:
+            if result.has_remote_changes:
+                enqueue_fetch_and_deploy_project(result.project.pk)
 
 
 @job
+def fetch_and_deploy_project_task(project_id, trigger=AIDeploymentTrigger.SCHEDULER):
+    logging.info(f"Fetching and deploying the project {project_id}")
+
+    project = AIGitHubProject.objects.filter(pk=project_id).first()
+    if not project or not project.is_ready:
+        return
+
+    # The health restart, the admin and the next copy of this job wait, the fetch sees the pushes made meanwhile
+    with AIProjectLock(project_id):
+        results = AIConcurrentFetcher().fetch([project])
+        if results[0].is_changed:
+            AIApplicationRunner(project).deploy(results[0].previous_commit, trigger=trigger)
+
+
+@job
+@measure_cycle('check_running_projects')
 def check_running_projects_task():
     logging.info("Running checking the projects are running")
 
-    queryset = AIGitHubProject.objects.all().order_by('id')
+    queryset = AIGitHubProject.objects.filter(provisioning_state=AIProvisioningState.READY).order_by('id').only(
+        'id', 'port', 'last_commit', 'last_error')
+    paginator = Paginator(queryset, 200)
+    snapshot = get_listening_ports_snapshot(max_age=0)
+    status_cache = AIProjectStatusCache()
+
+    for page_number in paginator.page_range:
+        page = paginator.page(page_number)
+
+        statuses = status_cache.refresh(page.object_list, snapshot=snapshot)
+        for project_id, status in statuses.items():
+            if not status.is_running:
+                enqueue_check_project_running(project_id)
+
+
+@job
+def check_project_running_task(project_id, trigger=AIDeploymentTrigger.HEALTH):
+    project = AIGitHubProject.objects.filter(pk=project_id).first()
+    if not project or not project.is_ready:
+        return
+
+    project.is_cleaned = True
+    try:
+        runner = AIApplicationRunner(project)
+    except AIProjectNotReadyError:
+        # The repo of the ready project was removed, e.g. by hand, it is cloned again
+        logging.warning(f"The repo of the project {project.name} is missing, cloning it again")
+        AIGitHubProject.objects.filter(pk=project_id).update(provisioning_state=AIProvisioningState.PENDING)
+        enqueue_clone_project(project_id)
+        return
+    try:
+        with AIProjectLock(project_id, blocking_timeout=0):
+            if not runner.is_application_running():
+                logging.info(f"The project {project.name} is not running, starting it")
+                runner.run(trigger=trigger)
+    except AIProjectLockedError:
+        # The deploy or the admin starts the application anyway
+        logging.info(f"The project {project.name} is being changed, skipping the health restart")
+
+
+@job
+@measure_cycle('rotate_logs')
+def rotate_logs_task():
+    logging.info("Running rotating the project logs")
+
+    queryset = AIGitHubProject.objects.filter(provisioning_state=AIProvisioningState.READY).order_by('id')
+    paginator = Paginator(queryset, 200)
+    log_sizes = []
+
+    for page_number in paginator.page_range:
+        page = paginator.page(page_number)
+
+        for project in page.object_list:
+            try:
+                rotator = AILogRotator(AIApplicationRunner(project))
+                rotator.rotate_if_needed()
+            except (OSError, AIProjectNotReadyError) as e:
+                logging.error(f"Error occurred while rotating the logs of the project {project.name}: {e}")
+                continue
+            for log_path in rotator.log_paths:
+                if os.path.exists(log_path):
+                    log_sizes.append(({'project_id': project.pk, 'project': project.name,
+                                       'log': os.path.basename(log_path)}, os.path.getsize(log_path)))
+
+    # The /metrics scrape reads the sizes measured here instead of walking the project dirs
+    AIMetricsStore().set_gauges(LOG_SIZE, log_sizes, replace=True)
+
+
+@job
+@measure_cycle('analyze_logs')
+def analyze_logs_task():
+    logging.info("Running analyzing the new lines of the project logs")
+
+    queryset = AIGitHubProject.objects.filter(provisioning_state=AIProvisioningState.READY).order_by('id')
     paginator = Paginator(queryset, 200)
 
     for page_number in paginator.page_range:
         page = paginator.page(page_number)
 
-        for obj in page.object_list:
-            obj.is_cleaned = True
-            is_running = AIApplicationRunner(obj).is_application_running()
-            if not is_running:
-                AIApplicationRunner(obj).run()
+        for project in page.object_list:
+            try:
+                runner = AIApplicationRunner(project)
+            except AIProjectNotReadyError as e:
+                # Cloned again since the page was read
+                logging.info(str(e))
+                continue
+            try:
+                AIAccessLogAnalyzer(project, runner).analyze()
+            except (OSError, redis.RedisError) as e:
+                logging.error(f"Error occurred while analyzing the access log of the project {project.name}: {e}")
+            try:
+                AIErrorLogAnalyzer(project, runner).analyze()
+            except (OSError, redis.RedisError) as e:
+                logging.error(f"Error occurred while analyzing the error log of the project {project.name}: {e}")
+
+
+@job
+@measure_cycle('gc_git_repos')
+def gc_git_repos_task():
+    logging.info("Running collecting the garbage of the git repos")
+
+    queryset = AIGitHubProject.objects.filter(provisioning_state=AIProvisioningState.READY).order_by('id')
+    paginator = Paginator(queryset, 200)
+
+    for page_number in paginator.page_range:
+        page = paginator.page(page_number)
+
+        for project in page.object_list:
+            RepoTools(project).gc()
+
+    for reference in AIReferenceRepo.get_all():
+        try:
+            reference.gc()
+        except (GitCommandError, OSError) as e:
+            logging.error(f"Error occurred while collecting the garbage of the reference repo {reference.path}: {e}")
 
 
 class AITasksScheduler():
@@ -60,3 +278,12 @@ class AITasksScheduler():
 
     def check_running_projects(self, interval=60):  # every 60 seconds
         self.scheduler.schedule(datetime.utcnow(), check_running_projects_task, interval=interval)
+
+    def rotate_logs(self, interval=300):  # every 5 minutes
+        self.scheduler.schedule(datetime.utcnow(), rotate_logs_task, interval=interval)
+
+    def analyze_logs(self, interval=60):  # every 60 seconds
+        self.scheduler.schedule(datetime.utcnow(), analyze_logs_task, interval=interval)
+
+    def gc_git_repos(self, interval=86400):  # every day
+        self.scheduler.schedule(datetime.utcnow(), gc_git_repos_task, interval=interval)
@@ -0,0 +1,55 @@
+from __future__ import unicode_literals
+
+__author__ = 'David Baum'
+
+import logging, sys
+
+from django.core.management.base import BaseCommand
+
+from github.envs import AIVirtualEnvCache, AIVirtualEnvError
+from github.wheelhouse import AIWheelhouse
+
+
+class Command(BaseCommand):
+    help = "Add the wheels of the requirements files to the shared wheelhouse and report its size"
+
+    def add_arguments(self, parser):
+        parser.add_argument("requirements", nargs="*", type=str, help="Paths to requirements.txt files")
+        parser.add_argument("--prune", action="store_true", help="Prune the wheelhouse to its disk budget")
+        parser.add_argument('-l',
+                            '--level',
+                            type=str,
+                            dest="level",
+                            help="Specify the level of logging",
+                            default="INFO"
+                            )
+
+    def handle(self, *args, **options):
+        level_logging = options['level']
+
+        root = logging.getLogger(__name__)
+        root.setLevel(logging.getLevelName(level_logging))
+
+        ch = logging.StreamHandler(sys.stdout)
+        ch.setLevel(logging.getLevelName(level_logging))
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        ch.setFormatter(formatter)
+        root.addHandler(ch)
+
+        wheelhouse = AIWheelhouse()
+        env_cache = AIVirtualEnvCache()
+        # The wheels must match the interpreter the project envs are created with
+        pip = ['python3', '-m', 'pip']
+        for requirements_path in options['requirements']:
+            try:
+                env_cache.run_command(wheelhouse.get_wheel_command(pip, requirements_path))
+                root.info(f'Added the wheels of {requirements_path}')
+            except AIVirtualEnvError as e:
+                root.error(f'Failed adding the wheels of {requirements_path}: {e}')
+
+        if options['prune']:
+            wheelhouse.prune()
+
+        wheels_number, size = wheelhouse.get_size()
+        self.stdout.write(f'{wheelhouse.path}: {wheels_number} wheels, {size / 1024 ** 2:.1f} MB '
+                          f'of {wheelhouse.disk_budget / 1024 ** 2:.1f} MB budget')
@@ -4,6 +4,9 @@ __author__ = 'David Baum'
 
 import django_rq, logging
 
+from redis.exceptions import LockError
+from rq.exceptions import NoSuchJobError
+from rq.job import Job, JobStatus
 from rq.registry import (
     DeferredJobRegistry,
     FailedJobRegistry,
@@ -14,6 +17,10 @@ from rq.registry import (
 
 logger = logging.getLogger(__name__)
 
+ENQUEUE_LOCK_PREFIX = 'arielinstaller:enqueue-lock'
+# Seconds the enqueue of a unique job may hold its lock, the check and the enqueue take a few Redis round-trips
+ENQUEUE_LOCK_TIMEOUT = 10
+
 
 def clean_queue(queue_name):
     queue = django_rq.get_queue(queue_name)
@@ -45,3 +52,52 @@ def clean_queue(queue_name):
         logging.info(f'Removed job {job_id} from RQ queue {queue.name}')
 
     logging.info(f'The RQ queue "{queue.name}" has been successfully flushed')
+
+
+def get_job_status(job_id, connection):
+    try:
+        return Job.fetch(job_id, connection=connection).get_status(refresh=False)
+    except NoSuchJobError:
+        return None
+
+
+def enqueue_unique(queue_name, func, job_id, *args, **kwargs):
+    """
+    Enqueue the job unless the copy of the job is already waiting.
+
+    The running copy may have read its input already, e.g. fetched the repo before the next push, so the job
+    is enqueued again under the "<job id>:next" id to run after it. Two copies never wait at once: the check
+    and the enqueue run under a Redis lock of the job id, so the concurrent calls do not push the same id twice.
+
+    :param job_id:
+        deterministic job id, e.g. "deploy-project-<id>"
+
+    :return:
+        the enqueued job or None if the copy of the job is pending
+    """
+    queue = django_rq.get_queue(queue_name)
+    lock = queue.connection.lock(f'{ENQUEUE_LOCK_PREFIX}:{job_id}', timeout=ENQUEUE_LOCK_TIMEOUT)
+    if not lock.acquire(blocking_timeout=ENQUEUE_LOCK_TIMEOUT):
+        # The concurrent call has been enqueuing the job for too long, the copy it enqueues serves this one too
+        logging.info(f'The job {job_id} is being enqueued by another call, skipping it')
+        return None
+    try:
+        pending_statuses = (JobStatus.QUEUED, JobStatus.DEFERRED, JobStatus.SCHEDULED)
+        job_ids = (job_id, f'{job_id}:next')
+        statuses = [get_job_status(copy_id, queue.connection) for copy_id in job_ids]
+
+        if any(status in pending_statuses for status in statuses):
+            logging.info(f'The job {job_id} is already waiting, skipping it')
+            return None
+        free_job_ids = [copy_id for copy_id, status in zip(job_ids, statuses) if status != JobStatus.STARTED]
+        if not free_job_ids:
+            # The second copy waits for the first one to finish and reads the input after it
+            logging.info(f'The job {job_id} and its next copy are already started, skipping it')
+            return None
+        return queue.enqueue(func, *args, job_id=free_job_ids[0], **kwargs)
+    finally:
+        try:
+            lock.release()
+        except LockError as e:
+            # Expired, the next call enqueues on its own
+            logging.error(f'Error occurred while unlocking the enqueue of the job {job_id}: {e}')